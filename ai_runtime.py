@@ -0,0 +1,64 @@
+# 檔案：ai_runtime.py
+# 說明：AI 系統（Gemini LLM、嵌入模型與 LangChain / Chroma 模組）的延遲初始化。
+#       匯入 main.py 時不載入這些重量級模組，改在背景暖機或第一次使用時才初始化，
+#       讓 /healthz、/api/chapters 等端點在啟動後立即可用。
+
+import os
+import threading
+import time
+
+# 啟動時是否在背景執行緒預先初始化 AI 系統（設為 0 則完全延遲到第一次使用）
+AI_WARMUP_ON_STARTUP = os.environ.get("AI_WARMUP_ON_STARTUP", "1") == "1"
+
+NOT_STARTED, LOADING, READY, FAILED = "not_started", "loading", "ready", "failed"
+
+_lock = threading.Lock()
+_state = {"status": NOT_STARTED, "error": None, "load_seconds": None}
+
+# 初始化完成後才會有值（皆已包裝 llm_client 的韌性呼叫層）
+llm = None
+embeddings = None
+
+
+def initialize() -> bool:
+    """初始化 LLM 與嵌入模型並預先載入 RAG 相關模組；可重複呼叫，回傳是否可用。"""
+    global llm, embeddings
+    with _lock:
+        if _state["status"] == READY:
+            return True
+        _state["status"] = LOADING
+        start = time.perf_counter()
+        try:
+            from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+            from llm_client import ResilientChatModel, ResilientEmbeddings
+
+            # 以韌性呼叫層包裝：每次呼叫都有期限、重試與斷路器
+            llm = ResilientChatModel(ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.3, convert_system_message_to_human=True))
+            embeddings = ResilientEmbeddings(GoogleGenerativeAIEmbeddings(model="models/embedding-001"))
+
+            # 預先載入 Agent / Chroma 相關模組，避免第一個請求承擔匯入時間
+            import rag_service  # noqa: F401
+
+            _state.update(status=READY, error=None)
+            print(f"AI 系統初始化成功 ({time.perf_counter() - start:.2f} 秒)")
+        except Exception as e:
+            _state.update(status=FAILED, error=str(e))
+            print(f"無法初始化 AI 系統: {e}")
+        finally:
+            _state["load_seconds"] = round(time.perf_counter() - start, 3)
+        return _state["status"] == READY
+
+
+def start_background_warmup() -> threading.Thread:
+    """在背景執行緒初始化 AI 系統，不阻塞伺服器啟動。"""
+    thread = threading.Thread(target=initialize, name="ai-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def is_ready() -> bool:
+    return _state["status"] == READY
+
+
+def status() -> dict:
+    return dict(_state)
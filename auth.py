@@ -2,6 +2,8 @@
 # 說明：處理所有驗證相關的邏輯，包括 JWT 的建立與驗證。
 
 import os
+import hashlib
+import time
 from datetime import datetime, timedelta, timezone
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -10,6 +12,7 @@ from sqlalchemy.orm import Session
 from dotenv import load_dotenv, dotenv_values
 from pathlib import Path
 import crud, models
+from cache import cache
 from database import SessionLocal
 
 # 載入環境變數（明確指定專案根目錄 .env 檔案）
@@ -27,6 +30,9 @@ if not os.environ.get("SECRET_KEY"):
 SECRET_KEY = os.environ["SECRET_KEY"]
 ALGORITHM = os.environ.get("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+# 已驗證權杖的快取秒數（省去每個請求的 JWT 解碼與使用者查詢；0 = 停用）
+AUTH_CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", "60"))
+USER_FIELDS = ("id", "email", "name", "picture", "role")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -50,6 +56,16 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         detail="無法驗證憑證",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    token_key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    try:
+        # 只用來決定快取的命名空間：偽造的權杖雜湊不會出現在快取中，命中前仍須曾經通過下方的驗證
+        namespace = crud.auth_cache_namespace(jwt.get_unverified_claims(token).get("sub") or "")
+    except JWTError:
+        raise credentials_exception
+    cached = cache.get(namespace, token_key)
+    if cached is not None:
+        # 未附加到 session 的使用者物件，只提供欄位值（端點只使用 id / role 等欄位）
+        return models.User(**cached)
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -60,6 +76,9 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     user = crud.get_user_by_email(db, email=email)
     if user is None:
         raise credentials_exception
+    # 快取不超過權杖的剩餘效期；使用者資料變更時由 crud 只清除該使用者的命名空間
+    ttl = min(AUTH_CACHE_TTL, payload.get("exp", 0) - time.time())
+    cache.set(namespace, token_key, {f: getattr(user, f) for f in USER_FIELDS}, ttl=ttl)
     return user
 
 async def get_current_admin_user(current_user: models.User = Depends(get_current_user)):
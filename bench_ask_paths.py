@@ -0,0 +1,46 @@
+# 檔案：bench_ask_paths.py
+# 說明：對執行中的伺服器送出一批問題，依回應中的 path（fast/agent）統計延遲分布。
+#       用法：ACCESS_TOKEN=<JWT> python bench_ask_paths.py chapter1 [重複次數]
+
+import os
+import sys
+import time
+import statistics
+import requests
+
+BASE_URL = os.environ.get("API_BASE_URL", "http://127.0.0.1:8000")
+QUESTIONS = [
+    "什麼是機器學習？",
+    "監督式學習和非監督式學習有什麼不同？",
+    "什麼是過擬合？如何避免？",
+    "最新版本的 PyTorch 有哪些新功能？",
+    "今年有哪些重要的 AI 研討會？",
+]
+
+def main():
+    chapter = sys.argv[1] if len(sys.argv) > 1 else "chapter1"
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    headers = {"Authorization": f"Bearer {os.environ.get('ACCESS_TOKEN', '')}"}
+    latencies = {}
+
+    for _ in range(repeat):
+        for question in QUESTIONS:
+            start = time.perf_counter()
+            response = requests.post(f"{BASE_URL}/api/ask", params={"chapter": chapter}, json={"question": question}, headers=headers)
+            elapsed = time.perf_counter() - start
+            if response.status_code != 200:
+                print(f"錯誤 {response.status_code}: {response.text[:200]}")
+                continue
+            path = response.json().get("path", "unknown")
+            latencies.setdefault(path, []).append(elapsed)
+            print(f"[{path:5}] {elapsed * 1000:8.1f} ms  {question}")
+
+    print("\n路徑延遲統計：")
+    for path, values in sorted(latencies.items()):
+        values.sort()
+        p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+        print(f"  {path:5}: n={len(values):3d}  平均 {statistics.mean(values) * 1000:8.1f} ms  "
+              f"中位數 {statistics.median(values) * 1000:8.1f} ms  p95 {p95 * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# 檔案：bench_list_responses.py
+# 說明：比較 1000 筆列表回應在 FastAPI 預設路徑（response_model 驗證 + 標準 json）與
+#       fast_response（orjson、欄位選擇、gzip / brotli 壓縮）下的序列化時間與回應大小。
+#       使用記憶體中的模擬資料，不需要資料庫或伺服器。
+#       用法：python bench_list_responses.py [--rows 1000] [--repeat 20]
+
+import argparse
+import asyncio
+import gzip
+import statistics
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+import fast_response
+import schemas
+
+ANSWER = "這是一段模擬的 AI 回答，說明梯度下降法如何依損失函數的梯度更新參數，並比較批次與隨機梯度下降的差異。" * 12
+
+
+def fake_query_logs(n: int):
+    user = SimpleNamespace(id=1, email="student@example.com", name="學生", role="user")
+    now = datetime.now(timezone.utc)
+    return [SimpleNamespace(id=i, user=user, question=f"[chapter1] 第 {i} 個問題：什麼是梯度下降？", answer=ANSWER, created_at=now) for i in range(n)]
+
+
+def fake_quiz_attempts(n: int):
+    now = datetime.now(timezone.utc)
+    def question(i, j):
+        choices = [SimpleNamespace(id=i * 100 + j * 10 + c, choice_text=f"選項 {c}：關於過擬合的敘述") for c in range(4)]
+        return SimpleNamespace(id=i * 10 + j, question_text=f"第 {j} 題：下列何者可以降低過擬合？", choices=choices,
+                               correct_answer_index=1, user_answer_index=j % 4, is_correct="correct" if j % 4 == 1 else "incorrect")
+    return [SimpleNamespace(id=i, topic="chapter1 - 過擬合", score=66.7, created_at=now, questions=[question(i, j) for j in range(3)]) for i in range(n)]
+
+
+def baseline(rows, schema) -> bytes:
+    """FastAPI 預設：serialize_response（response_model）後以 JSONResponse 輸出。"""
+    field = create_response_field(name="response", type_=List[schema], mode="serialization")
+    content = asyncio.run(serialize_response(field=field, response_content=rows))
+    return JSONResponse(content).body
+
+
+def timed(fn, repeat: int):
+    samples, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000, result
+
+
+def bench(name, rows, schema, omit, repeat):
+    print(f"\n{name}（{len(rows)} 筆）")
+    print(f"  {'方式':34s} {'時間 ms':>9s} {'大小 KB':>9s}")
+    base_ms, base_body = timed(lambda: baseline(rows, schema), repeat)
+    print(f"  {'FastAPI 預設 (json)':34s} {base_ms:9.1f} {len(base_body) / 1024:9.1f}")
+    fast_ms, body = timed(lambda: fast_response.serialize_rows(rows, schema), repeat)
+    print(f"  {'orjson':34s} {fast_ms:9.1f} {len(body) / 1024:9.1f}")
+    include = fast_response.select_fields(schema, exclude=omit)
+    lean_ms, lean = timed(lambda: fast_response.serialize_rows(rows, schema, include), repeat)
+    print(f"  {'orjson + exclude=' + omit:34s} {lean_ms:9.1f} {len(lean) / 1024:9.1f}")
+    gz_ms, gz = timed(lambda: gzip.compress(body, compresslevel=fast_response.GZIP_LEVEL), repeat)
+    print(f"  {'  + gzip（壓縮時間）':34s} {gz_ms:9.1f} {len(gz) / 1024:9.1f}")
+    if fast_response.brotli is not None:
+        br_ms, br = timed(lambda: fast_response.brotli.compress(body, quality=fast_response.BROTLI_QUALITY), repeat)
+        print(f"  {'  + brotli（壓縮時間）':34s} {br_ms:9.1f} {len(br) / 1024:9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="列表回應序列化與壓縮的效能比較")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    print(f"orjson：{'已安裝' if fast_response.orjson else '未安裝（使用標準 json）'}，brotli：{'已安裝' if fast_response.brotli else '未安裝'}")
+    bench("提問紀錄 RAGQueryLogSchema", fake_query_logs(args.rows), schemas.RAGQueryLogSchema, "answer", args.repeat)
+    bench("測驗歷史 QuizResultSchema", fake_quiz_attempts(args.rows), schemas.QuizResultSchema, "questions", args.repeat)
+
+
+if __name__ == "__main__":
+    main()
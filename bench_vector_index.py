@@ -0,0 +1,119 @@
+# 檔案：bench_vector_index.py
+# 說明：比較 Chroma（HNSW）與 NumPy 索引（float32 / float16 / int8）在不同章節大小下的
+#       查詢延遲、記憶體（磁碟大小與載入後的 RSS 增量）與 recall@k，作為 VECTOR_BACKEND=auto 門檻的依據。
+#       使用叢集化的合成向量（不呼叫嵌入 API），只量測向量檢索本身。
+#       用法：python bench_vector_index.py [--sizes 1000,5000,20000,50000] [--dim 768] [--queries 200] [--k 6]
+
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+import vector_index
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+
+
+def dir_mb(path: str) -> float:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files) / 1e6
+
+
+def synthetic(n: int, dim: int, queries: int, seed: int = 0):
+    """模擬課程嵌入：向量集中在少數主題附近，查詢也來自同樣的主題。"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(8, n // 200), dim)).astype(np.float32)
+    data = centers[rng.integers(len(centers), size=n)] + 0.35 * rng.normal(size=(n, dim)).astype(np.float32)
+    query = centers[rng.integers(len(centers), size=queries)] + 0.35 * rng.normal(size=(queries, dim)).astype(np.float32)
+    normalize = lambda m: m / np.linalg.norm(m, axis=1, keepdims=True)  # noqa: E731
+    return normalize(data).astype(np.float32), normalize(query).astype(np.float32)
+
+
+def exact_top_k(data: np.ndarray, queries: np.ndarray, k: int):
+    distances = (data ** 2).sum(axis=1)[None, :] - 2.0 * queries @ data.T
+    return [set(np.argsort(row)[:k].tolist()) for row in distances]
+
+
+def measure(search, queries, truth, k):
+    latencies, hits = [], 0
+    for q, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = search(q, k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(expected & set(found))
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "recall": hits / (len(truth) * k),
+    }
+
+
+def bench_numpy(workdir, data, queries, truth, k, dtype):
+    root = os.path.join(workdir, f"numpy-{dtype}")
+    documents = [{"page_content": f"chunk {i}", "metadata": {}} for i in range(len(data))]
+    vector_index.write_index("bench", data, documents, index_root=root, dtype=dtype)
+    before = rss_mb()
+    index = vector_index.NumpyChapterIndex.load("bench", index_root=root)
+    result = measure(lambda q, k: [i for i, _ in index.search(q, k)], queries, truth, k)
+    result.update(disk_mb=dir_mb(root), rss_mb=rss_mb() - before)
+    return result
+
+
+def bench_chroma(workdir, data, queries, truth, k):
+    import chromadb
+
+    path = os.path.join(workdir, "chroma")
+    collection = chromadb.PersistentClient(path=path).get_or_create_collection(vector_index.CHROMA_COLLECTION)
+    batch = 5000
+    for start in range(0, len(data), batch):
+        rows = data[start:start + batch]
+        collection.add(
+            ids=[str(i) for i in range(start, start + len(rows))],
+            embeddings=rows.tolist(),
+            documents=[f"chunk {i}" for i in range(start, start + len(rows))],
+        )
+    before = rss_mb()
+    # 重新開啟，模擬 API 行程載入既有的索引
+    chromadb.api.client.SharedSystemClient.clear_system_cache()
+    collection = chromadb.PersistentClient(path=path).get_collection(vector_index.CHROMA_COLLECTION)
+
+    def search(q, k):
+        return [int(i) for i in collection.query(query_embeddings=[q.tolist()], n_results=k, include=[])["ids"][0]]
+
+    result = measure(search, queries, truth, k)
+    result.update(disk_mb=dir_mb(path), rss_mb=rss_mb() - before)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比較 Chroma 與 NumPy 向量索引")
+    parser.add_argument("--sizes", default="1000,5000,20000,50000")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=6)
+    args = parser.parse_args()
+
+    print(f"{'向量數':>8s} {'後端':16s} {'p50 ms':>8s} {'p95 ms':>8s} {'recall':>7s} {'磁碟 MB':>8s} {'RSS Δ MB':>9s}")
+    for n in (int(s) for s in args.sizes.split(",")):
+        data, queries = synthetic(n, args.dim, args.queries)
+        truth = exact_top_k(data, queries, args.k)
+        workdir = tempfile.mkdtemp(prefix="bench-vector-")
+        try:
+            results = {f"numpy-{dtype}": bench_numpy(workdir, data, queries, truth, args.k, dtype) for dtype in vector_index.DTYPES}
+            results["chroma"] = bench_chroma(workdir, data, queries, truth, args.k)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        for name, r in results.items():
+            print(f"{n:8d} {name:16s} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['recall']:7.3f} {r['disk_mb']:8.1f} {r['rss_mb']:9.1f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
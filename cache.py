@@ -0,0 +1,306 @@
+# 檔案：cache.py
+# 說明：可抽換的快取層，讓多個 worker / 多台主機共用快取。
+#       後端：memory（行程內 LRU）、sqlite（同一台主機的 worker 共用的本機檔案）、redis（跨主機）。
+#       以命名空間區分用途（例如 answers:<章節>），支援 TTL、整個命名空間（含子命名空間）失效與命中統計。
+#       值以 JSON 儲存，只能快取可序列化的資料；快取後端故障時視為未命中，不影響請求。
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, Optional
+
+from metrics import metrics
+
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory")
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "10000"))
+CACHE_DEFAULT_TTL = float(os.environ.get("CACHE_DEFAULT_TTL", "300"))
+CACHE_SQLITE_PATH = os.environ.get("CACHE_SQLITE_PATH", "cache.db")
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_REDIS_TIMEOUT = float(os.environ.get("CACHE_REDIS_TIMEOUT", "0.5"))
+# 多個應用共用同一個 Redis 時區分鍵值
+CACHE_KEY_PREFIX = os.environ.get("CACHE_KEY_PREFIX", "vta:")
+
+# 過長的鍵（例如完整問題）以雜湊縮短
+MAX_KEY_LENGTH = 200
+
+
+def _in_namespace(entry_ns: str, namespace: str) -> bool:
+    return entry_ns == namespace or entry_ns.startswith(namespace + ":")
+
+
+class MemoryCache:
+    """行程內 LRU；只在單一 worker 內有效，適合開發與單行程部署。"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[(namespace, key)]
+                return None
+            self._entries.move_to_end((namespace, key))
+            return value
+
+    def set(self, namespace: str, key: str, value: str, ttl: Optional[float]):
+        with self._lock:
+            self._entries[(namespace, key)] = (time.time() + ttl if ttl else None, value)
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._entries.pop((namespace, key), None)
+
+    def invalidate(self, namespace: str) -> int:
+        with self._lock:
+            doomed = [k for k in self._entries if _in_namespace(k[0], namespace)]
+            for k in doomed:
+                del self._entries[k]
+            return len(doomed)
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """本機 SQLite 檔案（WAL 模式），同一台主機上的所有 worker 共用。"""
+
+    name = "sqlite"
+    # 每寫入多少筆清除一次過期資料
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL,"
+            " PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        conn.close()  # 不保留連線：gunicorn master 建立快取後 fork，各 worker 須自行連線
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] <= time.time():
+            self.delete(namespace, key)
+            return None
+        return row[0]
+
+    def set(self, namespace: str, key: str, value: str, ttl: Optional[float]):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, value, time.time() + ttl if ttl else None),
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self._purge(conn)
+
+    def _purge(self, conn: sqlite3.Connection):
+        conn.execute("DELETE FROM cache_entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        # 超過上限時優先移除最早過期的項目
+        conn.execute(
+            "DELETE FROM cache_entries WHERE (namespace, key) IN ("
+            " SELECT namespace, key FROM cache_entries ORDER BY expires_at IS NULL, expires_at"
+            " LIMIT max(0, (SELECT count(*) FROM cache_entries) - ?))",
+            (self.max_entries,),
+        )
+
+    def delete(self, namespace: str, key: str):
+        self._conn().execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def invalidate(self, namespace: str) -> int:
+        # 子命名空間以 "namespace:" 開頭，用範圍條件（";" 是 ":" 的下一個字元）才能使用主鍵索引
+        cursor = self._conn().execute(
+            "DELETE FROM cache_entries WHERE namespace = ? OR (namespace >= ? AND namespace < ?)",
+            (namespace, namespace + ":", namespace + ";"),
+        )
+        return cursor.rowcount
+
+    def size(self) -> int:
+        return self._conn().execute("SELECT count(*) FROM cache_entries").fetchone()[0]
+
+
+class RedisCache:
+    """Redis（或相容 Redis 協定的伺服器），跨主機共用；需安裝 redis 套件。"""
+
+    name = "redis"
+
+    def __init__(self, url: str = CACHE_REDIS_URL, prefix: str = CACHE_KEY_PREFIX):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis 需要安裝 redis 套件（pip install redis）")
+        # redis-py 的連線池會在 fork 後自動重新連線
+        self.client = redis.Redis.from_url(url, socket_timeout=CACHE_REDIS_TIMEOUT, socket_connect_timeout=CACHE_REDIS_TIMEOUT)
+        self.prefix = prefix
+
+    def _key(self, namespace: str, key: str) -> str:
+        # 以 "|" 分隔命名空間與鍵，子命名空間仍以 ":" 串接
+        return f"{self.prefix}{namespace}|{key}"
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        value = self.client.get(self._key(namespace, key))
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, namespace: str, key: str, value: str, ttl: Optional[float]):
+        self.client.set(self._key(namespace, key), value, px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, namespace: str, key: str):
+        self.client.delete(self._key(namespace, key))
+
+    def invalidate(self, namespace: str) -> int:
+        base = self.prefix + namespace
+        removed = 0
+        for pattern in (_escape_glob(base) + "|*", _escape_glob(base) + ":*"):
+            batch = []
+            for key in self.client.scan_iter(match=pattern, count=500):
+                batch.append(key)
+                if len(batch) >= 500:
+                    removed += self.client.unlink(*batch)
+                    batch = []
+            if batch:
+                removed += self.client.unlink(*batch)
+        return removed
+
+    def size(self) -> int:
+        return sum(1 for _ in self.client.scan_iter(match=_escape_glob(self.prefix) + "*", count=500))
+
+
+def _escape_glob(text: str) -> str:
+    return "".join("\\" + ch if ch in "*?[]\\" else ch for ch in text)
+
+
+class Cache:
+    """
+    各模組使用的快取介面。命名空間可用 ":" 分層（例如 answers:chapter1），
+    invalidate("answers") 會一併清除所有章節。統計以命名空間第一層彙總，且只反映目前的行程。
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0, "sets": 0, "invalidations": 0, "errors": 0})
+
+    def _count(self, namespace: str, field: str, n: int = 1):
+        group = namespace.split(":", 1)[0]
+        with self._lock:
+            self._stats[group][field] += n
+        metrics.incr(f"cache.{group}.{field}", n)
+
+    @staticmethod
+    def _normalize_key(key: Any) -> str:
+        key = key if isinstance(key, str) else json.dumps(key, ensure_ascii=False, sort_keys=True, default=str)
+        if len(key) > MAX_KEY_LENGTH:
+            key = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return key
+
+    def _error(self, namespace: str, action: str, e: Exception):
+        self._count(namespace, "errors")
+        print(f"[cache] {self.backend.name} {action} 失敗（{namespace}）: {e}")
+
+    def get(self, namespace: str, key: Any, default: Any = None) -> Any:
+        try:
+            raw = self.backend.get(namespace, self._normalize_key(key))
+        except Exception as e:
+            self._error(namespace, "get", e)
+            raw = None
+        if raw is None:
+            self._count(namespace, "misses")
+            return default
+        self._count(namespace, "hits")
+        return json.loads(raw)
+
+    def set(self, namespace: str, key: Any, value: Any, ttl: Optional[float] = CACHE_DEFAULT_TTL):
+        """ttl 為秒數；None 表示不過期，0 或負數表示不快取。"""
+        if ttl is not None and ttl <= 0:
+            return
+        try:
+            self.backend.set(namespace, self._normalize_key(key), json.dumps(value, ensure_ascii=False), ttl)
+            self._count(namespace, "sets")
+        except Exception as e:
+            self._error(namespace, "set", e)
+
+    def delete(self, namespace: str, key: Any):
+        try:
+            self.backend.delete(namespace, self._normalize_key(key))
+        except Exception as e:
+            self._error(namespace, "delete", e)
+
+    def invalidate(self, namespace: str) -> int:
+        """清除命名空間及其所有子命名空間，回傳移除的項目數。"""
+        try:
+            removed = self.backend.invalidate(namespace)
+        except Exception as e:
+            self._error(namespace, "invalidate", e)
+            return 0
+        self._count(namespace, "invalidations")
+        return removed
+
+    def get_or_set(self, namespace: str, key: Any, compute: Callable[[], Any], ttl: Optional[float] = CACHE_DEFAULT_TTL) -> Any:
+        value = self.get(namespace, key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.set(namespace, key, value, ttl=ttl)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            namespaces = {ns: dict(s) for ns, s in self._stats.items()}
+        for s in namespaces.values():
+            lookups = s["hits"] + s["misses"]
+            s["hit_rate"] = round(s["hits"] / lookups, 3) if lookups else None
+        try:
+            size = self.backend.size()
+        except Exception:
+            size = None
+        return {"backend": self.backend.name, "pid": os.getpid(), "entries": size, "namespaces": namespaces}
+
+
+def create_backend(name: str = CACHE_BACKEND):
+    if name == "memory":
+        return MemoryCache()
+    if name == "sqlite":
+        return SQLiteCache()
+    if name == "redis":
+        return RedisCache()
+    raise ValueError(f"不支援的快取後端: {name}（可用：memory、sqlite、redis）")
+
+
+# 全域共用的快取
+cache = Cache(create_backend())
@@ -0,0 +1,228 @@
+# 檔案：chapter_registry.py
+# 說明：行程內的章節登錄表。啟動時從資料庫與 chroma_db 資料夾載入，
+#       管理員修改章節時與定期掃描時更新，讓章節列表與查詢不必每次都存取資料庫或檔案系統。
+#       管理員的修改只會立即更新處理該請求的 worker；其他 worker 在定期掃描時比對章節表的版本指紋後重新載入。
+#       index_documents.py 重建章節後會更新 chroma_db/<章節>/.index_stamp，
+#       各 worker 比對戳記後清除該章節的快取答案並通知已開啟的向量資料庫重新載入。
+
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+import crud
+from cache import cache
+from database import SessionLocal
+from metrics import metrics
+
+CHROMA_ROOT = "chroma_db"
+# 定期掃描 chroma_db 的間隔（秒），0 表示停用
+CHAPTER_SCAN_INTERVAL = float(os.environ.get("CHAPTER_SCAN_INTERVAL", "30"))
+# 請求時檢查章節索引戳記的最短間隔（秒）
+CHAPTER_STAMP_CHECK = float(os.environ.get("CHAPTER_STAMP_CHECK", "5"))
+INDEX_STAMP_FILE = ".index_stamp"
+
+
+def read_index_stamp(db_path: str) -> Optional[str]:
+    try:
+        with open(os.path.join(db_path, INDEX_STAMP_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def write_index_stamp(db_path: str) -> str:
+    """章節的向量資料庫重建完成後呼叫；以暫存檔原子地替換，讀取端不會看到寫到一半的內容。"""
+    stamp = f"v{time.time_ns()}"
+    path = os.path.join(db_path, INDEX_STAMP_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(stamp)
+    os.replace(path + ".tmp", path)
+    return stamp
+
+
+@dataclass(frozen=True)
+class ChapterInfo:
+    """資料庫中章節的唯讀快照（欄位對應 schemas.ChapterListItem）。"""
+    id: int
+    name: str
+    display_name: str
+    is_active: int
+
+
+class ChapterRegistry:
+    def __init__(self, chroma_root: str = CHROMA_ROOT):
+        self.chroma_root = chroma_root
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._db_chapters: Dict[str, ChapterInfo] = {}
+        self._indexed: List[str] = []
+        self._managed: List[ChapterInfo] = []
+        self._version = 0
+        self._etag = ""
+        self._scanner: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stamps: Dict[str, Optional[str]] = {}
+        self._stamp_checked: Dict[str, float] = {}
+        self._reindex_listeners: List[Callable[[str], None]] = []
+        self._db_version: Optional[tuple] = None
+
+    # --- 載入與更新 ---
+    def _scan_indexed(self) -> List[str]:
+        if not os.path.exists(self.chroma_root):
+            return []
+        # 以 "." 開頭的是 index_documents.py 建立中或待刪除的資料夾
+        return sorted(d for d in os.listdir(self.chroma_root)
+                      if not d.startswith(".") and os.path.isdir(os.path.join(self.chroma_root, d)))
+
+    def _publish(self, db_chapters: Optional[Dict[str, ChapterInfo]] = None, indexed: Optional[List[str]] = None) -> bool:
+        """替換快照；內容有變動時遞增版本號並重新計算 ETag。"""
+        with self._lock:
+            db_chapters = self._db_chapters if db_chapters is None else db_chapters
+            indexed = self._indexed if indexed is None else indexed
+            if db_chapters == self._db_chapters and indexed == self._indexed and self._loaded:
+                return False
+            self._db_chapters = db_chapters
+            self._indexed = indexed
+            self._managed = sorted((c for c in db_chapters.values() if c.is_active), key=lambda c: c.name)
+            self._version += 1
+            # ETag 以內容雜湊計算，多個 worker 的相同內容會得到相同 ETag
+            digest = hashlib.sha1(json.dumps(
+                [indexed, [asdict(c) for c in sorted(db_chapters.values(), key=lambda c: c.name)]],
+                ensure_ascii=False,
+            ).encode("utf-8")).hexdigest()[:16]
+            self._etag = f'W/"chapters-{digest}"'
+            self._loaded = True
+            return True
+
+    def refresh_from_db(self, db: Session) -> bool:
+        # 先記錄版本再讀取：讀取期間的修改會讓下次比對不一致而再載入一次
+        self._db_version = crud.get_chapters_version(db)
+        chapters = crud.get_all_chapters(db, include_inactive=True)
+        return self._publish(db_chapters={
+            c.name: ChapterInfo(id=c.id, name=c.name, display_name=c.display_name, is_active=c.is_active)
+            for c in chapters
+        })
+
+    def scan_filesystem(self) -> bool:
+        return self._publish(indexed=self._scan_indexed())
+
+    def reload(self, db: Optional[Session] = None):
+        """同時從資料庫與檔案系統重新載入。"""
+        if db is None:
+            with SessionLocal() as session:
+                self.refresh_from_db(session)
+        else:
+            self.refresh_from_db(db)
+        self.scan_filesystem()
+        for name in self._indexed:
+            self._stamps.setdefault(name, read_index_stamp(os.path.join(self.chroma_root, name)))
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.reload()
+
+    # --- 查詢 ---
+    def indexed_chapters(self) -> List[str]:
+        """已建立向量索引的章節名稱（chroma_db 下的資料夾），已排序。"""
+        self._ensure_loaded()
+        return self._indexed
+
+    def managed_chapters(self) -> List[ChapterInfo]:
+        """資料庫中啟用的章節，依名稱排序。"""
+        self._ensure_loaded()
+        return self._managed
+
+    def get(self, name: str) -> Optional[ChapterInfo]:
+        self._ensure_loaded()
+        return self._db_chapters.get(name)
+
+    def index_path(self, name: str) -> Optional[str]:
+        """回傳章節向量索引的路徑；登錄表中沒有時再確認一次檔案系統（新建立的索引）。"""
+        self._ensure_loaded()
+        if name in self._indexed:
+            return os.path.join(self.chroma_root, name)
+        path = os.path.join(self.chroma_root, name)
+        if os.path.isdir(path):
+            self.scan_filesystem()
+            return path
+        return None
+
+    @property
+    def version(self) -> int:
+        self._ensure_loaded()
+        return self._version
+
+    @property
+    def etag(self) -> str:
+        self._ensure_loaded()
+        return self._etag
+
+    # --- 重新索引通知 ---
+    def on_reindex(self, callback: Callable[[str], None]):
+        """註冊章節重新索引後的回呼（例如 rag_service 丟棄已開啟的 Chroma）。"""
+        self._reindex_listeners.append(callback)
+
+    def check_reindexed(self, name: str, force: bool = False) -> bool:
+        """
+        比對章節的索引戳記（每個章節最多每 CHAPTER_STAMP_CHECK 秒讀一次檔案）。
+        與上次不同時清除該章節的快取答案、通知回呼並回傳 True。
+        """
+        if name not in self.indexed_chapters():
+            return False
+        now = time.monotonic()
+        if not force and now - self._stamp_checked.get(name, float("-inf")) < CHAPTER_STAMP_CHECK:
+            return False
+        self._stamp_checked[name] = now
+        stamp = read_index_stamp(os.path.join(self.chroma_root, name))
+        with self._lock:
+            seen = name in self._stamps
+            previous = self._stamps.get(name)
+            self._stamps[name] = stamp
+        if not seen or stamp == previous:
+            return False
+        print(f"[chapters] 行程 {os.getpid()} 偵測到章節 '{name}' 已重新索引（{previous} -> {stamp}）")
+        metrics.incr("chapters.reindex_reloads")
+        cache.invalidate(f"answers:{name}")
+        self.scan_filesystem()
+        for callback in list(self._reindex_listeners):
+            callback(name)
+        return True
+
+    # --- 定期掃描 ---
+    def check_db(self) -> bool:
+        """章節表的版本指紋與上次載入時不同（其他 worker 修改了章節）時重新載入。"""
+        with SessionLocal() as session:
+            if crud.get_chapters_version(session) == self._db_version:
+                return False
+            return self.refresh_from_db(session)
+
+    def _scan_loop(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.check_db()
+                self.scan_filesystem()
+                for name in self._indexed:
+                    self.check_reindexed(name, force=True)
+            except Exception as e:
+                print(f"章節索引掃描失敗: {e}")
+
+    def start_periodic_scan(self, interval: float = CHAPTER_SCAN_INTERVAL):
+        if interval <= 0 or self._scanner is not None:
+            return
+        self._stop.clear()
+        self._scanner = threading.Thread(target=self._scan_loop, args=(interval,), name="chapter-scan", daemon=True)
+        self._scanner.start()
+
+    def stop_periodic_scan(self):
+        self._stop.set()
+        self._scanner = None
+
+
+# 全域共用的章節登錄表
+registry = ChapterRegistry()
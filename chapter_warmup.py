@@ -0,0 +1,107 @@
+# 檔案：chapter_warmup.py
+# 說明：啟動後在背景預先載入所有啟用章節的向量資料庫，並以探測查詢確認可用，
+#       讓部署後的第一批學生不必承擔開啟 Chroma、載入 HNSW 索引的成本。
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import ai_runtime, crud
+from database import SessionLocal
+from metrics import metrics
+
+# 啟動時是否預熱章節索引，以及同時預熱的章節數上限
+CHAPTER_WARMUP_ON_STARTUP = os.environ.get("CHAPTER_WARMUP_ON_STARTUP", "1") == "1"
+CHAPTER_WARMUP_WORKERS = int(os.environ.get("CHAPTER_WARMUP_WORKERS", "2"))
+CHAPTER_WARMUP_PROBE_QUERY = os.environ.get("CHAPTER_WARMUP_PROBE_QUERY", "課程重點")
+
+PENDING, LOADING, WARM, FAILED = "pending", "loading", "warm", "failed"
+
+_lock = threading.Lock()
+_chapters: Dict[str, dict] = {}
+_state = {"running": False, "started_at": None, "finished_at": None}
+
+
+def _update(chapter: str, **fields):
+    with _lock:
+        _chapters.setdefault(chapter, {"chapter": chapter}).update(fields)
+
+
+def warm_chapter(chapter: str) -> dict:
+    """開啟章節向量資料庫（Chroma 或共用的 NumPy 索引）並執行一次探測查詢，記錄載入與查詢耗時。"""
+    import rag_service
+
+    _update(chapter, status=LOADING, error=None)
+    start = time.perf_counter()
+    try:
+        store = rag_service.get_vector_store_for_chapter(chapter)
+        loaded = time.perf_counter()
+        store.similarity_search(CHAPTER_WARMUP_PROBE_QUERY, k=1)
+        probed = time.perf_counter()
+        _update(
+            chapter, status=WARM,
+            load_seconds=round(loaded - start, 3),
+            probe_seconds=round(probed - loaded, 3),
+            warmed_at=datetime.now(timezone.utc).isoformat(),
+        )
+        metrics.observe("warmup.chapter_load", probed - start)
+    except Exception as e:
+        error = getattr(e, "detail", None) or str(e)  # 找不到索引時為 HTTPException
+        _update(chapter, status=FAILED, error=error, load_seconds=round(time.perf_counter() - start, 3))
+        metrics.incr("warmup.chapter_failures")
+        print(f"章節 '{chapter}' 預熱失敗: {error}")
+    return dict(_chapters[chapter])
+
+
+def warm_active_chapters(chapters: Optional[List[str]] = None):
+    """以有上限的執行緒池預熱章節（預設為所有啟用章節）。"""
+    with _lock:
+        _state.update(running=True, started_at=datetime.now(timezone.utc).isoformat(), finished_at=None)
+    try:
+        if not ai_runtime.initialize():
+            return
+        full_run = chapters is None
+        if full_run:
+            with SessionLocal() as db:
+                chapters = crud.get_active_chapter_names(db)
+        with _lock:
+            if full_run:
+                _chapters.clear()  # 已停用或刪除的章節不再回報
+            for chapter in chapters:
+                _chapters[chapter] = {"chapter": chapter, "status": PENDING}
+        with ThreadPoolExecutor(max_workers=CHAPTER_WARMUP_WORKERS, thread_name_prefix="chapter-warmup") as pool:
+            list(pool.map(warm_chapter, chapters))
+        warm = sum(1 for c in chapters if _chapters[c]["status"] == WARM)
+        print(f"章節預熱完成：{warm}/{len(chapters)} 個章節可用")
+    finally:
+        with _lock:
+            _state.update(running=False, finished_at=datetime.now(timezone.utc).isoformat())
+
+
+def start_background_warmup(chapters: Optional[List[str]] = None) -> threading.Thread:
+    thread = threading.Thread(target=warm_active_chapters, args=(chapters,), name="chapter-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def is_complete() -> bool:
+    """預熱是否已結束（失敗的章節會回報在狀態中，但不會讓服務永遠無法就緒）。"""
+    with _lock:
+        if _state["running"]:
+            return False
+        return all(info["status"] in (WARM, FAILED) for info in _chapters.values())
+
+
+def status() -> dict:
+    with _lock:
+        chapters = [dict(info) for info in _chapters.values()]
+        state = dict(_state)
+    return {
+        **state,
+        "complete": not state["running"] and all(c["status"] in (WARM, FAILED) for c in chapters),
+        "warm_count": sum(1 for c in chapters if c["status"] == WARM),
+        "chapters": sorted(chapters, key=lambda c: c["chapter"]),
+    }
@@ -0,0 +1,172 @@
+# 檔案：chunk_dedup.py
+# 說明：索引前去除重複的內容，減少嵌入呼叫次數與索引大小，也避免 /api/ask 的提示中出現重複段落。
+#       1. strip_repeated_lines：移除同一份文件中出現在大多數頁面的行（頁首、頁尾、投影片樣板）。
+#       2. deduplicate：以 MinHash（字元 n-gram，NumPy 向量化）為每個區塊計算指紋，LSH 分段找出候選，
+#          估計的 Jaccard 相似度達門檻即視為近似重複，只保留第一個，並在保留的區塊 metadata 記錄重複的來源。
+
+import os
+import re
+import zlib
+from collections import Counter, defaultdict
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# 0 表示停用去重
+INDEX_DEDUP = os.environ.get("INDEX_DEDUP", "1") == "1"
+# 估計的 Jaccard 相似度達此值視為近似重複
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", "0.85"))
+DEDUP_NUM_PERM = int(os.environ.get("DEDUP_NUM_PERM", "128"))
+# LSH 分段數（每段 NUM_PERM / BANDS 列）；16 x 8 時相似度約 0.7 以上才會成為候選
+DEDUP_BANDS = int(os.environ.get("DEDUP_BANDS", "16"))
+SHINGLE_SIZE = 5
+# 出現在超過此比例頁面的行視為頁首 / 頁尾（文件至少要有 REPEATED_LINE_MIN_PAGES 頁）
+REPEATED_LINE_RATIO = 0.5
+REPEATED_LINE_MIN_PAGES = 3
+
+_WHITESPACE = re.compile(r"\s+")
+_DIGITS = re.compile(r"\d+")
+
+
+@dataclass
+class DedupReport:
+    chunks_in: int = 0
+    chunks_out: int = 0
+    exact_duplicates: int = 0
+    near_duplicates: int = 0
+    chars_in: int = 0
+    chars_out: int = 0
+    boilerplate_lines_removed: int = 0
+
+    @property
+    def removed(self) -> int:
+        return self.chunks_in - self.chunks_out
+
+    def summary(self) -> str:
+        saved = self.chars_in - self.chars_out
+        return (f"去重：{self.chunks_in} -> {self.chunks_out} 個區塊（完全重複 {self.exact_duplicates}、近似重複 {self.near_duplicates}），"
+                f"省下 {self.removed} 次嵌入、{saved} 字元（{saved / max(self.chars_in, 1):.0%}）；"
+                f"移除頁首頁尾 {self.boilerplate_lines_removed} 行")
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "embeddings_saved": self.removed}
+
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+def _line_key(line: str) -> str:
+    # 頁碼不同的頁首頁尾（"第 3 頁"、"Page 12"）視為同一行
+    return _DIGITS.sub("#", _normalize(line))
+
+
+def strip_repeated_lines(documents: List, report: DedupReport = None) -> List:
+    """移除同一來源（同一份 PDF）中出現在大多數頁面的行，就地修改並回傳 documents。"""
+    by_source: Dict[str, List] = defaultdict(list)
+    for doc in documents:
+        by_source[doc.metadata.get("source", "")].append(doc)
+    for pages in by_source.values():
+        if len(pages) < REPEATED_LINE_MIN_PAGES:
+            continue
+        counts = Counter()
+        for doc in pages:
+            counts.update({_line_key(line) for line in doc.page_content.splitlines() if line.strip()})
+        limit = max(REPEATED_LINE_MIN_PAGES, len(pages) * REPEATED_LINE_RATIO)
+        repeated = {line for line, n in counts.items() if n >= limit}
+        if not repeated:
+            continue
+        for doc in pages:
+            lines = doc.page_content.splitlines()
+            kept = [line for line in lines if _line_key(line) not in repeated]
+            if report is not None:
+                report.boilerplate_lines_removed += len(lines) - len(kept)
+            doc.page_content = "\n".join(kept)
+    return documents
+
+
+class MinHasher:
+    """以 multiply-shift 雜湊族模擬 num_perm 個排列，一次計算一個區塊所有 shingle 的簽章。"""
+
+    def __init__(self, num_perm: int = DEDUP_NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+    @staticmethod
+    def shingles(text: str) -> np.ndarray:
+        text = _normalize(text)
+        if len(text) <= SHINGLE_SIZE:
+            grams = {text}
+        else:
+            grams = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+        return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = self.shingles(text)
+        # (a * h + b) mod 2^64 的高 32 位元；uint64 溢位即為 mod 2^64
+        with np.errstate(over="ignore"):
+            values = (self.a[:, None] * hashes[None, :] + self.b[:, None]) >> np.uint64(32)
+        return values.min(axis=1).astype(np.uint32)
+
+
+def deduplicate(chunks: List, report: DedupReport = None, threshold: float = DEDUP_THRESHOLD,
+                num_perm: int = DEDUP_NUM_PERM, bands: int = DEDUP_BANDS) -> Tuple[List, DedupReport]:
+    """
+    去除完全重複與近似重複的區塊（保留先出現的，順序不變），回傳 (保留的區塊, 報告)。
+    保留的區塊 metadata 增加 duplicates（被合併的數量）與 duplicate_sources（其他出處，逗號分隔）。
+    """
+    report = report or DedupReport()
+    report.chunks_in, report.chars_in = len(chunks), sum(len(c.page_content) for c in chunks)
+    if bands <= 0 or num_perm % bands:
+        raise ValueError("DEDUP_NUM_PERM 必須是 DEDUP_BANDS 的整數倍")
+    rows = num_perm // bands
+    hasher = MinHasher(num_perm)
+    exact: Dict[str, int] = {}
+    buckets: Dict[Tuple[int, bytes], List[int]] = defaultdict(list)
+    signatures: Dict[int, np.ndarray] = {}
+    kept: List = []
+
+    for chunk in chunks:
+        key = _normalize(chunk.page_content)
+        if key in exact:
+            _merge(kept[exact[key]], chunk)
+            report.exact_duplicates += 1
+            continue
+        signature = hasher.signature(chunk.page_content)
+        band_keys = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(bands)]
+        candidates = {index for band_key in band_keys for index in buckets.get(band_key, ())}
+        match = None
+        for index in sorted(candidates):
+            if np.count_nonzero(signatures[index] == signature) / num_perm >= threshold:
+                match = index
+                break
+        if match is not None:
+            _merge(kept[match], chunk)
+            report.near_duplicates += 1
+            continue
+        index = len(kept)
+        kept.append(chunk)
+        exact[key] = index
+        signatures[index] = signature
+        for band_key in band_keys:
+            buckets[band_key].append(index)
+
+    report.chunks_out = len(kept)
+    report.chars_out = sum(len(c.page_content) for c in kept)
+    return kept, report
+
+
+def _merge(kept, duplicate):
+    """記錄被合併的重複區塊出處（Chroma 的 metadata 只接受純量值，以逗號串接）。"""
+    metadata = kept.metadata
+    metadata["duplicates"] = metadata.get("duplicates", 0) + 1
+    source = duplicate.metadata.get("source")
+    if source is None:
+        return
+    if "page" in duplicate.metadata:
+        source = f"{source}#{duplicate.metadata['page']}"
+    sources = [s for s in metadata.get("duplicate_sources", "").split(",") if s]
+    if source not in sources and source != metadata.get("source") and len(sources) < 10:
+        metadata["duplicate_sources"] = ",".join(sources + [source])
@@ -0,0 +1,157 @@
+# 檔案：context_builder.py
+# 說明：組裝 RAG 提示詞所需的課程內容：去除重疊或重複的區塊、依相關度排序、
+#       依 token 預算裁切，並提供記錄每次 LLM 呼叫提示 token 數的 callback。
+
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.documents import Document
+
+# --- 可由環境變數調整的預算設定 ---
+# 問答與出題時，課程內容最多佔用的 token 數
+RAG_CONTEXT_TOKEN_BUDGET = int(os.environ.get("RAG_CONTEXT_TOKEN_BUDGET", "1500"))
+# 向量檢索時先多取幾個區塊，去重後再依預算裁切
+RAG_RETRIEVAL_K = int(os.environ.get("RAG_RETRIEVAL_K", "6"))
+# Agent 每次工具回傳的觀察結果上限
+AGENT_OBSERVATION_TOKEN_BUDGET = int(os.environ.get("AGENT_OBSERVATION_TOKEN_BUDGET", "800"))
+# Agent scratchpad 只保留最近幾個步驟，避免每輪重送越來越長的提示
+AGENT_SCRATCHPAD_STEPS = int(os.environ.get("AGENT_SCRATCHPAD_STEPS", "3"))
+AGENT_MAX_ITERATIONS = int(os.environ.get("AGENT_MAX_ITERATIONS", "4"))
+
+# 與 index_documents.py 中 RecursiveCharacterTextSplitter 的 chunk_overlap 一致
+CHUNK_OVERLAP = 100
+# 重疊長度低於此值視為巧合，不做合併
+MIN_OVERLAP = 20
+# 預算剩餘不足此值時，不再截斷塞入下一個區塊
+MIN_PARTIAL_TOKENS = 64
+
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+_WS_RE = re.compile(r"[ \t\r\f\v]+")
+
+ScoredDoc = Tuple[Document, float]
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估文字的 token 數：中日韓文字約一字一 token，其餘約四個字元一 token。"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """將文字截斷到大約 max_tokens 個 token 以內。"""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 二分搜尋可容納的最長前綴
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo].rstrip() + "…"
+
+
+def _normalize(text: str) -> str:
+    return _WS_RE.sub(" ", text).strip()
+
+
+def _overlap_len(head: str, tail: str, max_overlap: int) -> int:
+    """回傳 head 的結尾與 tail 的開頭重疊的最長字元數（不足 MIN_OVERLAP 時回傳 0）。"""
+    limit = min(len(head), len(tail), max_overlap)
+    for k in range(limit, MIN_OVERLAP - 1, -1):
+        if head.endswith(tail[:k]):
+            return k
+    return 0
+
+
+def dedupe_chunks(texts: Sequence[str], max_overlap: int = CHUNK_OVERLAP * 2) -> List[str]:
+    """
+    依輸入順序去除重複或被包含的區塊，並剪掉與已保留區塊首尾重疊的部分。
+    相鄰區塊因切割重疊而重複的文字只會出現一次。
+    """
+    kept: List[str] = []
+    for raw in texts:
+        text = _normalize(raw)
+        if not text:
+            continue
+        if any(text in other for other in kept):
+            continue
+        # 新區塊完整包含舊區塊時，以較長者取代並保留原本的排序位置
+        contained = [i for i, other in enumerate(kept) if other in text]
+        slot = contained[0] if contained else len(kept)
+        kept = [other for i, other in enumerate(kept) if i not in contained]
+        for other in kept:
+            k = _overlap_len(other, text, max_overlap)
+            if k:
+                text = text[k:].lstrip()
+            k = _overlap_len(text, other, max_overlap)
+            if k:
+                text = text[:-k].rstrip()
+            if not text:
+                break
+        if text:
+            kept.insert(slot, text)
+    return kept
+
+
+def build_context(
+    docs: Sequence[Union[Document, ScoredDoc]],
+    token_budget: Optional[int] = None,
+    separator: str = "\n\n",
+) -> str:
+    """
+    將檢索結果組成提示用的上下文字串。
+    docs 可為 Document（視為已依相關度排序）或 (Document, score) 配對（依分數由高至低排序）。
+    """
+    budget = RAG_CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    if docs and isinstance(docs[0], tuple):
+        ordered = [doc for doc, _ in sorted(docs, key=lambda pair: pair[1], reverse=True)]
+    else:
+        ordered = list(docs)
+
+    parts: List[str] = []
+    used = 0
+    sep_tokens = estimate_tokens(separator)
+    for text in dedupe_chunks([doc.page_content for doc in ordered]):
+        cost = estimate_tokens(text) + (sep_tokens if parts else 0)
+        if used + cost <= budget:
+            parts.append(text)
+            used += cost
+            continue
+        remaining = budget - used - (sep_tokens if parts else 0)
+        if remaining >= MIN_PARTIAL_TOKENS:
+            parts.append(truncate_to_tokens(text, remaining))
+        break
+    return separator.join(parts)
+
+
+class PromptTokenLogger(BaseCallbackHandler):
+    """記錄每一次 LLM 呼叫的提示 token 數（估計值），方便觀察 Agent 每輪的提示成長。"""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.calls: List[int] = []
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self.calls)
+
+    def _record(self, tokens: int):
+        self.calls.append(tokens)
+        print(f"[prompt-tokens] {self.label} 第 {len(self.calls)} 次呼叫：約 {tokens} tokens")
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        self._record(sum(estimate_tokens(p) for p in prompts))
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], **kwargs: Any) -> None:
+        self._record(sum(
+            estimate_tokens(m.content if isinstance(m.content, str) else str(m.content))
+            for batch in messages for m in batch
+        ))
@@ -1,19 +1,38 @@
 # 檔案：crud.py
 # 說明：包含所有對資料庫進行 CRUD (新增、讀取、更新、刪除) 的函式。
+import hashlib
 import os
-from sqlalchemy.orm import Session, joinedload
+import re
+from collections import defaultdict
+from sqlalchemy.orm import Session, joinedload, selectinload, defer
 from sqlalchemy import func, case
 import models, schemas
-from typing import List, Dict
+import query_search  # noqa: F401  註冊提問紀錄寫入全文檢索索引的 ORM 事件
+from cache import cache
+from log_retention import archive
+from typing import List, Dict, Tuple
+
+# 學習分析查詢的快取秒數（提交測驗時會清除該使用者的弱點主題）
+ANALYTICS_CACHE_TTL = float(os.environ.get("ANALYTICS_CACHE_TTL", "60"))
+WEAK_TOPICS_CACHE_TTL = float(os.environ.get("WEAK_TOPICS_CACHE_TTL", "600"))
+# 資源標籤清單的快取秒數（新增 / 刪除資源時清除），以及每個弱點主題附上的資源數
+RESOURCE_TAGS_CACHE_TTL = float(os.environ.get("RESOURCE_TAGS_CACHE_TTL", "3600"))
+RESOURCES_PER_TOPIC = int(os.environ.get("RESOURCES_PER_TOPIC", "3"))
 
 # --- User CRUD ---
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
+def auth_cache_namespace(email: str) -> str:
+    """已驗證權杖的快取依使用者分開，資料變更時只清除該使用者的權杖。"""
+    return "auth:" + hashlib.sha256(email.encode("utf-8")).hexdigest()[:16]
+
 def create_or_update_user(db: Session, user_info: dict):
     db_user = get_user_by_email(db, email=user_info["email"])
     admin_emails = [email.strip() for email in os.environ.get("ADMIN_EMAILS", "").split(',')]
+    changed = False
     if db_user:
+        changed = (db_user.name, db_user.picture) != (user_info.get("name"), user_info.get("picture"))
         db_user.name = user_info.get("name")
         db_user.picture = user_info.get("picture")
     else:
@@ -27,10 +46,13 @@ def create_or_update_user(db: Session, user_info: dict):
         db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    if changed:
+        # 該使用者已快取的權杖驗證結果帶有舊的名稱 / 頭像；新使用者沒有快取可清
+        cache.invalidate(auth_cache_namespace(db_user.email))
     return db_user
 
 # --- Quiz CRUD ---
-def create_quiz_attempt(db: Session, user_id: int, topic: str, quiz_data: dict) -> models.QuizAttempt:
+def _add_quiz_attempt(db: Session, user_id: int, topic: str, quiz_data: dict) -> models.QuizAttempt:
     attempt = models.QuizAttempt(user_id=user_id, topic=topic, score=0.0)
     db.add(attempt)
     db.flush()
@@ -40,22 +62,60 @@ def create_quiz_attempt(db: Session, user_id: int, topic: str, quiz_data: dict)
         db.flush()
         for c_text in q_data['choices']:
             db.add(models.Choice(question_id=question.id, choice_text=c_text))
+    return attempt
+
+def create_quiz_attempt(db: Session, user_id: int, topic: str, quiz_data: dict) -> models.QuizAttempt:
+    attempt = _add_quiz_attempt(db, user_id, topic, quiz_data)
     db.commit()
     db.refresh(attempt)
     return attempt
 
+def create_quiz_attempts(db: Session, user_id: int, items: List[Tuple[str, dict]]) -> List[int]:
+    """在同一個交易中建立多份測驗（(主題, 題目資料) 列表），任何一份失敗時全部回滾；回傳測驗 id。"""
+    try:
+        attempts = [_add_quiz_attempt(db, user_id, topic, quiz_data) for topic, quiz_data in items]
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return [attempt.id for attempt in attempts]
+
 def get_quiz_attempt(db: Session, attempt_id: int):
     return db.query(models.QuizAttempt).options(joinedload(models.QuizAttempt.questions).joinedload(models.Question.choices)).filter(models.QuizAttempt.id == attempt_id).first()
 
 def get_user_quiz_history(db: Session, user_id: int):
-    return db.query(models.QuizAttempt).filter(models.QuizAttempt.user_id == user_id).order_by(models.QuizAttempt.created_at.desc()).all()
+    # 一次載入題目與選項，避免序列化時逐筆延遲載入 (N+1)
+    return db.query(models.QuizAttempt).options(
+        selectinload(models.QuizAttempt.questions).selectinload(models.Question.choices)
+    ).filter(models.QuizAttempt.user_id == user_id).order_by(models.QuizAttempt.created_at.desc()).all()
+
+def get_quiz_attempts_version(db: Session, user_id: int = None) -> tuple:
+    """測驗資料的版本指紋（筆數、最新 id、分數總和、已作答題數），供列表端點計算 ETag。
+    提交測驗只會更新既有資料列，因此除了最新 id 也納入分數與作答狀態。"""
+    attempts = db.query(func.count(models.QuizAttempt.id), func.max(models.QuizAttempt.id), func.total(models.QuizAttempt.score))
+    answered = db.query(func.count(models.Question.user_answer_index), func.total(models.Question.user_answer_index))
+    if user_id is not None:
+        attempts = attempts.filter(models.QuizAttempt.user_id == user_id)
+        answered = answered.join(models.QuizAttempt, models.Question.quiz_attempt_id == models.QuizAttempt.id).filter(models.QuizAttempt.user_id == user_id)
+    return tuple(attempts.one()) + tuple(answered.one())
 
 # --- External Resource CRUD ---
+_TAG_SEPARATORS = re.compile(r"[,，、;；]")
+
+def normalize_tag(tag: str) -> str:
+    return " ".join(tag.split()).lower()
+
+def parse_tags(tags: str) -> List[str]:
+    """逗號（含全形逗號、頓號）分隔的標籤字串 -> 正規化且不重複的標籤列表"""
+    return list(dict.fromkeys(t for t in (normalize_tag(x) for x in _TAG_SEPARATORS.split(tags or "")) if t))
+
 def create_external_resource(db: Session, resource: schemas.ExternalResourceCreate):
     db_resource = models.ExternalResource(**resource.model_dump())
+    db_resource.tag_entries = [models.ResourceTag(tag=tag) for tag in parse_tags(resource.tags)]
     db.add(db_resource)
     db.commit()
     db.refresh(db_resource)
+    cache.invalidate("resource-tags")
     return db_resource
 
 def get_external_resources(db: Session, skip: int = 0, limit: int = 100):
@@ -64,44 +124,194 @@ def get_external_resources(db: Session, skip: int = 0, limit: int = 100):
 def delete_external_resource(db: Session, resource_id: int):
     db_resource = db.query(models.ExternalResource).filter(models.ExternalResource.id == resource_id).first()
     if db_resource:
-        db.delete(db_resource)
+        db.delete(db_resource)  # 標籤列隨之刪除
         db.commit()
+        cache.invalidate("resource-tags")
         return True
     return False
 
-def search_external_resources(db: Session, query: str) -> List[models.ExternalResource]:
-    return db.query(models.ExternalResource).filter(models.ExternalResource.tags.like(f"%{query}%")).all()
+def backfill_resource_tags(db: Session) -> int:
+    """為尚未建立標籤列的資源（resource_tags 資料表建立前新增的）補上標籤，回傳處理的資源數"""
+    resources = db.query(models.ExternalResource).filter(~models.ExternalResource.tag_entries.any()).all()
+    for resource in resources:
+        resource.tag_entries = [models.ResourceTag(tag=tag) for tag in parse_tags(resource.tags)]
+    if resources:
+        db.commit()
+        cache.invalidate("resource-tags")
+    return len(resources)
+
+def get_tag_vocabulary(db: Session) -> List[str]:
+    """所有使用中的標籤（不重複）"""
+    return cache.get_or_set("resource-tags", "vocabulary",
+                            lambda: [tag for (tag,) in db.query(models.ResourceTag.tag).distinct()],
+                            ttl=RESOURCE_TAGS_CACHE_TTL)
+
+def search_external_resources(db: Session, query: str, match_all: bool = False) -> List[models.ExternalResource]:
+    """依標籤查詢資源（逗號分隔多個標籤）：預設符合任一標籤，match_all 時須符合全部；符合越多標籤越前面"""
+    tags = parse_tags(query)
+    if not tags:
+        return []
+    matched = func.count(models.ResourceTag.id)
+    q = db.query(models.ExternalResource).join(models.ExternalResource.tag_entries).filter(models.ResourceTag.tag.in_(tags)).group_by(models.ExternalResource.id)
+    if match_all:
+        q = q.having(matched == len(tags))
+    return q.order_by(matched.desc(), models.ExternalResource.id).all()
+
+def _topic_tags(topic: str, vocabulary: List[str]):
+    """測驗主題（"章節 - 主題"）-> (主題相關的標籤, 章節標籤)；主題文字中出現的既有標籤也算"""
+    chapter, sep, name = topic.partition(" - ")
+    if not sep:
+        chapter, name = "", topic
+    name, chapter = normalize_tag(name), normalize_tag(chapter)
+    tags = {name} if name else set()
+    # 英數標籤須為完整的詞（避免 "ai" 比對到 "explain"），中文標籤直接比對子字串
+    tags.update(t for t in vocabulary if t != chapter and re.search(rf"(?<![a-z0-9]){re.escape(t)}(?![a-z0-9])", name))
+    tags.discard(chapter)
+    return tags, chapter
+
+def get_resources_for_topics(db: Session, topics: List[str], limit: int = RESOURCES_PER_TOPIC) -> Dict[str, List[models.ExternalResource]]:
+    """
+    一次查詢取得多個主題的推薦資源：符合的主題標籤越多越前面，同時標有該章節的資源優先。
+    只標了章節、與主題無關的資源不會推薦。
+    """
+    vocabulary = get_tag_vocabulary(db)
+    wanted = {topic: _topic_tags(topic, vocabulary) for topic in topics}
+    all_tags = set()
+    for tags, chapter in wanted.values():
+        all_tags |= tags | ({chapter} if chapter else set())
+    by_tag = defaultdict(list)
+    if all_tags:
+        rows = db.query(models.ResourceTag.tag, models.ExternalResource).join(models.ResourceTag.resource).filter(models.ResourceTag.tag.in_(all_tags)).all()
+        for tag, resource in rows:
+            by_tag[tag].append(resource)
+    results = {}
+    for topic, (tags, chapter) in wanted.items():
+        scores, resources = defaultdict(float), {}
+        for tag in tags:
+            for resource in by_tag[tag]:
+                scores[resource.id] += 1
+                resources[resource.id] = resource
+        for resource in by_tag[chapter] if chapter else []:
+            if resource.id in scores:
+                scores[resource.id] += 0.5
+        ranked = sorted(scores, key=lambda rid: (-scores[rid], rid))[:limit]
+        results[topic] = [resources[rid] for rid in ranked]
+    return results
 
 # --- Analytics & Recommendation CRUD ---
+# 家教對話的回合也寫入提問紀錄（管理員可查詢、匯出），問題記為 "[章節] [tutor] 問題"；
+# 這些問題依賴先前的對話內容（「為什麼？」），常見問題分群與熱門問題統計須排除
+TUTOR_LOG_MARKER = "[tutor] "
+TUTOR_LOG_PATTERN = f"[%] {TUTOR_LOG_MARKER}%"
+
+def tutor_log_question(chapter: str, question: str) -> str:
+    return f"[{chapter}] {TUTOR_LOG_MARKER}{question}"
+
 def log_rag_query(db: Session, user_id: int, question: str, answer: str):
     log_entry = models.RAGQueryLog(user_id=user_id, question=question, answer=answer)
     db.add(log_entry)
     db.commit()
     return log_entry
 
-def get_all_query_logs(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.RAGQueryLog).options(joinedload(models.RAGQueryLog.user)).order_by(models.RAGQueryLog.created_at.desc()).offset(skip).limit(limit).all()
+def get_latest_answer(db: Session, question: str):
+    """取得相同問題最近一次的回答（AI 服務故障時作為備援）"""
+    log_entry = db.query(models.RAGQueryLog.answer).filter(models.RAGQueryLog.question == question).order_by(models.RAGQueryLog.id.desc()).first()
+    return log_entry.answer if log_entry else None
+
+def get_all_query_logs(db: Session, skip: int = 0, limit: int = 100, load_answer: bool = True):
+    options = [joinedload(models.RAGQueryLog.user)]
+    if not load_answer:
+        options.append(defer(models.RAGQueryLog.answer))  # 不需要回答全文時不讀取
+    logs = db.query(models.RAGQueryLog).options(*options).order_by(models.RAGQueryLog.created_at.desc()).offset(skip).limit(limit).all()
+    if len(logs) < limit and archive.exists():
+        # 熱資料不足一頁時接著讀取封存的紀錄（封存的紀錄都比熱資料舊）
+        hot_count = len(logs) + skip if logs else db.query(func.count(models.RAGQueryLog.id)).scalar()
+        logs += archive.fetch_logs(db, skip=max(0, skip - hot_count), limit=limit - len(logs), load_answer=load_answer)
+    return logs
+
+def get_query_logs_version(db: Session) -> tuple:
+    """提問紀錄只會新增（或封存），以熱資料筆數、最新 id 與封存筆數（計數器，不掃描封存）作為版本指紋。"""
+    return tuple(db.query(func.count(models.RAGQueryLog.id), func.max(models.RAGQueryLog.id)).one()) + (archive.count(),)
 
-def get_all_quiz_attempts(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.QuizAttempt).options(joinedload(models.QuizAttempt.user)).order_by(models.QuizAttempt.created_at.desc()).offset(skip).limit(limit).all()
+def get_all_quiz_attempts(db: Session, skip: int = 0, limit: int = 100, load_questions: bool = True):
+    options = [joinedload(models.QuizAttempt.user)]
+    if load_questions:
+        options.append(selectinload(models.QuizAttempt.questions).selectinload(models.Question.choices))
+    return db.query(models.QuizAttempt).options(*options).order_by(models.QuizAttempt.created_at.desc()).offset(skip).limit(limit).all()
+
+# --- Bulk Export（串流匯出，逐批讀取，記憶體用量與總筆數無關）---
+def _prefix_pattern(prefix: str) -> str:
+    """LIKE 前綴比對，跳脫 % 與 _（章節名稱常含底線）"""
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def iter_query_log_export(db: Session, start=None, end=None, chapter: str = None,
+                          include_answer: bool = True, batch_size: int = 1000):
+    """
+    依 id 順序逐批讀取提問紀錄（只取欄位，不建立 ORM 物件），先輸出封存資料庫中符合條件的紀錄。
+    章節記錄在問題開頭的 "[章節] "。
+    """
+    columns = [models.RAGQueryLog.id, models.RAGQueryLog.created_at, models.RAGQueryLog.user_id,
+               models.User.email.label("user_email"), models.RAGQueryLog.question]
+    if include_answer:
+        columns.append(models.RAGQueryLog.answer)
+    query = db.query(*columns).outerjoin(models.User, models.User.id == models.RAGQueryLog.user_id)
+    if start is not None:
+        query = query.filter(models.RAGQueryLog.created_at >= start)
+    if end is not None:
+        query = query.filter(models.RAGQueryLog.created_at < end)
+    if chapter:
+        query = query.filter(models.RAGQueryLog.question.like(_prefix_pattern(f"[{chapter}] "), escape="\\"))
+    yield from archive.iter_export_rows(db, start, end, chapter, include_answer, batch_size)
+    yield from query.order_by(models.RAGQueryLog.id).yield_per(batch_size)
+
+def iter_quiz_attempt_export(db: Session, start=None, end=None, chapter: str = None, batch_size: int = 1000):
+    """依 id 順序逐批讀取測驗紀錄，每次測驗一列，附題數與答對題數。章節記錄在主題開頭的 "章節 - "。"""
+    counts = db.query(
+        models.Question.quiz_attempt_id.label("attempt_id"),
+        func.count(models.Question.id).label("question_count"),
+        func.sum(case((models.Question.is_correct == "correct", 1), else_=0)).label("correct_count"),
+    ).group_by(models.Question.quiz_attempt_id).subquery()
+    query = db.query(
+        models.QuizAttempt.id, models.QuizAttempt.created_at, models.QuizAttempt.user_id,
+        models.User.email.label("user_email"), models.QuizAttempt.topic, models.QuizAttempt.score,
+        func.coalesce(counts.c.question_count, 0).label("question_count"),
+        func.coalesce(counts.c.correct_count, 0).label("correct_count"),
+    ).outerjoin(models.User, models.User.id == models.QuizAttempt.user_id).outerjoin(counts, counts.c.attempt_id == models.QuizAttempt.id)
+    if start is not None:
+        query = query.filter(models.QuizAttempt.created_at >= start)
+    if end is not None:
+        query = query.filter(models.QuizAttempt.created_at < end)
+    if chapter:
+        query = query.filter(models.QuizAttempt.topic.like(_prefix_pattern(f"{chapter} - "), escape="\\"))
+    return query.order_by(models.QuizAttempt.id).yield_per(batch_size)
 
 def get_user_weakest_topics(db: Session, user_id: int, limit: int = 3) -> List[Dict]:
-    """找出使用者表現最差的主題"""
+    """找出使用者表現最差的主題（快取於 weak-topics 命名空間，提交測驗時清除）"""
+    cached = cache.get("weak-topics", [user_id, limit])
+    if cached is not None:
+        return cached
     results = db.query(
         models.QuizAttempt.topic,
         func.avg(models.QuizAttempt.score).label('average_score'),
         func.count(models.QuizAttempt.id).label('attempt_count')
     ).filter(models.QuizAttempt.user_id == user_id).group_by(models.QuizAttempt.topic).order_by('average_score').limit(limit).all()
     
-    return [{"topic": r.topic, "average_score": r.average_score} for r in results if r.average_score < 70]
+    topics = [{"topic": r.topic, "average_score": r.average_score} for r in results if r.average_score < 70]
+    cache.set("weak-topics", [user_id, limit], topics, ttl=WEAK_TOPICS_CACHE_TTL)
+    return topics
+
+def invalidate_user_topics(user_id: int, limit: int = 3):
+    cache.delete("weak-topics", [user_id, limit])
 
 def get_most_queried_topics(db: Session, limit: int = 5) -> List[Dict]:
-    """找出最常被提問的主題 (簡易版，計算提問次數)"""
-    results = db.query(
-        models.RAGQueryLog.question,
-        func.count(models.RAGQueryLog.id).label('query_count')
-    ).group_by(models.RAGQueryLog.question).order_by(func.count(models.RAGQueryLog.id).desc()).limit(limit).all()
-    return [{"question": r.question, "count": r.query_count} for r in results]
+    """找出最常被提問的主題 (簡易版，計算提問次數；全表彙總，短暫快取)"""
+    def compute():
+        results = db.query(
+            models.RAGQueryLog.question,
+            func.count(models.RAGQueryLog.id).label('query_count')
+        ).filter(~models.RAGQueryLog.question.like(TUTOR_LOG_PATTERN)).group_by(models.RAGQueryLog.question).order_by(func.count(models.RAGQueryLog.id).desc()).limit(limit).all()
+        return [{"question": r.question, "count": r.query_count} for r in results]
+    return cache.get_or_set("analytics:top-questions", limit, compute, ttl=ANALYTICS_CACHE_TTL)
 
 # --- Chapter Management CRUD ---
 def create_chapter(db: Session, chapter: schemas.ChapterCreate):
@@ -127,6 +337,11 @@ def get_all_chapters(db: Session, include_inactive: bool = False):
         query = query.filter(models.Chapter.is_active == 1)
     return query.order_by(models.Chapter.name).all()
 
+def get_chapters_version(db: Session) -> tuple:
+    """章節表的版本指紋（筆數、最新 id、最後修改時間、啟用數），供各 worker 定期比對是否需要重新載入章節。"""
+    return tuple(db.query(func.count(models.Chapter.id), func.max(models.Chapter.id),
+                          func.max(models.Chapter.updated_at), func.total(models.Chapter.is_active)).one())
+
 def get_active_chapter_names(db: Session) -> List[str]:
     """獲取所有啟用章節的名稱列表"""
     chapters = db.query(models.Chapter.name).filter(models.Chapter.is_active == 1).all()
@@ -0,0 +1,208 @@
+# 檔案：data_export.py
+# 說明：管理員的大量資料匯出（整學期的提問紀錄與測驗紀錄，供離線分析）。
+#       以 yield_per 逐批讀取資料列並邊讀邊輸出（StreamingResponse），記憶體用量與總筆數無關；
+#       支援日期與章節篩選，輸出 NDJSON、CSV（含 BOM，Excel 可直接開啟中文）或 Parquet。
+#       Parquet 需要選用套件 pyarrow，每批資料寫成一個 row group 後立即送出。
+
+import csv
+import io
+import os
+import re
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+import crud
+from database import SessionLocal
+from fast_response import dumps
+from metrics import metrics
+
+# 每次自資料庫取回的筆數，也是 NDJSON / CSV 每次送出的筆數
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+# Parquet 每個 row group 的筆數（太小會讓檔案變大、讀取變慢）
+EXPORT_PARQUET_ROW_GROUP = int(os.environ.get("EXPORT_PARQUET_ROW_GROUP", "20000"))
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# 欄位與型別（Parquet schema 依此建立，CSV 依此排列欄位）
+QUERY_LOG_COLUMNS = {
+    "id": "int", "created_at": "timestamp", "user_id": "int", "user_email": "str",
+    "chapter": "str", "question": "str", "answer": "str",
+}
+QUIZ_ATTEMPT_COLUMNS = {
+    "id": "int", "created_at": "timestamp", "user_id": "int", "user_email": "str",
+    "chapter": "str", "topic": "str", "score": "float", "question_count": "int", "correct_count": "int",
+}
+
+_QUESTION_CHAPTER = re.compile(r"\[([^\]]+)\] (.*)", re.DOTALL)
+
+
+def split_question(text: str):
+    """"[chapter1] 問題" -> ("chapter1", "問題")；沒有章節前綴時章節為 None。"""
+    match = _QUESTION_CHAPTER.fullmatch(text or "")
+    return (match.group(1), match.group(2)) if match else (None, text)
+
+
+def split_topic(text: str):
+    """"chapter1 - 過擬合" -> ("chapter1", "過擬合")"""
+    chapter, sep, topic = (text or "").partition(" - ")
+    return (chapter, topic) if sep else (None, text)
+
+
+def _query_log_row(row) -> dict:
+    chapter, question = split_question(row.question)
+    item = {"id": row.id, "created_at": row.created_at, "user_id": row.user_id, "user_email": row.user_email,
+            "chapter": chapter, "question": question}
+    if "answer" in row._fields:
+        item["answer"] = row.answer
+    return item
+
+
+def _quiz_attempt_row(row) -> dict:
+    chapter, topic = split_topic(row.topic)
+    return {"id": row.id, "created_at": row.created_at, "user_id": row.user_id, "user_email": row.user_email,
+            "chapter": chapter, "topic": topic, "score": row.score,
+            "question_count": row.question_count, "correct_count": int(row.correct_count)}
+
+
+def date_range(start: Optional[date], end: Optional[date]):
+    """日期（UTC，含 end 當天）轉為 [start, end) 的時間範圍。"""
+    if start and end and end < start:
+        raise HTTPException(status_code=400, detail="end 不可早於 start")
+    return (datetime.combine(start, dt_time.min) if start else None,
+            datetime.combine(end + timedelta(days=1), dt_time.min) if end else None)
+
+
+def _rows(fetch: Callable, convert: Callable, filters: dict) -> Iterator[dict]:
+    # 使用專屬的 session：串流期間一直持有，輸出完成或用戶端中斷時關閉
+    db = SessionLocal()
+    try:
+        for row in fetch(db, batch_size=EXPORT_BATCH_SIZE, **filters):
+            yield convert(row)
+    finally:
+        db.close()
+
+
+def _batches(rows: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def encode_ndjson(rows: Iterable[dict], columns: Dict[str, str]) -> Iterator[bytes]:
+    for batch in _batches(rows, EXPORT_BATCH_SIZE):
+        yield b"".join(dumps({k: _plain(v) for k, v in row.items()}) + b"\n" for row in batch)
+
+
+def encode_csv(rows: Iterable[dict], columns: Dict[str, str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")  # BOM：讓 Excel 以 UTF-8 開啟
+    writer.writerow(columns)
+    for batch in _batches(rows, EXPORT_BATCH_SIZE):
+        writer.writerows([_plain(row.get(name)) for name in columns] for row in batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise HTTPException(status_code=400, detail="Parquet 匯出需要安裝 pyarrow 套件（pip install pyarrow），或改用 ndjson / csv")
+    return pyarrow
+
+
+class _ChunkSink(io.RawIOBase):
+    """收集 ParquetWriter 寫出的位元組，每個 row group 寫完就取出送給用戶端。"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        # Parquet 檔尾記錄各 row group 的絕對位移，必須回報累計寫出的位元組數
+        return self.position
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def encode_parquet(rows: Iterable[dict], columns: Dict[str, str]) -> Iterator[bytes]:
+    pa = _require_pyarrow()
+    types = {"int": pa.int64(), "float": pa.float64(), "str": pa.string(), "timestamp": pa.timestamp("us", tz="UTC")}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns.items()])
+    sink = _ChunkSink()
+    writer = pa.parquet.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for batch in _batches(rows, EXPORT_PARQUET_ROW_GROUP):
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {"ndjson": encode_ndjson, "csv": encode_csv, "parquet": encode_parquet}
+
+
+def _counted(rows: Iterable[dict], name: str, fmt: str) -> Iterator[dict]:
+    started, count = time.perf_counter(), 0
+    try:
+        for row in rows:
+            count += 1
+            yield row
+    finally:
+        metrics.incr(f"export.{name}.rows", count)
+        print(f"[export] {name}.{fmt}：{count} 筆，{time.perf_counter() - started:.1f} 秒")
+
+
+def export_response(name: str, fetch: Callable, convert: Callable, columns: Dict[str, str], fmt: str, filters: dict) -> StreamingResponse:
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支援的格式: {fmt}（可用：{', '.join(FORMATS)}）")
+    if fmt == "parquet":
+        _require_pyarrow()  # 在開始串流前檢查，否則用戶端只會收到中斷的回應
+    body = ENCODERS[fmt](_counted(_rows(fetch, convert, filters), name, fmt), columns)
+    filename = f"{name}-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}"
+    return StreamingResponse(body, media_type=FORMATS[fmt], headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+def export_query_logs(fmt: str, start=None, end=None, chapter: str = None, include_answer: bool = True) -> StreamingResponse:
+    columns = dict(QUERY_LOG_COLUMNS)
+    if not include_answer:
+        del columns["answer"]
+    filters = {"start": start, "end": end, "chapter": chapter, "include_answer": include_answer}
+    return export_response("query-logs", crud.iter_query_log_export, _query_log_row, columns, fmt, filters)
+
+
+def export_quiz_attempts(fmt: str, start=None, end=None, chapter: str = None) -> StreamingResponse:
+    filters = {"start": start, "end": end, "chapter": chapter}
+    return export_response("quiz-attempts", crud.iter_quiz_attempt_export, _quiz_attempt_row, QUIZ_ATTEMPT_COLUMNS, fmt, filters)
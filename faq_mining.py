@@ -0,0 +1,424 @@
+# 檔案：faq_mining.py
+# 說明：由提問紀錄找出常見問題並預先產生答案。
+#       批次工作（離峰時段排程、python faq_mining.py 或 POST /api/admin/faq/mine）依章節取出最近 FAQ_LOOKBACK_DAYS 天的提問，
+#       正規化去重後以嵌入模型批次嵌入，再以 NumPy 向量化的門檻分群（相似度矩陣 + 依密度挑選中心，
+#       之後每個問題改屬最相近的中心）：「什麼是過擬合?」與「what's overfitting」會落在同一群。
+#       提問次數達 FAQ_MIN_CLUSTER_SIZE 的群集以最接近中心的問題預先產生標準答案，
+#       /api/ask 收到的問題與某個群集中心的相似度達 FAQ_MATCH_THRESHOLD 時直接回覆該答案，不必呼叫 LLM。
+#       用法：python faq_mining.py [--chapter 章節] [--days 30] [--no-answers]
+
+import argparse
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+from chapter_registry import registry, read_index_stamp
+from database import SessionLocal
+from metrics import metrics
+from request_profiling import stage
+from singleflight import normalize_text
+
+FAQ_LOOKBACK_DAYS = float(os.environ.get("FAQ_LOOKBACK_DAYS", "30"))
+# 每個章節最多取幾個（依提問次數）不同的問題分群；相似度矩陣為此值的平方
+FAQ_MAX_QUESTIONS = int(os.environ.get("FAQ_MAX_QUESTIONS", "5000"))
+# 與群集中心的 cosine 相似度達此值才算同一群
+FAQ_CLUSTER_THRESHOLD = float(os.environ.get("FAQ_CLUSTER_THRESHOLD", "0.85"))
+# 提問次數達此值的群集才保留並預先產生答案
+FAQ_MIN_CLUSTER_SIZE = int(os.environ.get("FAQ_MIN_CLUSTER_SIZE", "5"))
+FAQ_MAX_CLUSTERS = int(os.environ.get("FAQ_MAX_CLUSTERS", "20"))
+# /api/ask 的問題與群集中心相似度達此值時直接回覆預先產生的答案
+FAQ_MATCH_THRESHOLD = float(os.environ.get("FAQ_MATCH_THRESHOLD", "0.9"))
+# 超過此天數的答案在下次分群時重新產生
+FAQ_ANSWER_MAX_AGE_DAYS = float(os.environ.get("FAQ_ANSWER_MAX_AGE_DAYS", "7"))
+# 每天幾點（本地時間，0-23）執行分群；-1 表示不排程
+FAQ_MINING_HOUR = int(os.environ.get("FAQ_MINING_HOUR", "3"))
+# 各 worker 檢查是否有新的分群結果的間隔（秒）
+FAQ_RELOAD_CHECK = float(os.environ.get("FAQ_RELOAD_CHECK", "30"))
+FAQ_LOCK_PATH = os.environ.get("FAQ_LOCK_PATH", "faq_mining.lock")
+EMBED_BATCH = 100
+SIMILARITY_BLOCK_ROWS = 1024
+SAMPLE_QUESTIONS = 5
+# 只保存 AI 實際產生的答案（不保存 AI 故障時替代用的舊回答）
+ANSWER_PATHS = ("fast", "agent")
+# /api/ask 以常見問題答案回覆時的路徑
+PATH_FAQ = "faq"
+
+_CHAPTER_PREFIX = re.compile(r"^\[([^\]]+)\] (.*)$", re.DOTALL)
+
+
+# --- 分群 ---
+def load_questions(db: Session, chapter: Optional[str] = None, days: float = FAQ_LOOKBACK_DAYS) -> Dict[str, Dict[str, list]]:
+    """
+    回傳 {章節: {正規化問題: [提問次數, 原始問題]}}；章節記錄在問題開頭的 "[章節] "。
+    家教對話的回合與「為什麼？」這類追問語句（較早的紀錄沒有標記）脫離對話就沒有意義，不列入分群。
+    """
+    import crud
+    from tutor_sessions import is_followup
+
+    query = (db.query(models.RAGQueryLog.question)
+             .filter(models.RAGQueryLog.created_at >= datetime.utcnow() - timedelta(days=days))
+             .filter(~models.RAGQueryLog.question.like(crud.TUTOR_LOG_PATTERN)))
+    if chapter:
+        query = query.filter(models.RAGQueryLog.question.like(crud._prefix_pattern(f"[{chapter}] "), escape="\\"))
+    questions: Dict[str, Dict[str, list]] = {}
+    for (logged,) in query.yield_per(2000):
+        match = _CHAPTER_PREFIX.match(logged)
+        if not match:
+            continue
+        key = normalize_text(match.group(2))
+        if not key or is_followup(match.group(2)):
+            continue
+        entry = questions.setdefault(match.group(1), {}).setdefault(key, [0, match.group(2).strip()])
+        entry[0] += 1
+    return questions
+
+
+def _normalize_rows(matrix):
+    import numpy as np
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def _centroids(vectors, weights, labels, k: int):
+    import numpy as np
+    sums = np.zeros((k, vectors.shape[1]), dtype=np.float32)
+    np.add.at(sums, labels, vectors * weights[:, None])
+    return _normalize_rows(sums)
+
+
+def cluster(vectors, weights, threshold: float = FAQ_CLUSTER_THRESHOLD):
+    """
+    vectors 為已正規化的 (n, d) float32，weights 為各問題的提問次數。回傳 (labels, 正規化的群集中心)。
+    1. 分塊計算相似度矩陣並轉為鄰接矩陣（相似度 >= threshold）。
+    2. 依加權鄰居數由高到低挑選尚未分配的問題為中心，其尚未分配的鄰居都歸入此群。
+    3. 每個問題再改屬最相近的中心（相似度仍須達門檻），修正先挑中心造成的邊界誤差。
+    """
+    import numpy as np
+
+    n = len(vectors)
+    adjacency = np.empty((n, n), dtype=bool)
+    for start in range(0, n, SIMILARITY_BLOCK_ROWS):
+        adjacency[start:start + SIMILARITY_BLOCK_ROWS] = vectors[start:start + SIMILARITY_BLOCK_ROWS] @ vectors.T >= threshold
+    density = adjacency @ weights
+    labels = np.full(n, -1, dtype=np.int64)
+    unassigned = np.ones(n, dtype=bool)
+    k = 0
+    for i in np.argsort(-density, kind="stable"):
+        if not unassigned[i]:
+            continue
+        members = adjacency[i] & unassigned
+        members[i] = True
+        labels[members] = k
+        unassigned &= ~members
+        k += 1
+
+    centroids = _centroids(vectors, weights, labels, k)
+    similarity = vectors @ centroids.T
+    best = similarity.argmax(axis=1)
+    labels = np.where(similarity[np.arange(n), best] >= threshold, best, labels)
+    return labels, _centroids(vectors, weights, labels, k)
+
+
+def embed_questions(texts: List[str], embeddings):
+    import numpy as np
+    vectors = []
+    for start in range(0, len(texts), EMBED_BATCH):
+        vectors.extend(embeddings.embed_documents(texts[start:start + EMBED_BATCH]))
+    return _normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+
+def find_clusters(questions: Dict[str, list], embeddings, min_size: int = FAQ_MIN_CLUSTER_SIZE,
+                  max_clusters: int = FAQ_MAX_CLUSTERS, threshold: float = FAQ_CLUSTER_THRESHOLD) -> Tuple[List[dict], dict]:
+    """將一個章節的問題分群，回傳（依提問次數排序、達 min_size 的群集, 耗時）。"""
+    import numpy as np
+
+    timings = {}
+    items = sorted(questions.values(), key=lambda item: -item[0])[:FAQ_MAX_QUESTIONS]
+    if not items:
+        return [], timings
+    texts = [text for _, text in items]
+    weights = np.asarray([count for count, _ in items], dtype=np.float32)
+
+    started = time.perf_counter()
+    vectors = embed_questions(texts, embeddings)
+    timings["embed"] = round(time.perf_counter() - started, 3)
+    started = time.perf_counter()
+    labels, centroids = cluster(vectors, weights, threshold)
+    sizes = np.bincount(labels, weights=weights, minlength=len(centroids))
+    timings["cluster"] = round(time.perf_counter() - started, 3)
+
+    clusters = []
+    for label in np.argsort(-sizes, kind="stable"):
+        if sizes[label] < min_size or len(clusters) >= max_clusters:
+            break
+        members = np.flatnonzero(labels == label)
+        closest = members[np.argmax(vectors[members] @ centroids[label])]
+        by_count = members[np.argsort(-weights[members], kind="stable")]
+        clusters.append({
+            "size": int(sizes[label]),
+            "unique_questions": len(members),
+            "representative": texts[closest],
+            "sample_questions": [texts[i] for i in by_count[:SAMPLE_QUESTIONS]],
+            "centroid": centroids[label],
+        })
+    return clusters, timings
+
+
+# --- 批次工作 ---
+def _carry_over_answers(db: Session, chapter: str, clusters: List[dict], stamp: Optional[str]) -> int:
+    """沿用上次分群中相同群集（中心相似度達 FAQ_MATCH_THRESHOLD）且仍有效的答案，回傳沿用的數量。"""
+    import numpy as np
+
+    cutoff = datetime.utcnow() - timedelta(days=FAQ_ANSWER_MAX_AGE_DAYS)
+    previous = [
+        row for row in db.query(models.FaqCluster).filter(models.FaqCluster.chapter == chapter, models.FaqCluster.answer.isnot(None))
+        if row.index_stamp == stamp and row.answered_at is not None and row.answered_at.replace(tzinfo=None) >= cutoff
+    ]
+    if not previous or not clusters:
+        return 0
+    old = np.stack([np.frombuffer(row.centroid, dtype=np.float32) for row in previous])
+    new = np.stack([c["centroid"] for c in clusters])
+    if old.shape[1] != new.shape[1]:
+        return 0
+    similarity = new @ old.T
+    reused = 0
+    for i, c in enumerate(clusters):
+        j = int(similarity[i].argmax())
+        if similarity[i, j] >= FAQ_MATCH_THRESHOLD:
+            row = previous[j]
+            c.update(answer=row.answer, answer_path=row.answer_path, answered_at=row.answered_at, index_stamp=row.index_stamp)
+            reused += 1
+    return reused
+
+
+def mine_chapter(db: Session, chapter: str, questions: Dict[str, list], rag_service=None, answer: bool = True) -> dict:
+    """分群一個章節並以新結果取代該章節的群集；rag_service 為 None 或 answer=False 時只分群不產生答案。"""
+    import ai_runtime
+
+    report = {"chapter": chapter, "questions": sum(count for count, _ in questions.values()), "unique_questions": len(questions),
+              "clusters": 0, "answers_reused": 0, "answers_generated": 0, "answer_errors": 0}
+    clusters, report["seconds"] = find_clusters(questions, ai_runtime.embeddings)
+    report["clusters"] = len(clusters)
+    db_path = registry.index_path(chapter)
+    stamp = read_index_stamp(db_path) if db_path else None
+    report["answers_reused"] = _carry_over_answers(db, chapter, clusters, stamp)
+
+    if answer and rag_service is not None and db_path is not None:
+        started = time.perf_counter()
+        vector_store = rag_service.get_vector_store_for_chapter(chapter)
+        for c in clusters:
+            if c.get("answer"):
+                continue
+            try:
+                text, path = rag_service.answer_question(chapter, c["representative"], vector_store)
+            except Exception as e:
+                report["answer_errors"] += 1
+                print(f"[faq] 無法為 '{chapter}' 的「{c['representative']}」產生答案：{e}")
+                continue
+            if path in ANSWER_PATHS:
+                c.update(answer=text, answer_path=path, answered_at=datetime.utcnow(), index_stamp=stamp)
+                report["answers_generated"] += 1
+        report["seconds"]["answer"] = round(time.perf_counter() - started, 3)
+
+    # 答案都產生後才在同一個交易中取代舊群集，不長時間佔用資料庫的寫入鎖
+    db.query(models.FaqCluster).filter(models.FaqCluster.chapter == chapter).delete(synchronize_session=False)
+    for rank, c in enumerate(clusters, start=1):
+        db.add(models.FaqCluster(
+            chapter=chapter, rank=rank, size=c["size"], unique_questions=c["unique_questions"],
+            representative=c["representative"], sample_questions=c["sample_questions"], centroid=c["centroid"].tobytes(),
+            answer=c.get("answer"), answer_path=c.get("answer_path"), answered_at=c.get("answered_at"),
+            index_stamp=c.get("index_stamp"), hits=0,
+        ))
+    db.commit()
+    faq_index.invalidate(chapter)
+    metrics.incr("faq.answers_generated", report["answers_generated"])
+    return report
+
+
+def mine(chapter: Optional[str] = None, answer: bool = True, days: float = FAQ_LOOKBACK_DAYS) -> List[dict]:
+    """分群所有（或指定）章節最近的提問；需要 AI 系統（嵌入模型，產生答案時另需 LLM）。"""
+    import ai_runtime
+
+    if not ai_runtime.initialize():
+        raise RuntimeError("AI 系統無法使用，無法分群提問紀錄")
+    import rag_service
+
+    reports = []
+    with SessionLocal() as db:
+        for name, questions in sorted(load_questions(db, chapter, days).items()):
+            if registry.index_path(name) is None:
+                continue
+            report = mine_chapter(db, name, questions, rag_service, answer=answer)
+            print(f"[faq] 章節 '{name}'：{report['questions']} 次提問、{report['unique_questions']} 個不同問題 -> "
+                  f"{report['clusters']} 個常見問題（新產生 {report['answers_generated']} 個答案、沿用 {report['answers_reused']} 個）")
+            reports.append(report)
+    metrics.incr("faq.runs")
+    return reports
+
+
+def run_exclusive(**options) -> Optional[List[dict]]:
+    """以檔案鎖確保同一時間只有一個行程（多 worker 部署時）執行分群；已有其他行程執行中時回傳 None。"""
+    try:
+        import fcntl
+    except ImportError:  # Windows：不支援 flock，直接執行
+        return mine(**options)
+    with open(FAQ_LOCK_PATH, "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            return mine(**options)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class MiningScheduler:
+    """每天 FAQ_MINING_HOUR 點在背景執行一次分群（所有 worker 都會啟動，由檔案鎖確保只執行一次）。"""
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def seconds_until(hour: int, now: Optional[datetime] = None) -> float:
+        now = now or datetime.now()
+        target = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if target <= now:
+            target += timedelta(days=1)
+        return (target - now).total_seconds()
+
+    def _loop(self, hour: int):
+        while not self._stop.wait(self.seconds_until(hour)):
+            try:
+                if run_exclusive() is None:
+                    print("[faq] 其他行程正在分群提問紀錄，略過")
+            except Exception as e:
+                print(f"[faq] 分群提問紀錄失敗: {e}")
+
+    def start(self, hour: int = FAQ_MINING_HOUR):
+        if hour < 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(hour,), name="faq-mining", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+
+# --- /api/ask 使用的常見問題比對 ---
+class FaqIndex:
+    """行程內各章節已有答案的群集中心；每隔 FAQ_RELOAD_CHECK 秒確認是否有新的分群結果。"""
+
+    def __init__(self, reload_check: float = FAQ_RELOAD_CHECK):
+        self.reload_check = reload_check
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+
+    def invalidate(self, chapter: str):
+        with self._lock:
+            self._entries.pop(chapter, None)
+
+    def _load(self, db: Session, chapter: str, version: Optional[int]) -> dict:
+        import numpy as np
+
+        db_path = registry.index_path(chapter)
+        stamp = read_index_stamp(db_path) if db_path else None
+        # 章節重新索引後，舊索引產生的答案不再提供
+        rows = [
+            row for row in db.query(models.FaqCluster.id, models.FaqCluster.centroid, models.FaqCluster.answer, models.FaqCluster.index_stamp)
+            .filter(models.FaqCluster.chapter == chapter, models.FaqCluster.answer.isnot(None))
+            if row.index_stamp == stamp
+        ]
+        entry = {"version": version, "ids": [row.id for row in rows], "answers": [row.answer for row in rows], "centroids": None}
+        if rows:
+            entry["centroids"] = np.stack([np.frombuffer(row.centroid, dtype=np.float32) for row in rows])
+        return entry
+
+    def get(self, chapter: str) -> Optional[dict]:
+        now = time.monotonic()
+        entry = self._entries.get(chapter)
+        if entry is not None and now - entry["checked_at"] < self.reload_check:
+            return entry
+        with SessionLocal() as db:
+            version = db.query(func.max(models.FaqCluster.id)).filter(models.FaqCluster.chapter == chapter).scalar()
+            if entry is None or entry["version"] != version:
+                entry = self._load(db, chapter, version)
+        entry["checked_at"] = now
+        with self._lock:
+            self._entries[chapter] = entry
+        return entry
+
+    def match(self, chapter: str, question: str, embeddings) -> Tuple[Optional[dict], Optional[list]]:
+        """
+        回傳 (相符的群集 {"id", "answer", "similarity"} 或 None, 問題向量)。
+        章節沒有常見問題時不呼叫嵌入模型，向量為 None；有向量時呼叫端可直接用於檢索。
+        """
+        with stage("faq.match"):
+            return self._match(chapter, question, embeddings)
+
+    def _match(self, chapter: str, question: str, embeddings) -> Tuple[Optional[dict], Optional[list]]:
+        import numpy as np
+        from llm_client import LLMUnavailableError
+
+        entry = self.get(chapter)
+        if entry["centroids"] is None:
+            return None, None
+        try:
+            vector = embeddings.embed_query(question)
+        except LLMUnavailableError:
+            return None, None
+        q = np.asarray(vector, dtype=np.float32)
+        if q.shape[0] != entry["centroids"].shape[1]:
+            return None, vector
+        similarity = entry["centroids"] @ (q / (np.linalg.norm(q) or 1.0))
+        best = int(similarity.argmax())
+        if similarity[best] < FAQ_MATCH_THRESHOLD:
+            metrics.incr("faq.misses")
+            return None, vector
+        metrics.incr("faq.hits")
+        return {"id": entry["ids"][best], "answer": entry["answers"][best], "similarity": float(similarity[best])}, vector
+
+
+def record_hit(db: Session, cluster_id: int):
+    db.query(models.FaqCluster).filter(models.FaqCluster.id == cluster_id).update(
+        {models.FaqCluster.hits: models.FaqCluster.hits + 1}, synchronize_session=False)
+    db.commit()
+
+
+def get_clusters(db: Session, chapter: Optional[str] = None, limit: int = 20) -> List[models.FaqCluster]:
+    query = db.query(models.FaqCluster)
+    if chapter:
+        query = query.filter(models.FaqCluster.chapter == chapter)
+    return query.order_by(models.FaqCluster.size.desc(), models.FaqCluster.id).limit(limit).all()
+
+
+faq_index = FaqIndex()
+scheduler = MiningScheduler()
+# 章節重新索引時立即重新載入（舊答案依索引戳記排除）
+registry.on_reindex(faq_index.invalidate)
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="由提問紀錄分群找出常見問題並預先產生答案")
+    parser.add_argument("--chapter", help="只處理此章節")
+    parser.add_argument("--days", type=float, default=FAQ_LOOKBACK_DAYS, help="分群最近幾天的提問")
+    parser.add_argument("--no-answers", dest="answer", action="store_false", help="只分群，不產生答案")
+    args = parser.parse_args()
+    for report in mine(chapter=args.chapter, answer=args.answer, days=args.days):
+        print(f"  {report}")
+
+
+if __name__ == "__main__":
+    main()
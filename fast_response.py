@@ -0,0 +1,127 @@
+# 檔案：fast_response.py
+# 說明：大型列表端點（測驗歷史、提問紀錄、測驗紀錄）的最佳化回應：
+#       以 orjson 序列化、超過門檻時依 Accept-Encoding 壓縮（brotli / gzip）、
+#       以最新資料列計算 ETag（If-None-Match 相符時回傳 304，不必載入資料），以及欄位選擇（例如省略 answer）。
+#       orjson 與 brotli 為選用套件，未安裝時分別退回標準 json 與 gzip。
+
+import gzip
+import hashlib
+import json
+import os
+from functools import lru_cache
+from typing import Any, FrozenSet, Iterable, List, Optional, Set, Type
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, ConfigDict, TypeAdapter, create_model
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 選用套件
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - 選用套件
+    brotli = None
+
+# 回應本文超過此位元組數才壓縮（小回應壓縮的 CPU 成本不划算）
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "5"))
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """以 orjson 序列化的 JSONResponse（未安裝 orjson 時使用精簡格式的標準 json）。"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+@lru_cache(maxsize=None)
+def _list_adapter(schema: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(List[schema])
+
+
+@lru_cache(maxsize=256)
+def _projection(schema: Type[BaseModel], fields: FrozenSet[str]) -> Type[BaseModel]:
+    """只含指定欄位的 schema，省略的欄位（例如 answer 全文）連驗證都不做。"""
+    return create_model(
+        f"{schema.__name__}Projection",
+        __config__=ConfigDict(from_attributes=True),
+        **{name: (info.annotation, info) for name, info in schema.model_fields.items() if name in fields},
+    )
+
+
+def _split(value: Optional[str]) -> Set[str]:
+    return {name.strip() for name in (value or "").split(",") if name.strip()}
+
+
+def select_fields(schema: Type[BaseModel], fields: Optional[str] = None, exclude: Optional[str] = None) -> Optional[Set[str]]:
+    """
+    解析 ?fields=a,b 與 ?exclude=c（逗號分隔的頂層欄位），回傳要輸出的欄位集合；
+    皆未指定時回傳 None（輸出全部欄位）。
+    """
+    include, omit = _split(fields), _split(exclude)
+    if not include and not omit:
+        return None
+    unknown = (include | omit) - set(schema.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"不支援的欄位: {', '.join(sorted(unknown))}（可用：{', '.join(schema.model_fields)}）")
+    return (include or set(schema.model_fields)) - omit
+
+
+def make_etag(*parts: Any) -> str:
+    """由資料版本（例如最新的 id、筆數）與查詢參數計算弱 ETag。"""
+    digest = hashlib.sha1(json.dumps(parts, default=str, ensure_ascii=False).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """If-None-Match 與目前的 ETag 相符時回傳 304 回應，否則回傳 None。"""
+    candidates = {tag.strip() for tag in request.headers.get("if-none-match", "").split(",")}
+    if etag in candidates or "*" in candidates:
+        return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept-Encoding"})
+    return None
+
+
+def _accepted_encodings(request: Request) -> Set[str]:
+    accepted = set()
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        if name and params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(name.lower())
+    return accepted
+
+
+def compress(request: Request, body: bytes):
+    """依 Accept-Encoding 壓縮本文，回傳 (本文, Content-Encoding 或 None)。"""
+    if len(body) < COMPRESSION_MIN_SIZE:
+        return body, None
+    accepted = _accepted_encodings(request)
+    if brotli is not None and "br" in accepted:
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    if "gzip" in accepted:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+    return body, None
+
+
+def serialize_rows(rows: Iterable[Any], schema: Type[BaseModel], include: Optional[Set[str]] = None) -> bytes:
+    """以 schema（或只含 include 欄位的投影）驗證 ORM 物件並序列化為 JSON 陣列。"""
+    adapter = _list_adapter(schema if include is None else _projection(schema, frozenset(include)))
+    items = adapter.validate_python(list(rows), from_attributes=True)
+    return dumps(adapter.dump_python(items, mode="json"))
+
+
+def list_response(request: Request, rows: Iterable[Any], schema: Type[BaseModel], etag: str, include: Optional[Set[str]] = None) -> Response:
+    body, encoding = compress(request, serialize_rows(rows, schema, include))
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
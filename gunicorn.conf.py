@@ -0,0 +1,49 @@
+# 檔案：gunicorn.conf.py
+# 說明：多 worker 部署設定（gunicorn 管理多個 uvicorn worker，僅支援 Linux / macOS）。
+#       用法：gunicorn main:app -c gunicorn.conf.py
+#       master 先匯入應用程式並載入所有章節的 NumPy 索引（memory-map），再 fork 出 worker，
+#       唯讀的向量資料由所有 worker 共用；Gemini 用戶端等不可跨 fork 共用的資源則由各 worker 自行初始化。
+
+import gc
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+# 多 worker 模式預設使用共用的 NumPy 索引與 worker 間共用的 SQLite 快取（須在匯入應用程式前設定）
+os.environ.setdefault("VECTOR_BACKEND", "numpy")
+os.environ.setdefault("CACHE_BACKEND", "sqlite")
+
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Agent 呼叫期限為 AGENT_CALL_TIMEOUT（預設 90 秒），worker 逾時須更長
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+
+
+def when_ready(server):
+    """在 fork worker 之前於 master 執行：建立資料表與全文檢索索引、預先載入章節索引。"""
+    import main
+    import vector_index
+    from database import engine
+
+    # 只在 master 執行一次，避免多個 worker 同時對 SQLite 執行 create_all 與回填；
+    # 環境變數由 fork 出的 worker 繼承，main.lifespan 據此略過同樣的步驟
+    main.init_database()
+    os.environ["DB_INITIALIZED_BY_MASTER"] = "1"
+    engine.dispose()  # 不讓 worker 繼承 master 的資料庫連線
+
+    loaded = vector_index.catalog.preload()
+    size_mb = sum(c["bytes"] for c in vector_index.catalog.status()["chapters"]) / 1e6
+    server.log.info(f"已預先載入 {len(loaded)} 個章節索引（{size_mb:.1f} MB，由所有 worker 共用）")
+
+    # 將目前的物件移出 GC 追蹤，避免 worker 的 GC 寫入物件標頭而觸發 copy-on-write
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # 各 worker 使用自己的連線池
+    from database import engine
+    engine.dispose(close=False)
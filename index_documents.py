@@ -1,19 +1,94 @@
 # 檔案：index_documents.py
 # 說明：重大更新！此腳本現在會掃描 data/ 下的章節子資料夾，
 #       並為每一個章節建立獨立的 ChromaDB 資料庫。
+#       python index_documents.py --watch 持續監看 materials/，只重新索引有檔案變動的章節，
+#       完成後更新索引戳記，執行中的 API 不必重新啟動即可查到新內容。
 
+import argparse
 import os
 import shutil
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader, TextLoader
+from langchain_community.document_loaders import DirectoryLoader, TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_chroma import Chroma
 
+import chunk_dedup
+import pdf_extract
+import vector_index
+from chapter_registry import write_index_stamp
+
 load_dotenv()
 
 ROOT_DATA_PATH = "materials/"
 ROOT_DB_PATH = "chroma_db"
+# 章節資料夾中會被索引的子資料夾與副檔名（與 DirectoryLoader 的 glob 相同，不含子目錄）
+SOURCE_FOLDERS = ("materials", "question_bank")
+SOURCE_SUFFIXES = (".pdf", ".md")
+# --watch：檢查檔案變動的間隔，以及章節最後一次變動後需靜止多久才重新索引（秒）
+WATCH_POLL_INTERVAL = float(os.environ.get("WATCH_POLL_INTERVAL", "2"))
+WATCH_DEBOUNCE = float(os.environ.get("WATCH_DEBOUNCE", "3"))
+
+
+def list_chapters() -> List[str]:
+    return sorted(d for d in os.listdir(ROOT_DATA_PATH) if os.path.isdir(os.path.join(ROOT_DATA_PATH, d)))
+
+
+def load_chapter_documents(chapter: str, pdf_extractor: pdf_extract.PDFExtractor) -> list:
+    """讀取章節 materials/ 與 question_bank/ 中的 PDF 與 Markdown。"""
+    chapter_data_path = os.path.join(ROOT_DATA_PATH, chapter)
+    all_documents = []
+    for folder in SOURCE_FOLDERS:
+        folder_path = os.path.join(chapter_data_path, folder)
+        if not os.path.exists(folder_path):
+            print(f"警告: 在 '{chapter}' 中找不到 '{folder}' 資料夾。")
+            continue
+        print(f"正在讀取 '{folder_path}'...")
+        # Load PDF files
+        all_documents.extend(pdf_extract.load_pdf_directory(folder_path, pdf_extractor))
+        # Load Markdown files
+        loader_md = DirectoryLoader(folder_path, glob='*.md', loader_cls=TextLoader, silent_errors=True)
+        all_documents.extend(loader_md.load())
+    return all_documents
+
+
+def build_chapter_db(chapter: str, all_documents: list, embeddings, db_path: str) -> int:
+    """切割、去重並將章節文件寫入 db_path 的 ChromaDB，回傳區塊數。"""
+    # 切割文件（先移除重複的頁首頁尾，切割後去除重複與近似重複的區塊以減少嵌入次數）
+    dedup_report = chunk_dedup.DedupReport()
+    if chunk_dedup.INDEX_DEDUP:
+        chunk_dedup.strip_repeated_lines(all_documents, dedup_report)
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    chunks = text_splitter.split_documents(all_documents)
+    print(f"文件已成功切割成 {len(chunks)} 個區塊。")
+    if chunk_dedup.INDEX_DEDUP:
+        chunks, dedup_report = chunk_dedup.deduplicate(chunks, dedup_report)
+        print(dedup_report.summary())
+
+    # 建立並儲存該章節的 ChromaDB
+    print(f"正在為 '{chapter}' 建立向量索引...")
+    Chroma.from_documents(documents=chunks, embedding=embeddings, persist_directory=db_path)
+    return len(chunks)
+
+
+def publish_chapter(chapter: str):
+    """匯出共用的 NumPy 索引並更新索引戳記，執行中的 API 各 worker 會在數秒內重新載入。"""
+    chapter_db_path = os.path.join(ROOT_DB_PATH, chapter)
+    manifest = vector_index.export_chapter(chapter, chroma_root=ROOT_DB_PATH)
+    print(f"章節 '{chapter}' 的 NumPy 索引已匯出（版本 {manifest['version']}）。")
+    write_index_stamp(chapter_db_path)
+
+
+def print_pdf_stats(pdf_extractor: pdf_extract.PDFExtractor):
+    stats = pdf_extractor.stats
+    if stats["pages"]:
+        print(f"\nPDF 擷取：{stats['pages']} 頁（快取 {stats['cached_pages']} 頁、解析 {stats['parsed_pages']} 頁），"
+              f"{stats['seconds']:.1f} 秒，{stats['pages'] / max(stats['seconds'], 1e-9):.0f} 頁/秒")
+
 
 def create_vector_db_for_chapters():
     """
@@ -30,7 +105,7 @@ def create_vector_db_for_chapters():
 
     # 取得所有章節資料夾的名稱
     try:
-        chapters = [d for d in os.listdir(ROOT_DATA_PATH) if os.path.isdir(os.path.join(ROOT_DATA_PATH, d))]
+        chapters = list_chapters()
     except FileNotFoundError:
         print(f"錯誤: 根資料夾 '{ROOT_DATA_PATH}' 不存在。請建立它並放入章節資料夾。")
         return
@@ -40,60 +115,200 @@ def create_vector_db_for_chapters():
         return
 
     embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+    # PDF 以行程池平行解析，並依檔案內容快取擷取結果（所有章節共用同一個行程池）
+    pdf_extractor = pdf_extract.PDFExtractor()
 
     # 為每個章節建立資料庫
     for chapter in chapters:
         print(f"\n--- 正在處理章節: {chapter} ---")
-        chapter_data_path = os.path.join(ROOT_DATA_PATH, chapter)
         chapter_db_path = os.path.join(ROOT_DB_PATH, chapter)
-
-        # 檢查 'materials' 和 'question_bank' 資料夾是否存在
-        materials_path = os.path.join(chapter_data_path, 'materials')
-        question_bank_path = os.path.join(chapter_data_path, 'question_bank')
-        
-        all_documents = []
-        
-        if os.path.exists(materials_path):
-            print(f"正在讀取 '{materials_path}'...")
-            # Load PDF files
-            loader_materials_pdf = DirectoryLoader(materials_path, glob='*.pdf', loader_cls=PyPDFLoader, silent_errors=True)
-            all_documents.extend(loader_materials_pdf.load())
-            # Load Markdown files
-            loader_materials_md = DirectoryLoader(materials_path, glob='*.md', loader_cls=TextLoader, silent_errors=True)
-            all_documents.extend(loader_materials_md.load())
-        else:
-            print(f"警告: 在 '{chapter}' 中找不到 'materials' 資料夾。")
-
-        if os.path.exists(question_bank_path):
-            print(f"正在讀取 '{question_bank_path}'...")
-            # Load PDF files
-            loader_qb_pdf = DirectoryLoader(question_bank_path, glob='*.pdf', loader_cls=PyPDFLoader, silent_errors=True)
-            all_documents.extend(loader_qb_pdf.load())
-            # Load Markdown files
-            loader_qb_md = DirectoryLoader(question_bank_path, glob='*.md', loader_cls=TextLoader, silent_errors=True)
-            all_documents.extend(loader_qb_md.load())
-        else:
-            print(f"警告: 在 '{chapter}' 中找不到 'question_bank' 資料夾。")
-
+        all_documents = load_chapter_documents(chapter, pdf_extractor)
         if not all_documents:
             print(f"在 '{chapter}' 的子資料夾中找不到任何文件，跳過此章節。")
             continue
 
-        # 切割文件
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        chunks = text_splitter.split_documents(all_documents)
-        print(f"文件已成功切割成 {len(chunks)} 個區塊。")
-
-        # 建立並儲存該章節的 ChromaDB
-        print(f"正在為 '{chapter}' 建立向量索引...")
-        vector_store = Chroma.from_documents(
-            documents=chunks,
-            embedding=embeddings,
-            persist_directory=chapter_db_path
-        )
+        build_chapter_db(chapter, all_documents, embeddings, chapter_db_path)
         print(f"章節 '{chapter}' 的向量資料庫已成功建立於 '{chapter_db_path}'。")
+        # 同步匯出共用的 NumPy 索引，多 worker 部署的 API 會自動熱重載
+        publish_chapter(chapter)
+
+    print_pdf_stats(pdf_extractor)
+    pdf_extractor.close()
 
     print("\n所有章節處理完畢！")
 
+
+# --- 監看模式 ---
+def reindex_chapter(chapter: str, embeddings, pdf_extractor: pdf_extract.PDFExtractor) -> int:
+    """
+    只重建單一章節，回傳區塊數（章節已沒有文件時移除其索引並回傳 0）。
+    新的 ChromaDB 先建立在 chroma_db/.building-*，完成後才替換 chroma_db/<章節>，
+    重建期間 API 仍使用舊索引回答。
+    """
+    chapter_db_path = os.path.join(ROOT_DB_PATH, chapter)
+    all_documents = load_chapter_documents(chapter, pdf_extractor) if os.path.isdir(os.path.join(ROOT_DATA_PATH, chapter)) else []
+    if not all_documents:
+        print(f"章節 '{chapter}' 已沒有任何文件，移除其索引。")
+        remove_chapter_index(chapter)
+        return 0
+
+    building = os.path.join(ROOT_DB_PATH, f".building-{chapter}-{time.time_ns()}")
+    try:
+        count = build_chapter_db(chapter, all_documents, embeddings, building)
+    except BaseException:
+        shutil.rmtree(building, ignore_errors=True)
+        raise
+    finally:
+        vector_index.release_chroma(building)
+    _swap_directory(building, chapter_db_path)
+    publish_chapter(chapter)
+    return count
+
+
+def _swap_directory(new_path: Optional[str], target: str):
+    """以 new_path 替換 target（new_path 為 None 時只移除 target）。"""
+    retired = os.path.join(ROOT_DB_PATH, f".old-{os.path.basename(target)}-{time.time_ns()}")
+    if os.path.exists(target):
+        os.rename(target, retired)
+    if new_path is not None:
+        os.rename(new_path, target)
+    # Windows 上 API 仍開啟的舊檔案無法刪除，留待下次啟動監看時清除
+    shutil.rmtree(retired, ignore_errors=True)
+
+
+def remove_chapter_index(chapter: str):
+    _swap_directory(None, os.path.join(ROOT_DB_PATH, chapter))
+    try:
+        # 移除 CURRENT 後各 worker 不再使用該章節的 NumPy 索引（版本資料夾留待下次匯出時清理）
+        os.remove(os.path.join(vector_index.VECTOR_INDEX_ROOT, chapter, vector_index.CURRENT_FILE))
+    except OSError:
+        pass
+
+
+def _remove_leftovers():
+    """清除上次中斷或無法刪除而留下的 .building-* / .old-* 資料夾。"""
+    if not os.path.isdir(ROOT_DB_PATH):
+        return
+    for name in os.listdir(ROOT_DB_PATH):
+        if name.startswith((".building-", ".old-")):
+            shutil.rmtree(os.path.join(ROOT_DB_PATH, name), ignore_errors=True)
+
+
+def snapshot_chapter(chapter: str) -> Dict[str, Tuple[int, int]]:
+    """章節中會被索引的檔案 -> (修改時間, 大小)。"""
+    files = {}
+    for folder in SOURCE_FOLDERS:
+        try:
+            entries = os.scandir(os.path.join(ROOT_DATA_PATH, chapter, folder))
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.endswith(SOURCE_SUFFIXES) and entry.is_file():
+                    stat = entry.stat()
+                    files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+class ChapterWatcher:
+    """
+    定期比對各章節資料夾的檔案清單（修改時間與大小）。章節有變動且靜止 debounce 秒後，
+    交給背景執行緒只重新索引該章節；重建期間再有變動，完成後會再重建一次。
+    以輪詢實作，不需額外套件，Windows（create_index.bat）與 Linux 的行為相同。
+    """
+
+    def __init__(self, interval: float = WATCH_POLL_INTERVAL, debounce: float = WATCH_DEBOUNCE):
+        self.interval = interval
+        self.debounce = debounce
+        self.snapshots: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        self.changed_at: Dict[str, float] = {}
+        self.running: Dict[str, Future] = {}
+        # 重新索引依序在同一個背景執行緒執行（PDF 快取的 SQLite 連線只能在建立它的執行緒使用）
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reindex")
+        self._embeddings = None
+        self._pdf_extractor: Optional[pdf_extract.PDFExtractor] = None
+
+    def start(self, reindex_missing: bool = True):
+        _remove_leftovers()
+        os.makedirs(ROOT_DB_PATH, exist_ok=True)
+        for chapter in list_chapters():
+            self.snapshots[chapter] = snapshot_chapter(chapter)
+            # 尚未建立索引的章節（例如監看啟動前才放入）直接排入重建
+            if reindex_missing and self.snapshots[chapter] and not os.path.isdir(os.path.join(ROOT_DB_PATH, chapter)):
+                self.changed_at[chapter] = float("-inf")
+
+    def poll(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        try:
+            chapters = set(list_chapters())
+        except FileNotFoundError:
+            chapters = set()
+        for chapter in chapters | set(self.snapshots):
+            current = snapshot_chapter(chapter) if chapter in chapters else {}
+            if current != self.snapshots.get(chapter, {}):
+                print(f"[watch] 偵測到章節 '{chapter}' 的檔案變動（{len(current)} 個檔案）")
+                self.changed_at[chapter] = now
+            if chapter in chapters:
+                self.snapshots[chapter] = current
+            else:
+                self.snapshots.pop(chapter, None)
+
+        for chapter, changed in list(self.changed_at.items()):
+            if now - changed < self.debounce:
+                continue
+            future = self.running.get(chapter)
+            if future is not None and not future.done():
+                continue
+            del self.changed_at[chapter]
+            self.running[chapter] = self.executor.submit(self._reindex, chapter)
+
+    def _reindex(self, chapter: str):
+        print(f"\n[watch] 開始重新索引章節 '{chapter}'")
+        started = time.perf_counter()
+        try:
+            if self._embeddings is None:
+                self._embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+            if self._pdf_extractor is None:
+                self._pdf_extractor = pdf_extract.PDFExtractor()
+            count = reindex_chapter(chapter, self._embeddings, self._pdf_extractor)
+        except Exception as e:
+            # 下次檔案變動時會再試一次
+            print(f"[watch] 章節 '{chapter}' 重新索引失敗: {e}")
+            return
+        print(f"[watch] 章節 '{chapter}' 重新索引完成：{count} 個區塊，{time.perf_counter() - started:.1f} 秒")
+
+    def run(self):
+        self.start()
+        print(f"[watch] 監看 '{ROOT_DATA_PATH}'（{len(self.snapshots)} 個章節），每 {self.interval:g} 秒檢查、"
+              f"變動靜止 {self.debounce:g} 秒後重新索引。按 Ctrl+C 結束。")
+        try:
+            while True:
+                self.poll()
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            print("\n[watch] 結束監看，等待進行中的重新索引完成...")
+        finally:
+            self.close()
+
+    def close(self):
+        # PDF 快取的連線必須在重新索引的執行緒中關閉
+        self.executor.submit(self._close_extractor)
+        self.executor.shutdown(wait=True)
+
+    def _close_extractor(self):
+        if self._pdf_extractor is not None:
+            print_pdf_stats(self._pdf_extractor)
+            self._pdf_extractor.close()
+            self._pdf_extractor = None
+
+
 if __name__ == "__main__":
-    create_vector_db_for_chapters()
+    parser = argparse.ArgumentParser(description="建立章節向量資料庫")
+    parser.add_argument("--watch", action="store_true", help="持續監看 materials/，只重新索引有變動的章節")
+    parser.add_argument("--interval", type=float, default=WATCH_POLL_INTERVAL, help="檢查檔案變動的間隔（秒）")
+    parser.add_argument("--debounce", type=float, default=WATCH_DEBOUNCE, help="章節變動靜止多久後重新索引（秒）")
+    args = parser.parse_args()
+    if args.watch:
+        ChapterWatcher(args.interval, args.debounce).run()
+    else:
+        create_vector_db_for_chapters()
@@ -0,0 +1,273 @@
+# 檔案：item_stats.py
+# 說明：測驗題目的試題分析（item analysis）。提交測驗時以累計值增量更新三張彙總表，
+#       查詢時直接由累計值算出各題與各主題的難度（答對率）、鑑別度（答對與否和測驗總分的點二系列相關）
+#       與各選項的作答分布，不必掃描所有 Question 資料列。
+#       相同主題、題目、選項與正確答案的題目視為同一題（single-flight 與批次出題產生的共用題目會跨測驗累計）。
+#       重新提交同一份測驗時先扣除上次的作答再加上新的作答。
+#       用法：python item_stats.py rebuild   # 以 NumPy 從所有已作答題目重新計算（回填）
+
+import hashlib
+import math
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, func, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import models
+from crud import _prefix_pattern
+from metrics import metrics
+
+SUM_COLUMNS = ("responses", "correct", "score_sum", "score_sq_sum", "correct_score_sum")
+SORTS = ("discrimination", "difficulty", "responses")
+# 標示需要檢查的題目
+TOO_EASY = 0.9
+TOO_HARD = 0.2
+LOW_DISCRIMINATION = 0.2
+MAX_PAGE_SIZE = 500
+
+
+def item_key(topic: str, question_text: str, choices: List[str], correct_answer_index: int) -> str:
+    payload = "\x1f".join([topic or "", question_text.strip(), str(correct_answer_index), *choices])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _choice_texts(question: models.Question) -> List[str]:
+    return [c.choice_text for c in sorted(question.choices, key=lambda c: c.id)]
+
+
+def _upsert(db: Session, model, keys: List[str], rows: List[dict]):
+    """累計值以 "欄位 = 欄位 + 新值" 更新，並行提交不會互相覆蓋。"""
+    if not rows:
+        return
+    stmt = sqlite_insert(model).values(rows)
+    updates = {column: getattr(model, column) + getattr(stmt.excluded, column)
+               for column in rows[0] if column in SUM_COLUMNS or column == "count"}
+    if hasattr(model, "updated_at"):
+        updates["updated_at"] = func.now()
+    db.execute(stmt.on_conflict_do_update(index_elements=keys, set_=updates))
+
+
+def record_submission(db: Session, attempt: models.QuizAttempt, previous_answers: Dict[int, Optional[int]],
+                      previous_score: Optional[float]):
+    """
+    submit_quiz 評分後、commit 前呼叫（與作答在同一個交易）。
+    previous_answers 為評分前各題的 user_answer_index，previous_score 為評分前的分數。
+    """
+    items: Dict[str, dict] = {}
+    choices: Counter = Counter()
+    topic_sums = dict.fromkeys(SUM_COLUMNS, 0)
+
+    def add(sign: int, key: str, question: models.Question, answer: int, score: float):
+        is_correct = answer == question.correct_answer_index
+        row = items[key]
+        for sums in (row, topic_sums):
+            sums["responses"] += sign
+            sums["correct"] += sign * is_correct
+            sums["score_sum"] += sign * score
+            sums["score_sq_sum"] += sign * score * score
+            sums["correct_score_sum"] += sign * score * is_correct
+        choices[(key, answer)] += sign
+
+    for question in attempt.questions:
+        old, new = previous_answers.get(question.id), question.user_answer_index
+        if old is None and new is None:
+            continue
+        texts = _choice_texts(question)
+        key = item_key(attempt.topic, question.question_text, texts, question.correct_answer_index)
+        items.setdefault(key, {
+            "item_key": key, "topic": attempt.topic or "", "question_text": question.question_text,
+            "correct_answer_index": question.correct_answer_index, "num_choices": len(texts),
+            **dict.fromkeys(SUM_COLUMNS, 0),
+        })
+        if old is not None:
+            add(-1, key, question, old, previous_score or 0.0)
+        if new is not None:
+            add(1, key, question, new, attempt.score or 0.0)
+
+    if not items:
+        return
+    _upsert(db, models.QuestionItemStat, ["item_key"], list(items.values()))
+    _upsert(db, models.QuestionChoiceStat, ["item_key", "choice_index"],
+            [{"item_key": key, "choice_index": answer, "count": count} for (key, answer), count in choices.items() if count])
+    _upsert(db, models.TopicItemStat, ["topic"], [{"topic": attempt.topic or "", **topic_sums}])
+    metrics.incr("item_stats.updates")
+
+
+def describe(responses: float, correct: float, score_sum: float, score_sq_sum: float, correct_score_sum: float) -> dict:
+    """由累計值計算答對率與點二系列相關（作答數不足或總分沒有變異時為 None）。"""
+    if responses <= 0:
+        return {"correct_rate": None, "discrimination": None, "mean_score": None}
+    p = correct / responses
+    mean = score_sum / responses
+    variance = max(score_sq_sum / responses - mean * mean, 0.0)
+    discrimination = None
+    if 0 < correct < responses and variance > 1e-12:
+        mean_correct = correct_score_sum / correct
+        mean_incorrect = (score_sum - correct_score_sum) / (responses - correct)
+        discrimination = (mean_correct - mean_incorrect) / math.sqrt(variance) * math.sqrt(p * (1 - p))
+    return {"correct_rate": round(p, 4), "mean_score": round(mean, 2),
+            "discrimination": None if discrimination is None else round(discrimination, 4)}
+
+
+def _flags(stats: dict) -> List[str]:
+    flags = []
+    p, r = stats["correct_rate"], stats["discrimination"]
+    if p is not None and p >= TOO_EASY:
+        flags.append("too_easy")
+    if p is not None and p <= TOO_HARD:
+        flags.append("too_hard")
+    if r is not None and r < 0:
+        flags.append("negative_discrimination")  # 總分高的學生反而答錯：答案可能有誤
+    elif r is not None and r < LOW_DISCRIMINATION:
+        flags.append("low_discrimination")
+    return flags
+
+
+def _sums(row) -> tuple:
+    return tuple(getattr(row, column) for column in SUM_COLUMNS)
+
+
+def get_item_stats(db: Session, topic: Optional[str] = None, chapter: Optional[str] = None, min_responses: int = 1,
+                   sort: str = "discrimination", limit: int = 100) -> List[dict]:
+    query = db.query(models.QuestionItemStat).filter(models.QuestionItemStat.responses >= max(min_responses, 1))
+    if topic:
+        query = query.filter(models.QuestionItemStat.topic == topic)
+    if chapter:
+        query = query.filter(models.QuestionItemStat.topic.like(_prefix_pattern(f"{chapter} - "), escape="\\"))
+    rows = query.all()
+    counts = defaultdict(dict)
+    keys = [row.item_key for row in rows]
+    for start in range(0, len(keys), 500):
+        for choice in db.query(models.QuestionChoiceStat).filter(models.QuestionChoiceStat.item_key.in_(keys[start:start + 500])):
+            counts[choice.item_key][choice.choice_index] = choice.count
+
+    items = []
+    for row in rows:
+        stats = describe(*_sums(row))
+        distribution = [counts[row.item_key].get(i, 0) for i in range(row.num_choices)]
+        items.append({
+            "item_key": row.item_key, "topic": row.topic, "question_text": row.question_text,
+            "correct_answer_index": row.correct_answer_index, "responses": row.responses,
+            "choice_counts": distribution, **stats, "flags": _flags(stats),
+            "updated_at": row.updated_at,
+        })
+    # 鑑別度低（或負）、極端難易度的題目排在前面
+    sort_key = {
+        "discrimination": lambda i: (i["discrimination"] is None, i["discrimination"] if i["discrimination"] is not None else 0.0),
+        "difficulty": lambda i: i["correct_rate"],
+        "responses": lambda i: -i["responses"],
+    }[sort]
+    items.sort(key=sort_key)
+    return items[:max(1, min(limit, MAX_PAGE_SIZE))]
+
+
+def get_topic_stats(db: Session, chapter: Optional[str] = None) -> List[dict]:
+    query = db.query(models.TopicItemStat).filter(models.TopicItemStat.responses > 0)
+    if chapter:
+        query = query.filter(models.TopicItemStat.topic.like(_prefix_pattern(f"{chapter} - "), escape="\\"))
+    item_counts = dict(db.query(models.QuestionItemStat.topic, func.count(models.QuestionItemStat.id))
+                       .filter(models.QuestionItemStat.responses > 0).group_by(models.QuestionItemStat.topic).all())
+    topics = [{"topic": row.topic, "items": item_counts.get(row.topic, 0), "responses": row.responses,
+               **describe(*_sums(row)), "updated_at": row.updated_at} for row in query.all()]
+    return sorted(topics, key=lambda t: t["topic"])
+
+
+def rebuild(db: Session) -> dict:
+    """以 NumPy 從所有已作答的題目重新計算三張彙總表（取代既有內容）。"""
+    import numpy as np
+
+    started = time.perf_counter()
+    rows = (
+        db.query(models.Question.id, models.Question.question_text, models.Question.correct_answer_index,
+                 models.Question.user_answer_index, models.QuizAttempt.topic, models.QuizAttempt.score)
+        .join(models.QuizAttempt, models.Question.quiz_attempt_id == models.QuizAttempt.id)
+        .filter(models.Question.user_answer_index.isnot(None))
+        .order_by(models.Question.id)
+        .all()
+    )
+    choice_texts: Dict[int, List[str]] = defaultdict(list)
+    for question_id, text in (
+        db.query(models.Choice.question_id, models.Choice.choice_text)
+        .join(models.Question, models.Choice.question_id == models.Question.id)
+        .filter(models.Question.user_answer_index.isnot(None))
+        .order_by(models.Choice.question_id, models.Choice.id)
+    ):
+        choice_texts[question_id].append(text)
+
+    keys, meta = [], {}
+    for row in rows:
+        texts = choice_texts.get(row.id, [])
+        key = item_key(row.topic or "", row.question_text, texts, row.correct_answer_index)
+        keys.append(key)
+        meta.setdefault(key, (row.topic or "", row.question_text, row.correct_answer_index, len(texts)))
+
+    db.execute(delete(models.QuestionChoiceStat))
+    db.execute(delete(models.QuestionItemStat))
+    db.execute(delete(models.TopicItemStat))
+    summary = {"responses": len(rows), "items": 0, "topics": 0}
+    if rows:
+        answers = np.fromiter((r.user_answer_index for r in rows), dtype=np.int64, count=len(rows))
+        correct_index = np.fromiter((r.correct_answer_index for r in rows), dtype=np.int64, count=len(rows))
+        score = np.fromiter((r.score or 0.0 for r in rows), dtype=np.float64, count=len(rows))
+        is_correct = (answers == correct_index).astype(np.float64)
+        unique_keys, item = np.unique(np.asarray(keys), return_inverse=True)
+        unique_topics, topic = np.unique(np.asarray([meta[k][0] for k in keys]), return_inverse=True)
+
+        def sums(groups, size):
+            return {
+                "responses": np.bincount(groups, minlength=size),
+                "correct": np.bincount(groups, weights=is_correct, minlength=size),
+                "score_sum": np.bincount(groups, weights=score, minlength=size),
+                "score_sq_sum": np.bincount(groups, weights=score * score, minlength=size),
+                "correct_score_sum": np.bincount(groups, weights=score * is_correct, minlength=size),
+            }
+
+        item_sums = sums(item, len(unique_keys))
+        topic_sums = sums(topic, len(unique_topics))
+        db.execute(insert(models.QuestionItemStat), [
+            {"item_key": key, "topic": meta[key][0], "question_text": meta[key][1], "correct_answer_index": meta[key][2],
+             "num_choices": meta[key][3], **{c: item_sums[c][i].item() for c in SUM_COLUMNS}}
+            for i, key in enumerate(unique_keys.tolist())
+        ])
+        db.execute(insert(models.TopicItemStat), [
+            {"topic": name, **{c: topic_sums[c][i].item() for c in SUM_COLUMNS}}
+            for i, name in enumerate(unique_topics.tolist())
+        ])
+        # 各題各選項的作答數：以 (題目, 選項) 組成單一索引後一次計數
+        valid = answers >= 0
+        width = int(answers[valid].max()) + 1 if valid.any() else 1
+        pairs, pair_counts = np.unique(item[valid] * width + answers[valid], return_counts=True)
+        if len(pairs):
+            db.execute(insert(models.QuestionChoiceStat), [
+                {"item_key": unique_keys[pair // width].item(), "choice_index": pair % width, "count": count}
+                for pair, count in zip(pairs.tolist(), pair_counts.tolist())
+            ])
+        summary.update(items=len(unique_keys), topics=len(unique_topics))
+    db.commit()
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    print(f"[item-stats] 已重新計算：{summary['responses']} 筆作答、{summary['items']} 題、{summary['topics']} 個主題，{summary['seconds']} 秒")
+    return summary
+
+
+def backfill_if_empty(db: Session) -> Optional[dict]:
+    """彙總表建立前已有作答紀錄時（第一次升級），啟動時回填一次。"""
+    if db.query(models.TopicItemStat.id).first() is not None:
+        return None
+    if db.query(models.Question.id).filter(models.Question.user_answer_index.isnot(None)).first() is None:
+        return None
+    return rebuild(db)
+
+
+if __name__ == "__main__":
+    from database import SessionLocal, engine
+
+    if sys.argv[1:] != ["rebuild"]:
+        print("用法：python item_stats.py rebuild")
+        sys.exit(1)
+    models.Base.metadata.create_all(bind=engine)
+    with SessionLocal() as session:
+        rebuild(session)
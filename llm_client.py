@@ -0,0 +1,222 @@
+# 檔案：llm_client.py
+# 說明：LLM 與嵌入模型的韌性呼叫層。為每次呼叫加上期限、有抖動的指數退避重試、
+#       選用的對沖請求 (hedged request)，以及供應商故障時快速失敗的斷路器。
+
+import contextvars
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_google_genai.chat_models import ChatGoogleGenerativeAIError
+
+from metrics import metrics
+from request_profiling import attach, stage
+
+# --- 可由環境變數調整的設定 ---
+LLM_CALL_TIMEOUT = float(os.environ.get("LLM_CALL_TIMEOUT", "30"))
+AGENT_CALL_TIMEOUT = float(os.environ.get("AGENT_CALL_TIMEOUT", "90"))
+EMBEDDING_CALL_TIMEOUT = float(os.environ.get("EMBEDDING_CALL_TIMEOUT", "10"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.environ.get("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.environ.get("LLM_RETRY_MAX_DELAY", "4"))
+# 超過此秒數仍未回應時，再送出一個相同的請求並採用先回來的結果；0 表示停用
+LLM_HEDGE_DELAY = float(os.environ.get("LLM_HEDGE_DELAY", "0"))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_TIMEOUT", "30"))
+LLM_CLIENT_THREADS = int(os.environ.get("LLM_CLIENT_THREADS", "32"))
+
+# 請求本身有問題（例如參數錯誤），重試也不會成功，且不代表供應商故障
+NON_RETRYABLE_ERRORS = (ValueError, TypeError, KeyError, ChatGoogleGenerativeAIError)
+
+
+class LLMUnavailableError(Exception):
+    """AI 供應商暫時無法使用（逾時或斷路器開啟）。"""
+
+
+class CallTimeoutError(LLMUnavailableError):
+    """呼叫超過期限。"""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """斷路器開啟中，直接拒絕呼叫。"""
+
+
+class CircuitBreaker:
+    """
+    連續失敗達門檻後開啟 (open)，在 reset_timeout 內直接拒絕呼叫；
+    之後進入半開 (half_open) 只放行一個試探呼叫，成功即關閉 (closed)。
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+    _STATE_GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def _set_state(self, state: str):
+        if state != self._state:
+            print(f"[circuit-breaker] {self.name}: {self._state} -> {state}")
+            metrics.incr(f"breaker.{self.name}.transitions.{state}")
+        self._state = state
+        metrics.set_gauge(f"breaker.{self.name}.state", self._STATE_GAUGE[state])
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+
+# 逾時的呼叫無法強制中止，會留在此執行緒池中直到結束，但不再佔用 API worker
+_executor = ThreadPoolExecutor(max_workers=LLM_CLIENT_THREADS, thread_name_prefix="llm-call")
+
+
+def _call_once(name: str, fn: Callable, args: tuple, kwargs: dict, timeout: float, hedge_delay: float) -> Any:
+    deadline = time.monotonic() + timeout
+    # 在執行緒池中沿用目前請求的剖析狀態（每次提交各自複製 context，對沖的兩個呼叫不共用）
+    fn = attach(fn)
+    futures = [_executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)]
+    if 0 < hedge_delay < timeout:
+        done, _ = wait(futures, timeout=hedge_delay)
+        if not done:
+            metrics.incr(f"llm.{name}.hedged")
+            futures.append(_executor.submit(contextvars.copy_context().run, fn, *args, **kwargs))
+
+    pending = set(futures)
+    last_error: Optional[BaseException] = None
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            last_error = future.exception()
+    if last_error is not None and not pending:
+        raise last_error
+    metrics.incr(f"llm.{name}.timeouts")
+    raise CallTimeoutError(f"{name} 呼叫超過 {timeout:.0f} 秒未回應")
+
+
+def call_with_resilience(
+    name: str,
+    fn: Callable,
+    *args: Any,
+    breaker: CircuitBreaker,
+    timeout: float = LLM_CALL_TIMEOUT,
+    retries: int = LLM_MAX_RETRIES,
+    hedge_delay: float = LLM_HEDGE_DELAY,
+    **kwargs: Any,
+) -> Any:
+    """在期限內呼叫 fn，失敗時以有抖動的指數退避重試，並回報給斷路器。"""
+    with stage(f"llm.{name}"):
+        return _call_with_retries(name, fn, args, kwargs, breaker, timeout, retries, hedge_delay)
+
+
+def _call_with_retries(name: str, fn: Callable, args: tuple, kwargs: dict, breaker: CircuitBreaker,
+                       timeout: float, retries: int, hedge_delay: float) -> Any:
+    for attempt in range(retries + 1):
+        if not breaker.allow():
+            metrics.incr(f"llm.{name}.short_circuited")
+            raise CircuitOpenError(f"{breaker.name} 斷路器開啟中，暫停呼叫 AI 服務")
+        start = time.perf_counter()
+        try:
+            result = _call_once(name, fn, args, kwargs, timeout, hedge_delay)
+        except NON_RETRYABLE_ERRORS:
+            breaker.record_success()  # 供應商有回應，只是請求內容有誤
+            metrics.incr(f"llm.{name}.errors")
+            raise
+        except Exception:
+            breaker.record_failure()
+            metrics.incr(f"llm.{name}.errors")
+            if attempt == retries:
+                raise
+            metrics.incr(f"llm.{name}.retries")
+            # full jitter：在 0 ~ 指數上限之間隨機等待，避免大量請求同時重試
+            time.sleep(random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * (2 ** attempt))))
+            continue
+        breaker.record_success()
+        metrics.observe(f"llm.{name}.latency", time.perf_counter() - start)
+        return result
+
+
+# 全域共用的斷路器：聊天模型（含 Agent）與嵌入模型分開計算
+llm_breaker = CircuitBreaker("llm")
+embedding_breaker = CircuitBreaker("embeddings")
+
+
+class ResilientChatModel:
+    """
+    包裝 LangChain chat model：invoke 時套用期限、重試、對沖與斷路器。
+    其他屬性直接轉給原始模型；需要 Runnable 組合（例如 create_react_agent）時請使用 .model。
+    """
+
+    def __init__(self, model, name: str = "llm", breaker: CircuitBreaker = llm_breaker, timeout: float = LLM_CALL_TIMEOUT):
+        self.model = model
+        self.name = name
+        self.breaker = breaker
+        self.timeout = timeout
+
+    def invoke(self, input: Any, config: Optional[dict] = None, **kwargs: Any) -> Any:
+        return call_with_resilience(self.name, self.model.invoke, input, config, breaker=self.breaker, timeout=self.timeout, **kwargs)
+
+    def __getattr__(self, item):
+        return getattr(self.model, item)
+
+
+class ResilientEmbeddings(Embeddings):
+    """包裝 LangChain 嵌入模型，可直接作為 Chroma 的 embedding_function 使用。"""
+
+    def __init__(self, embeddings: Embeddings, breaker: CircuitBreaker = embedding_breaker, timeout: float = EMBEDDING_CALL_TIMEOUT):
+        self.embeddings = embeddings
+        self.breaker = breaker
+        self.timeout = timeout
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # 批次嵌入（建立索引）資料量大，期限隨筆數放寬
+        timeout = self.timeout * max(1, len(texts) / 100)
+        return call_with_resilience("embed_documents", self.embeddings.embed_documents, texts, breaker=self.breaker, timeout=timeout, hedge_delay=0)
+
+    def embed_query(self, text: str) -> List[float]:
+        return call_with_resilience("embed_query", self.embeddings.embed_query, text, breaker=self.breaker, timeout=self.timeout)
+
+
+def invoke_agent(agent_executor, inputs: dict, config: Optional[dict] = None) -> dict:
+    """執行 AgentExecutor；整體套用 Agent 期限與聊天模型的斷路器，不重試也不對沖（工具可能有副作用）。"""
+    return call_with_resilience("agent", agent_executor.invoke, inputs, config, breaker=llm_breaker, timeout=AGENT_CALL_TIMEOUT, retries=0, hedge_delay=0)
@@ -0,0 +1,341 @@
+# 檔案：log_retention.py
+# 說明：提問紀錄（rag_query_logs）的保留與封存。
+#       主資料庫只保留最近 LOG_RETENTION_DAYS 天（熱資料），較舊的紀錄分批移到獨立的封存資料庫，
+#       回答全文以 zstd 壓縮（未安裝 zstandard 時使用 zlib），並可依內容雜湊去除重複的回答。
+#       管理員查詢（提問紀錄列表、大量匯出）超出熱資料範圍時自動讀取封存資料；全文檢索只涵蓋熱資料。
+#       每次執行回報搬移筆數、壓縮率與主資料庫釋放的空間。
+#       用法：python log_retention.py [--days 90] [--vacuum]
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Iterator, List, Optional
+
+from sqlalchemy import text
+
+import models
+from database import engine
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - 選用套件
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+# 主資料庫保留的天數（熱資料）
+LOG_RETENTION_DAYS = float(os.environ.get("LOG_RETENTION_DAYS", "90"))
+LOG_ARCHIVE_PATH = os.environ.get("LOG_ARCHIVE_PATH", "query_logs_archive.db")
+# 定期封存的間隔（小時），0 表示只能手動執行
+LOG_RETENTION_INTERVAL_HOURS = float(os.environ.get("LOG_RETENTION_INTERVAL_HOURS", "0"))
+LOG_RETENTION_BATCH = int(os.environ.get("LOG_RETENTION_BATCH", "2000"))
+# 相同的回答（例如快取命中的答案）在封存中只存一份
+LOG_ARCHIVE_DEDUP = os.environ.get("LOG_ARCHIVE_DEDUP", "1") == "1"
+# 封存後執行 VACUUM 把空間還給檔案系統（會短暫鎖住資料庫；未執行時釋放的頁面留待之後重複使用）
+LOG_RETENTION_VACUUM = os.environ.get("LOG_RETENTION_VACUUM", "0") == "1"
+ZSTD_LEVEL = int(os.environ.get("LOG_ARCHIVE_ZSTD_LEVEL", "9"))
+
+ARCHIVE_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS archived_answers ("
+    " hash TEXT PRIMARY KEY, codec TEXT NOT NULL, data BLOB NOT NULL, raw_size INTEGER NOT NULL) WITHOUT ROWID",
+    # 去重時 answer_hash 指向 archived_answers，否則回答直接存在 answer_data
+    "CREATE TABLE IF NOT EXISTS archived_query_logs ("
+    " id INTEGER PRIMARY KEY, user_id INTEGER, question TEXT NOT NULL, created_at TEXT,"
+    " answer_hash TEXT, answer_codec TEXT, answer_data BLOB)",
+    "CREATE INDEX IF NOT EXISTS ix_archived_query_logs_created_at ON archived_query_logs (created_at)",
+    "CREATE TABLE IF NOT EXISTS compaction_runs ("
+    " id INTEGER PRIMARY KEY, finished_at TEXT NOT NULL, report TEXT NOT NULL)",
+    # 封存筆數等計數器，由封存作業在同一個交易中更新（提問紀錄列表的版本指紋不必每次 count(*)）
+    "CREATE TABLE IF NOT EXISTS archive_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID",
+]
+
+ArchivedExportRow = namedtuple("ArchivedExportRow", "id created_at user_id user_email question answer")
+ArchivedExportRowNoAnswer = namedtuple("ArchivedExportRowNoAnswer", "id created_at user_id user_email question")
+
+
+def _codec() -> str:
+    return "zstd" if zstandard is not None else "zlib"
+
+
+def compress(value: str, codec: str) -> bytes:
+    raw = value.encode("utf-8")
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return zlib.compress(raw, 9)
+
+
+def decompress(data: bytes, codec: str) -> str:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("封存資料以 zstd 壓縮，需要安裝 zstandard 套件")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _db_pages(conn) -> dict:
+    page_size = conn.execute(text("PRAGMA page_size")).scalar()
+    return {"bytes": conn.execute(text("PRAGMA page_count")).scalar() * page_size,
+            "free_bytes": conn.execute(text("PRAGMA freelist_count")).scalar() * page_size}
+
+
+class LogArchive:
+    def __init__(self, path: str = LOG_ARCHIVE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._run_lock = threading.Lock()
+        self.last_report: Optional[dict] = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _conn(self) -> sqlite3.Connection:
+        # 每個執行緒 / 行程各自連線（gunicorn fork 後不可共用）
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in ARCHIVE_SCHEMA:
+                conn.execute(statement)
+            if conn.execute("SELECT 1 FROM archive_meta WHERE key = 'archived_logs'").fetchone() is None:
+                # 加入計數器之前建立的封存資料庫：計算一次
+                conn.execute("INSERT OR IGNORE INTO archive_meta (key, value)"
+                             " SELECT 'archived_logs', count(*) FROM archived_query_logs")
+            conn.commit()
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    # --- 封存 ---
+    def _archive_batch(self, rows, codec: str, dedup: bool, report: dict):
+        conn = self._conn()
+        added = 0
+        for row in rows:
+            raw_size = len(row.answer.encode("utf-8"))
+            report["answer_bytes"] += raw_size
+            answer_hash = answer_data = None
+            if dedup:
+                answer_hash = hashlib.sha256(row.answer.encode("utf-8")).hexdigest()
+                if conn.execute("SELECT 1 FROM archived_answers WHERE hash = ?", (answer_hash,)).fetchone():
+                    report["deduplicated"] += 1
+                else:
+                    data = compress(row.answer, codec)
+                    conn.execute("INSERT INTO archived_answers (hash, codec, data, raw_size) VALUES (?, ?, ?, ?)",
+                                 (answer_hash, codec, data, raw_size))
+                    report["stored_answer_bytes"] += len(data)
+            else:
+                answer_data = compress(row.answer, codec)
+                report["stored_answer_bytes"] += len(answer_data)
+            # 重跑時（上次封存後、刪除前中斷）略過已封存的紀錄
+            added += conn.execute(
+                "INSERT OR IGNORE INTO archived_query_logs (id, user_id, question, created_at, answer_hash, answer_codec, answer_data)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (row.id, row.user_id, row.question, str(row.created_at) if row.created_at else None,
+                 answer_hash, None if dedup else codec, answer_data),
+            ).rowcount
+        conn.execute("UPDATE archive_meta SET value = value + ? WHERE key = 'archived_logs'", (added,))
+        conn.commit()
+
+    def compact(self, days: float = LOG_RETENTION_DAYS, batch_size: int = LOG_RETENTION_BATCH,
+                dedup: bool = LOG_ARCHIVE_DEDUP, vacuum: bool = LOG_RETENTION_VACUUM) -> dict:
+        """
+        將早於 days 天的提問紀錄搬到封存資料庫，回傳報告。每批先寫入封存並提交，再從主資料庫刪除，
+        中途中斷時重跑即可（已封存的紀錄不會重複）。多個 worker 同時觸發時只有一個會執行。
+        """
+        if not self._run_lock.acquire(blocking=False):
+            return {"skipped": "已有封存作業執行中"}
+        lock_file = None
+        try:
+            if fcntl is not None:
+                lock_file = open(self.path + ".lock", "w")
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return {"skipped": "其他行程正在執行封存作業"}
+            return self._compact(days, batch_size, dedup, vacuum)
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+            self._run_lock.release()
+
+    def _compact(self, days: float, batch_size: int, dedup: bool, vacuum: bool) -> dict:
+        started = time.perf_counter()
+        # created_at 以 "YYYY-MM-DD HH:MM:SS" 文字儲存（UTC），以相同格式比較
+        cutoff = str(datetime.utcnow() - timedelta(days=days))
+        codec = _codec()
+        report = {"cutoff": cutoff[:19], "codec": codec, "archived": 0, "deduplicated": 0,
+                  "answer_bytes": 0, "stored_answer_bytes": 0}
+        archive_before = os.path.getsize(self.path) if self.exists() else 0
+        with engine.connect() as conn:
+            before = _db_pages(conn)
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(text(
+                    "SELECT id, user_id, question, answer, created_at FROM rag_query_logs"
+                    " WHERE created_at < :cutoff ORDER BY id LIMIT :limit"), {"cutoff": cutoff, "limit": batch_size}).all()
+                if not rows:
+                    break
+                self._archive_batch(rows, codec, dedup, report)
+                # 依 id 排序取出，因此 id <= 最後一筆且早於 cutoff 的紀錄正好是這一批
+                conn.execute(text("DELETE FROM rag_query_logs WHERE id <= :last AND created_at < :cutoff"),
+                             {"last": rows[-1].id, "cutoff": cutoff})
+            report["archived"] += len(rows)
+        if report["archived"]:
+            self._conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if vacuum and report["archived"]:
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text("VACUUM"))
+        with engine.connect() as conn:
+            after = _db_pages(conn)
+        report.update({
+            "main_db_bytes_before": before["bytes"],
+            "main_db_bytes_after": after["bytes"],
+            # 未執行 VACUUM 時檔案大小不變，釋放的頁面會被之後的寫入重複使用
+            "reclaimed_bytes": before["bytes"] - after["bytes"],
+            "reusable_free_bytes": after["free_bytes"],
+            "archive_bytes_added": (os.path.getsize(self.path) if self.exists() else 0) - archive_before,
+            "compression_ratio": round(report["answer_bytes"] / report["stored_answer_bytes"], 2) if report["stored_answer_bytes"] else None,
+            "vacuum": vacuum,
+            "seconds": round(time.perf_counter() - started, 2),
+        })
+        if report["archived"]:
+            conn = self._conn()
+            conn.execute("INSERT INTO compaction_runs (finished_at, report) VALUES (?, ?)",
+                         (datetime.utcnow().isoformat(timespec="seconds"), json.dumps(report)))
+            conn.commit()
+        self.last_report = report
+        print(f"[retention] 封存 {report['archived']} 筆（去重 {report['deduplicated']}），"
+              f"回答 {report['answer_bytes'] / 1e6:.1f} MB -> {report['stored_answer_bytes'] / 1e6:.1f} MB，"
+              f"主資料庫釋放 {report['reclaimed_bytes'] / 1e6:.1f} MB（可重複使用 {report['reusable_free_bytes'] / 1e6:.1f} MB）")
+        return report
+
+    # --- 讀取（read-through） ---
+    def _answer(self, row) -> Optional[str]:
+        answer_hash, codec, data = row[-3:]
+        if answer_hash is not None:
+            stored = self._conn().execute("SELECT codec, data FROM archived_answers WHERE hash = ?", (answer_hash,)).fetchone()
+            return decompress(stored[1], stored[0]) if stored else None
+        return decompress(data, codec) if data is not None else None
+
+    def count(self) -> int:
+        """封存的紀錄數（讀取 archive_meta 的計數器，不掃描資料表）。"""
+        if not self.exists():
+            return 0
+        return self._conn().execute("SELECT value FROM archive_meta WHERE key = 'archived_logs'").fetchone()[0]
+
+    def fetch_logs(self, db, skip: int, limit: int, load_answer: bool = True) -> List[SimpleNamespace]:
+        """依時間由新到舊分頁讀取封存的紀錄，欄位與 models.RAGQueryLog 相同（可直接用 RAGQueryLogSchema 輸出）。"""
+        if limit <= 0 or not self.exists():
+            return []
+        rows = self._conn().execute(
+            "SELECT id, user_id, question, created_at, answer_hash, answer_codec, answer_data FROM archived_query_logs"
+            " ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?", (limit, skip)).fetchall()
+        users = {u.id: u for u in db.query(models.User).filter(models.User.id.in_({r[1] for r in rows}))}
+        return [SimpleNamespace(id=r[0], user_id=r[1], user=users.get(r[1]), question=r[2], created_at=_parse_time(r[3]),
+                                answer=self._answer(r) if load_answer else None) for r in rows]
+
+    def iter_export_rows(self, db, start=None, end=None, chapter: Optional[str] = None,
+                         include_answer: bool = True, batch_size: int = 1000) -> Iterator[tuple]:
+        """依 id 順序逐批讀取封存的紀錄（供大量匯出），欄位與 crud.iter_query_log_export 相同。"""
+        if not self.exists():
+            return
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("created_at >= ?")
+            params.append(str(start))
+        if end is not None:
+            conditions.append("created_at < ?")
+            params.append(str(end))
+        if chapter:
+            conditions.append("substr(question, 1, ?) = ?")
+            params += [len(chapter) + 3, f"[{chapter}] "]
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = self._conn().execute(
+            "SELECT id, user_id, question, created_at, answer_hash, answer_codec, answer_data FROM archived_query_logs"
+            f"{where} ORDER BY id", params)
+        row_type = ArchivedExportRow if include_answer else ArchivedExportRowNoAnswer
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            emails = dict(db.query(models.User.id, models.User.email).filter(models.User.id.in_({r[1] for r in rows})))
+            for r in rows:
+                values = [r[0], _parse_time(r[3]), r[1], emails.get(r[1]), r[2]]
+                if include_answer:
+                    values.append(self._answer(r))
+                yield row_type(*values)
+
+    def status(self) -> dict:
+        info = {"path": self.path, "codec": _codec(), "retention_days": LOG_RETENTION_DAYS,
+                "interval_hours": LOG_RETENTION_INTERVAL_HOURS, "dedup": LOG_ARCHIVE_DEDUP,
+                "archived_logs": self.count(), "archive_bytes": os.path.getsize(self.path) if self.exists() else 0,
+                "last_report": self.last_report}
+        if self.exists():
+            conn = self._conn()
+            info["unique_answers"] = conn.execute("SELECT count(*) FROM archived_answers").fetchone()[0]
+            last = conn.execute("SELECT finished_at FROM compaction_runs ORDER BY id DESC LIMIT 1").fetchone()
+            info["last_run_at"] = last[0] if last else None
+        with engine.connect() as conn:
+            info["hot_logs"] = conn.execute(text("SELECT count(*) FROM rag_query_logs")).scalar()
+            info["main_db"] = _db_pages(conn)
+        return info
+
+
+class RetentionScheduler:
+    """每 LOG_RETENTION_INTERVAL_HOURS 小時在背景執行一次封存。"""
+
+    def __init__(self, archive: LogArchive):
+        self.archive = archive
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _loop(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.archive.compact()
+            except Exception as e:
+                print(f"[retention] 封存提問紀錄失敗: {e}")
+
+    def start(self, interval_hours: float = LOG_RETENTION_INTERVAL_HOURS):
+        if interval_hours <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval_hours * 3600,), name="log-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+
+# 全域共用的封存
+archive = LogArchive()
+scheduler = RetentionScheduler(archive)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="將較舊的提問紀錄搬到封存資料庫")
+    parser.add_argument("--days", type=float, default=LOG_RETENTION_DAYS, help="主資料庫保留的天數")
+    parser.add_argument("--vacuum", action="store_true", default=LOG_RETENTION_VACUUM, help="封存後執行 VACUUM 縮小主資料庫檔案")
+    parser.add_argument("--no-dedup", dest="dedup", action="store_false", default=LOG_ARCHIVE_DEDUP, help="不依內容雜湊去除重複的回答")
+    args = parser.parse_args()
+    report = archive.compact(days=args.days, dedup=args.dedup, vacuum=args.vacuum)
+    for key, value in report.items():
+        print(f"  {key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
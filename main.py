@@ -2,32 +2,32 @@
 # 說明：FastAPI 主應用程式，整合所有功能。
 
 import os
-import json
-import requests
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from dotenv import load_dotenv, dotenv_values
-from fastapi import FastAPI, Depends, HTTPException, Request, Query
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi import FastAPI, Depends, HTTPException, Request, Query, BackgroundTasks
+from fastapi.responses import RedirectResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import text
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
 from typing import List
 from pathlib import Path
+from datetime import date
 
 # 匯入我們自己的模組
-import models, crud, auth, schemas
+# 注意：LangChain / Chroma / Google GenAI / OAuth 等重量級套件不在此匯入，
+#       RAG 邏輯位於 rag_service.py，由 ai_runtime 在背景暖機或第一次使用時才載入。
+import models, crud, auth, schemas, ai_runtime, chapter_warmup, data_export, query_search, log_retention, quiz_batch, item_stats, tutor_sessions, faq_mining
+from request_profiling import profiler, stage, to_speedscope
+from metrics import metrics
+from singleflight import SingleFlight, normalize_text
+from rate_limit import get_rate_limited_user, llm_admission
 from database import engine, SessionLocal
-
-# LangChain Agent 相關匯入
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_community.vectorstores import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain.agents import tool, AgentExecutor, create_react_agent
-from langchain_community.tools.google_search.tool import GoogleSearchRun
-from langchain_community.utilities.google_search import GoogleSearchAPIWrapper
-from langchain import hub
-
-# Google 驗證相關匯入
-from google_auth_oauthlib.flow import Flow
+from chapter_registry import registry
+from cache import cache
+from fast_response import FastJSONResponse, list_response, make_etag, not_modified, select_fields
 
 # 載入環境變數（明確指定專案根目錄 .env 檔案）
 ENV_PATH = Path(__file__).resolve().parent / ".env"
@@ -43,11 +43,43 @@ if not os.environ.get("SECRET_KEY"):
 # 在開發環境中允許不安全的傳輸 (僅限本地開發)
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
-# 建立資料庫表格
-models.Base.metadata.create_all(bind=engine)
+def init_database():
+    """建立資料表與全文檢索索引並回填既有資料（gunicorn 部署時只由 master 在 fork 前執行一次）。"""
+    # 建立資料庫表格
+    models.Base.metadata.create_all(bind=engine)
+    # 提問紀錄的全文檢索索引（第一次啟動時回填既有資料）
+    query_search.ensure_index(engine)
+    # 資源標籤資料表建立前新增的資源補上標籤列
+    with SessionLocal() as db:
+        crud.backfill_resource_tags(db)
+        # 試題統計資料表建立前已有的作答紀錄回填一次
+        item_stats.backfill_if_empty(db)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # gunicorn.conf.py 的 when_ready 已在 master 執行過時略過，避免多個 worker 同時 create_all 與重建統計
+    if not os.environ.get("DB_INITIALIZED_BY_MASTER"):
+        init_database()
+    # 章節列表改由記憶體中的登錄表提供，並定期掃描 chroma_db
+    registry.reload()
+    registry.start_periodic_scan()
+    # 定期將較舊的提問紀錄移到封存資料庫（LOG_RETENTION_INTERVAL_HOURS）
+    log_retention.scheduler.start()
+    # 每天離峰時段（FAQ_MINING_HOUR）由提問紀錄分群並預先產生常見問題的答案
+    faq_mining.scheduler.start()
+    # AI 系統與章節索引在背景初始化，不延遲伺服器開始接受請求
+    if ai_runtime.AI_WARMUP_ON_STARTUP:
+        if chapter_warmup.CHAPTER_WARMUP_ON_STARTUP:
+            chapter_warmup.start_background_warmup()  # 會先初始化 AI 系統
+        else:
+            ai_runtime.start_background_warmup()
+    yield
+    registry.stop_periodic_scan()
+    log_retention.scheduler.stop()
+    faq_mining.scheduler.stop()
 
 # FastAPI App
-app = FastAPI(title="虛擬助教 API (最終版)")
+app = FastAPI(title="虛擬助教 API (最終版)", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # 設定 CORS
 app.add_middleware(
@@ -59,44 +91,68 @@ app.add_middleware(
 )
 app.add_middleware(SessionMiddleware, secret_key=os.environ["SECRET_KEY"])
 
-# --- 全域資源初始化 ---
-try:
-    # 全域 LLM 和嵌入模型
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.3, convert_system_message_to_human=True)
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-    
-    print("AI 系統初始化成功")
-    ai_system_available = True
-
-except Exception as e:
-    print(f"無法初始化 AI 系統: {e}")
-    ai_system_available = False
-
-# --- Helper 函式來動態載入 Retriever ---
-def get_retriever_for_chapter(chapter: str, db: Session = None):
-    """根據章節名稱動態載入對應的 ChromaDB retriever。"""
-    # 優先從資料庫查找章節資訊
-    if db:
-        db_chapter = crud.get_chapter_by_name(db, chapter)
-        if db_chapter and db_chapter.is_active:
-            db_path = os.path.join("chroma_db", db_chapter.name)
-            if os.path.exists(db_path):
-                vector_store = Chroma(persist_directory=db_path, embedding_function=embeddings)
-                return vector_store.as_retriever(search_kwargs={"k": 3})
-    
-    # 回退到直接文件系統查找
-    db_path = os.path.join("chroma_db", chapter)
-    if not os.path.exists(db_path):
-        raise HTTPException(status_code=404, detail=f"找不到章節 '{chapter}' 的知識庫。")
-    
-    vector_store = Chroma(persist_directory=db_path, embedding_function=embeddings)
-    return vector_store.as_retriever(search_kwargs={"k": 3})
+# 請求剖析與慢請求擷取（見 request_profiling.py；由 /api/admin/profiling 開啟）
+def _finish_profile(profile, status_code: int):
+    if profiler.finish(profile, status_code):
+        profiler.save_later(profile)
+
+async def _profiled_body(body, profile, status_code: int):
+    # 標頭送出時本文可能還在產生（NDJSON / CSV 匯出、批次出題），計時到本文送完或客戶端中斷為止
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        _finish_profile(profile, status_code)
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    profile = profiler.begin(request.method, request.url.path, request.query_params.get("chapter"))
+    if profile is None:
+        return await call_next(request)
+    token = profiler.activate(profile)
+    try:
+        response = await call_next(request)
+    except Exception:
+        _finish_profile(profile, 500)
+        raise
+    finally:
+        profiler.deactivate(token)
+    response.body_iterator = _profiled_body(response.body_iterator, profile, response.status_code)
+    return response
+
+# --- AI 系統 ---
+async def require_ai_system():
+    """確保 AI 系統已初始化（必要時在執行緒池中等待初始化完成），並回傳 rag_service 模組。"""
+    if not ai_runtime.is_ready():
+        await run_in_threadpool(ai_runtime.initialize)
+    if not ai_runtime.is_ready():
+        raise HTTPException(status_code=503, detail="AI 系統尚未準備就緒。")
+    import rag_service
+    return rag_service
+
+# 合併相同的並行問答與出題請求
+ask_flight = SingleFlight("ask", admission=llm_admission)
+quiz_flight = SingleFlight("quiz", admission=llm_admission)
+
+# 共用快取（CACHE_BACKEND）：相同章節的相同問題直接回傳先前的答案；0 = 停用
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+ANALYTICS_SUMMARY_CACHE_TTL = float(os.environ.get("ANALYTICS_SUMMARY_CACHE_TTL", "300"))
+PATH_ANSWER_CACHE = "answer_cache"
+PATH_FAQ = faq_mining.PATH_FAQ
+# 只快取 AI 實際產生的答案與常見問題的答案（故障備援的舊答案不寫回快取）
+CACHEABLE_PATHS = ("fast", "agent", PATH_FAQ)
 
 # --- Google 驗證設定（若憑證缺失則停用登入流程） ---
 GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
-if GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET:
-    flow = Flow.from_client_config(
+
+@lru_cache(maxsize=1)
+def get_oauth_flow():
+    """第一次登入時才建立 OAuth Flow（避免啟動時匯入 google_auth_oauthlib）。"""
+    if not (GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET):
+        return None
+    from google_auth_oauthlib.flow import Flow
+    return Flow.from_client_config(
         client_config={
             "web": {
                 "client_id": GOOGLE_CLIENT_ID,
@@ -109,31 +165,33 @@ if GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET:
         scopes=['openid', 'https://www.googleapis.com/auth/userinfo.email', 'https://www.googleapis.com/auth/userinfo.profile'],
         redirect_uri="http://127.0.0.1:8000/auth/callback"
     )
-else:
-    flow = None
 
 # --- API 端點 ---
 
 # 新增：獲取章節列表
 @app.get("/api/chapters", response_model=List[str])
-async def get_chapters():
-    """掃描資料庫資料夾並回傳所有可用的章節列表。"""
-    db_root = "chroma_db"
-    if not os.path.exists(db_root):
-        return []
-    chapters = [d for d in os.listdir(db_root) if os.path.isdir(os.path.join(db_root, d))]
-    return sorted(chapters)
+async def get_chapters(request: Request, response: Response):
+    """回傳所有已建立索引的章節列表（由章節登錄表提供，支援 If-None-Match）。"""
+    etag = registry.etag
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return registry.indexed_chapters()
 
 # 新增：從資料庫獲取章節列表
 @app.get("/api/chapters/managed", response_model=List[schemas.ChapterListItem])
-async def get_managed_chapters(db: Session = Depends(auth.get_db)):
-    """從資料庫獲取已管理的章節列表"""
-    chapters = crud.get_all_chapters(db, include_inactive=False)
-    return chapters
+async def get_managed_chapters(request: Request, response: Response):
+    """回傳已管理且啟用的章節列表（由章節登錄表提供，支援 If-None-Match）"""
+    etag = registry.etag
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return registry.managed_chapters()
 
 # 驗證 & 使用者
 @app.get("/auth/login")
 async def login_via_google(request: Request):
+    flow = get_oauth_flow()
     if not flow:
         raise HTTPException(status_code=503, detail="Google OAuth 未設定，請設定 GOOGLE_CLIENT_ID/SECRET")
     authorization_url, state = flow.authorization_url(access_type='offline', include_granted_scopes='true')
@@ -142,6 +200,7 @@ async def login_via_google(request: Request):
 
 @app.get("/auth/callback")
 async def auth_callback(request: Request, db: Session = Depends(auth.get_db)):
+    flow = get_oauth_flow()
     if not flow:
         raise HTTPException(status_code=503, detail="Google OAuth 未設定，無法完成登入")
     try:
@@ -173,88 +232,108 @@ async def read_users_me(current_user: models.User = Depends(auth.get_current_use
 async def ask_question(
     request: schemas.AskRequest, 
     chapter: str = Query(..., description="選擇的章節"), # 新增 chapter 查詢參數
-    current_user: models.User = Depends(auth.get_current_user), 
+    current_user: models.User = Depends(get_rate_limited_user), 
     db: Session = Depends(auth.get_db)
 ):
-    if not ai_system_available:
-        raise HTTPException(status_code=503, detail="AI 系統尚未準備就緒。")
+    # 快取命中時不需要 AI 系統（章節剛重新索引時先清除舊答案）
+    registry.check_reindexed(chapter)
+    answer_key = normalize_text(request.question)
+    with stage("answer_cache"):
+        cached = cache.get(f"answers:{chapter}", answer_key)
+    if cached is not None:
+        metrics.incr(f"ask.path.{PATH_ANSWER_CACHE}")
+        crud.log_rag_query(db, user_id=current_user.id, question=f"[{chapter}] {request.question}", answer=cached["answer"])
+        return {"answer": cached["answer"], "path": PATH_ANSWER_CACHE}
+
+    rag_service = await require_ai_system()
     
     try:
-        # 動態建立 Agent 工具
-        retriever = get_retriever_for_chapter(chapter, db)
+        vector_store = rag_service.get_vector_store_for_chapter(chapter)
+        # 相同章節、相同問題的並行請求只會計算一次（包含常見問題比對的嵌入呼叫）；
+        # 屬於某個常見問題群集時直接回覆預先產生的答案，未命中時沿用算好的問題向量檢索
+        key = (chapter, answer_key)
+        (answer, path, faq_id), shared = await ask_flight.do(key, rag_service.answer_with_faq, chapter, request.question, vector_store)
+        if path in CACHEABLE_PATHS and not shared:
+            cache.set(f"answers:{chapter}", answer_key, {"answer": answer, "path": path}, ttl=ANSWER_CACHE_TTL)
+        if faq_id is not None:
+            # 共用結果的每位提問者都算一次命中
+            faq_mining.record_hit(db, faq_id)
         
-        @tool
-        def course_knowledge_base_search(query: str) -> str:
-            f"""當問題與 '{chapter}' 章節的課程內容、講義、作業或評分標準相關時，使用此工具來搜尋內部知識庫。"""
-            docs = retriever.invoke(query)
-            return "\n\n".join(doc.page_content for doc in docs)
-
-        # 設定網路搜尋工具
-        search = GoogleSearchAPIWrapper(
-            google_api_key=os.environ.get("GOOGLE_API_KEY_SEARCH"), 
-            google_cse_id=os.environ.get("GOOGLE_CSE_ID")
-        )
-        web_search_tool = GoogleSearchRun(api_wrapper=search)
-        web_search_tool.name = "internet_search"
-        web_search_tool.description = "當問題涉及即時資訊、最新版本、外部事件或在課程知識庫中找不到答案時，使用此工具進行網路搜尋。"
+        # 記錄查詢（包含章節資訊）；共用結果的每位提問者仍各自記錄
+        with stage("db.log_query"):
+            crud.log_rag_query(db, user_id=current_user.id, question=f"[{chapter}] {request.question}", answer=answer)
+        return {"answer": answer, "path": path}
         
-        tools = [course_knowledge_base_search, web_search_tool]
-        agent_prompt = hub.pull("hwchase17/react")
-        agent = create_react_agent(llm, tools, agent_prompt)
-        agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True, handle_parsing_errors=True)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        metrics.incr("ask.errors")
+        raise HTTPException(status_code=500, detail=f"處理問題時發生錯誤: {e}")
 
-        response = agent_executor.invoke({"input": request.question})
-        answer = response.get("output", "抱歉，我無法處理這個問題。")
-        
-        # 記錄查詢（包含章節資訊）
-        crud.log_rag_query(db, user_id=current_user.id, question=f"[{chapter}] {request.question}", answer=answer)
-        return {"answer": answer}
-        
+# 多輪家教對話：追問時帶入有上限的對話內容（舊回合於背景摘要），同一主題的追問沿用上次的檢索結果
+@app.post("/api/tutor/sessions", response_model=schemas.TutorSessionSchema, status_code=201)
+async def create_tutor_session(req: schemas.TutorSessionCreate, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(auth.get_db)):
+    if registry.index_path(req.chapter) is None:
+        raise HTTPException(status_code=404, detail=f"找不到章節 '{req.chapter}' 的知識庫。")
+    return tutor_sessions.create_session(db, user_id=current_user.id, chapter=req.chapter)
+
+@app.get("/api/tutor/sessions", response_model=List[schemas.TutorSessionListItem])
+async def list_tutor_sessions(chapter: str = Query(None, description="只列出此章節的對話"), current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(auth.get_db)):
+    return tutor_sessions.list_sessions(db, user_id=current_user.id, chapter=chapter)
+
+@app.get("/api/tutor/sessions/{session_id}", response_model=schemas.TutorSessionSchema)
+async def get_tutor_session(session_id: int, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(auth.get_db)):
+    return tutor_sessions.get_session(db, session_id, user_id=current_user.id)
+
+@app.delete("/api/tutor/sessions/{session_id}", status_code=204)
+async def delete_tutor_session(session_id: int, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(auth.get_db)):
+    tutor_sessions.delete_session(db, session_id, user_id=current_user.id)
+    return {"ok": True}
+
+@app.post("/api/tutor/sessions/{session_id}/ask", response_model=schemas.TutorAnswer)
+async def ask_tutor(
+    session_id: int,
+    req: schemas.TutorAskRequest,
+    background_tasks: BackgroundTasks,
+    current_user: models.User = Depends(get_rate_limited_user),
+    db: Session = Depends(auth.get_db),
+):
+    session = tutor_sessions.get_session(db, session_id, user_id=current_user.id)
+    rag_service = await require_ai_system()
+    try:
+        vector_store = rag_service.get_vector_store_for_chapter(session.chapter)
+        async with llm_admission.slot():
+            result = await run_in_threadpool(tutor_sessions.answer, rag_service, db, session_id, current_user.id, req.question, vector_store)
     except HTTPException as e:
         raise e
     except Exception as e:
+        metrics.incr("tutor.errors")
         raise HTTPException(status_code=500, detail=f"處理問題時發生錯誤: {e}")
+    # 回應送出後才將較舊的回合併入摘要，不增加這次請求的延遲
+    if tutor_sessions.needs_summary(session):
+        background_tasks.add_task(tutor_sessions.summarize, rag_service, session_id)
+    return result
 
 # 測驗系統 (更新：支援章節化)
 @app.post("/api/quiz/generate", response_model=schemas.QuizAttemptSchema)
 async def generate_quiz(
     req: schemas.GenerateQuizRequest, 
     chapter: str = Query(..., description="選擇的章節"), # 新增 chapter 查詢參數
-    current_user: models.User = Depends(auth.get_current_user), 
+    current_user: models.User = Depends(get_rate_limited_user), 
     db: Session = Depends(auth.get_db)
 ):
-    if not ai_system_available:
-        raise HTTPException(status_code=503, detail="AI 系統尚未準備就緒。")
+    rag_service = await require_ai_system()
     
     try:
-        retriever = get_retriever_for_chapter(chapter, db)
-        context_docs = retriever.invoke(req.topic)
-        context_text = "\n".join([doc.page_content for doc in context_docs])
+        vector_store = rag_service.get_vector_store_for_chapter(chapter)
+        key = (chapter, normalize_text(req.topic), req.num_questions)
+        quiz_data, shared = await quiz_flight.do(key, rag_service.generate_quiz_data, chapter, req.topic, req.num_questions, vector_store)
         
-        # 建立題目生成提示
-        quiz_prompt = f"""請根據以下關於 '{chapter}' 章節的課程內容，為「{req.topic}」設計一份包含 {req.num_questions} 題單選題的測驗。嚴格依照 JSON 格式輸出。
-        
-課程內容：
----
-{context_text}
----
-
-JSON 格式範例：
-{{"questions": [{{"question_text": "問題？", "choices": ["A", "B", "C"], "correct_answer_index": 0}}]}}
-
-請確保：
-1. 問題與提供的課程內容相關
-2. 選項具有挑戰性且合理
-3. 正確答案索引從 0 開始計算
-4. 嚴格遵循上述 JSON 格式
-"""
-        
-        response = llm.invoke(quiz_prompt)
-        quiz_data = json.loads(response.content)
-        
-        # 建立測驗記錄（包含章節資訊）
+        # 建立測驗記錄（包含章節資訊）；共用題目時每位使用者仍有自己的測驗紀錄
         attempt = crud.create_quiz_attempt(db, user_id=current_user.id, topic=f"{chapter} - {req.topic}", quiz_data=quiz_data)
-        return attempt
+        # 修復後仍不足題數時照常建立測驗，但在回應中標示，讓前端可以提示或重新產生
+        return schemas.QuizAttemptSchema.model_validate(attempt).model_copy(
+            update={"requested": quiz_data["requested"], "incomplete": quiz_data["incomplete"]})
         
     except HTTPException as e:
         raise e
@@ -266,6 +345,9 @@ async def submit_quiz(attempt_id: int, req: schemas.SubmitQuizRequest, current_u
     attempt = crud.get_quiz_attempt(db, attempt_id)
     if not attempt or attempt.user_id != current_user.id:
         raise HTTPException(status_code=404, detail="找不到指定的測驗或權限不足。")
+    # 重新提交時，試題統計要先扣除上次的作答
+    previous_answers = {q.id: q.user_answer_index for q in attempt.questions}
+    previous_score = attempt.score
     correct_count = 0
     for answer in req.answers:
         question = db.query(models.Question).filter(models.Question.id == answer.question_id, models.Question.quiz_attempt_id == attempt_id).first()
@@ -274,24 +356,40 @@ async def submit_quiz(attempt_id: int, req: schemas.SubmitQuizRequest, current_u
             question.is_correct = "correct" if question.user_answer_index == question.correct_answer_index else "incorrect"
             if question.is_correct == "correct": correct_count += 1
     attempt.score = (correct_count / len(attempt.questions)) * 100 if attempt.questions else 0
+    item_stats.record_submission(db, attempt, previous_answers, previous_score)
     db.commit()
     db.refresh(attempt)
+    crud.invalidate_user_topics(current_user.id)
     return attempt
 
 # 個人化 & 數據分析
 @app.get("/api/quiz/history", response_model=List[schemas.QuizResultSchema])
-async def get_my_quiz_history(current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(auth.get_db)):
-    return crud.get_user_quiz_history(db, user_id=current_user.id)
+async def get_my_quiz_history(
+    request: Request,
+    fields: str = Query(None, description="只回傳這些欄位（逗號分隔），例如 id,topic,score,created_at"),
+    exclude: str = Query(None, description="省略這些欄位（逗號分隔），例如 questions"),
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(auth.get_db),
+):
+    include = select_fields(schemas.QuizResultSchema, fields, exclude)
+    etag = make_etag("quiz-history", current_user.id, crud.get_quiz_attempts_version(db, user_id=current_user.id), sorted(include or []))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    return list_response(request, crud.get_user_quiz_history(db, user_id=current_user.id), schemas.QuizResultSchema, etag, include)
 
 @app.get("/api/recommendations", response_model=List[schemas.LearningRecommendation])
 async def get_learning_recommendations(current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(auth.get_db)):
     weak_topics = crud.get_user_weakest_topics(db, user_id=current_user.id)
+    # 所有弱點主題的相關資源以一次查詢取得
+    resources = crud.get_resources_for_topics(db, [t["topic"] for t in weak_topics])
     recommendations = []
     for topic_data in weak_topics:
         recommendations.append(schemas.LearningRecommendation(
             recommendation_type="review_topic",
             topic=topic_data["topic"],
-            reason=f"您在「{topic_data['topic']}」主題的平均測驗分數較低 ({topic_data['average_score']:.1f}分)，建議您多加複習。"
+            reason=f"您在「{topic_data['topic']}」主題的平均測驗分數較低 ({topic_data['average_score']:.1f}分)，建議您多加複習。",
+            resources=[schemas.ExternalResourceSchema.model_validate(r) for r in resources[topic_data["topic"]]],
         ))
     return recommendations
 
@@ -315,7 +413,9 @@ async def create_chapter(
         os.makedirs(os.path.join(chapter.folder_path, "materials"), exist_ok=True)
         os.makedirs(os.path.join(chapter.folder_path, "question_bank"), exist_ok=True)
     
-    return crud.create_chapter(db, chapter)
+    db_chapter = crud.create_chapter(db, chapter)
+    registry.refresh_from_db(db)
+    return db_chapter
 
 @app.get("/api/admin/chapters", response_model=List[schemas.ChapterSchema])
 async def list_all_chapters(
@@ -349,6 +449,7 @@ async def update_chapter(
     updated_chapter = crud.update_chapter(db, chapter_id, chapter_update)
     if not updated_chapter:
         raise HTTPException(status_code=404, detail="找不到指定的章節")
+    registry.refresh_from_db(db)
     return updated_chapter
 
 @app.patch("/api/admin/chapters/{chapter_id}/toggle", response_model=schemas.ChapterSchema)
@@ -361,6 +462,7 @@ async def toggle_chapter_status(
     chapter = crud.toggle_chapter_status(db, chapter_id)
     if not chapter:
         raise HTTPException(status_code=404, detail="找不到指定的章節")
+    registry.refresh_from_db(db)
     return chapter
 
 @app.delete("/api/admin/chapters/{chapter_id}", status_code=204)
@@ -372,6 +474,7 @@ async def delete_chapter(
     """刪除章節"""
     if not crud.delete_chapter(db, chapter_id):
         raise HTTPException(status_code=404, detail="找不到指定的章節")
+    registry.refresh_from_db(db)
     return {"ok": True}
 
 @app.post("/api/admin/chapters/{chapter_id}/reindex", status_code=200)
@@ -405,6 +508,16 @@ async def add_resource(resource: schemas.ExternalResourceCreate, current_admin:
 async def list_resources(current_admin: models.User = Depends(auth.get_current_admin_user), db: Session = Depends(auth.get_db)):
     return crud.get_external_resources(db)
 
+@app.get("/api/admin/resources/search", response_model=List[schemas.ExternalResourceSchema])
+async def search_resources(
+    tags: str = Query(..., description="逗號分隔的標籤"),
+    match: str = Query("any", description="any（符合任一標籤）或 all（符合全部標籤）"),
+    current_admin: models.User = Depends(auth.get_current_admin_user), db: Session = Depends(auth.get_db),
+):
+    if match not in ("any", "all"):
+        raise HTTPException(status_code=400, detail="match 只能是 any 或 all")
+    return crud.search_external_resources(db, tags, match_all=match == "all")
+
 @app.delete("/api/admin/resources/{resource_id}", status_code=204)
 async def remove_resource(resource_id: int, current_admin: models.User = Depends(auth.get_current_admin_user), db: Session = Depends(auth.get_db)):
     if not crud.delete_external_resource(db, resource_id):
@@ -412,20 +525,134 @@ async def remove_resource(resource_id: int, current_admin: models.User = Depends
     return {"ok": True}
 
 @app.get("/api/admin/analytics/query-logs", response_model=List[schemas.RAGQueryLogSchema])
-async def get_query_logs(current_admin: models.User = Depends(auth.get_current_admin_user), db: Session = Depends(auth.get_db), skip: int = 0, limit: int = 100):
-    return crud.get_all_query_logs(db, skip=skip, limit=limit)
+async def get_query_logs(
+    request: Request,
+    current_admin: models.User = Depends(auth.get_current_admin_user), db: Session = Depends(auth.get_db),
+    skip: int = 0, limit: int = 100,
+    fields: str = Query(None, description="只回傳這些欄位（逗號分隔）"),
+    exclude: str = Query(None, description="省略這些欄位（逗號分隔），例如 answer"),
+):
+    include = select_fields(schemas.RAGQueryLogSchema, fields, exclude)
+    etag = make_etag("query-logs", crud.get_query_logs_version(db), skip, limit, sorted(include or []))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    logs = crud.get_all_query_logs(db, skip=skip, limit=limit, load_answer=include is None or "answer" in include)
+    return list_response(request, logs, schemas.RAGQueryLogSchema, etag, include)
+
+@app.get("/api/admin/analytics/query-logs/search", response_model=schemas.QueryLogSearchPage)
+async def search_query_logs(
+    q: str = Query(..., description='搜尋詞；"片語"、前綴*、-排除'),
+    chapter: str = Query(None, description="只搜尋此章節"),
+    field: str = Query(None, description="只搜尋 question 或 answer"),
+    order: str = Query("recent", description="recent（由新到舊）或 relevance（相關度）"),
+    limit: int = Query(20, ge=1, le=query_search.MAX_PAGE_SIZE),
+    cursor: str = Query(None, description="上一頁回傳的 next_cursor"),
+    current_admin: models.User = Depends(auth.get_current_admin_user), db: Session = Depends(auth.get_db),
+):
+    return query_search.search(db, q, chapter=chapter, field=field, order=order, limit=limit, cursor=cursor)
 
 @app.get("/api/admin/analytics/quiz-attempts", response_model=List[schemas.QuizAttemptAdminView])
-async def get_quiz_attempts_analytics(current_admin: models.User = Depends(auth.get_current_admin_user), db: Session = Depends(auth.get_db), skip: int = 0, limit: int = 100):
-    return crud.get_all_quiz_attempts(db, skip=skip, limit=limit)
+async def get_quiz_attempts_analytics(
+    request: Request,
+    current_admin: models.User = Depends(auth.get_current_admin_user), db: Session = Depends(auth.get_db),
+    skip: int = 0, limit: int = 100,
+    fields: str = Query(None, description="只回傳這些欄位（逗號分隔）"),
+    exclude: str = Query(None, description="省略這些欄位（逗號分隔），例如 questions"),
+):
+    include = select_fields(schemas.QuizAttemptAdminView, fields, exclude)
+    etag = make_etag("quiz-attempts", crud.get_quiz_attempts_version(db), skip, limit, sorted(include or []))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    attempts = crud.get_all_quiz_attempts(db, skip=skip, limit=limit, load_questions=include is None or "questions" in include)
+    return list_response(request, attempts, schemas.QuizAttemptAdminView, etag, include)
+
+@app.get("/api/admin/export/query-logs")
+async def export_query_logs(
+    current_admin: models.User = Depends(auth.get_current_admin_user),
+    format: str = Query("ndjson", description="ndjson、csv 或 parquet"),
+    start: date = Query(None, description="起始日期（UTC，含當天），例如 2024-09-01"),
+    end: date = Query(None, description="結束日期（UTC，含當天）"),
+    chapter: str = Query(None, description="只匯出此章節的提問"),
+    include_answer: bool = Query(True, description="是否包含回答全文"),
+):
+    """串流匯出提問紀錄（逐批讀取，不受筆數限制）。"""
+    start_at, end_at = data_export.date_range(start, end)
+    return data_export.export_query_logs(format, start_at, end_at, chapter, include_answer)
+
+@app.get("/api/admin/export/quiz-attempts")
+async def export_quiz_attempts(
+    current_admin: models.User = Depends(auth.get_current_admin_user),
+    format: str = Query("ndjson", description="ndjson、csv 或 parquet"),
+    start: date = Query(None, description="起始日期（UTC，含當天），例如 2024-09-01"),
+    end: date = Query(None, description="結束日期（UTC，含當天）"),
+    chapter: str = Query(None, description="只匯出此章節的測驗"),
+):
+    """串流匯出測驗紀錄（每次測驗一列，含題數與答對題數）。"""
+    start_at, end_at = data_export.date_range(start, end)
+    return data_export.export_quiz_attempts(format, start_at, end_at, chapter)
+
+@app.get("/api/admin/analytics/items", response_model=List[schemas.ItemStatSchema])
+async def get_item_statistics(
+    topic: str = Query(None, description="完整主題（例如 chapter1 - 過擬合）"),
+    chapter: str = Query(None),
+    min_responses: int = Query(5, ge=1, description="作答數少於此值的題目不列出"),
+    sort: str = Query("discrimination", description="discrimination（鑑別度低者在前）、difficulty（答對率低者在前）或 responses"),
+    limit: int = Query(100, ge=1, le=item_stats.MAX_PAGE_SIZE),
+    current_admin: models.User = Depends(auth.get_current_admin_user), db: Session = Depends(auth.get_db),
+):
+    """各題的難度（答對率）、鑑別度（點二系列相關）與選項分布，由提交測驗時增量維護的彙總表計算。"""
+    if sort not in item_stats.SORTS:
+        raise HTTPException(status_code=400, detail=f"不支援的排序: {sort}（可用：{', '.join(item_stats.SORTS)}）")
+    return item_stats.get_item_stats(db, topic=topic, chapter=chapter, min_responses=min_responses, sort=sort, limit=limit)
+
+@app.get("/api/admin/analytics/topics", response_model=List[schemas.TopicStatSchema])
+async def get_topic_statistics(chapter: str = Query(None), current_admin: models.User = Depends(auth.get_current_admin_user), db: Session = Depends(auth.get_db)):
+    return item_stats.get_topic_stats(db, chapter=chapter)
+
+@app.post("/api/admin/analytics/items/rebuild", response_model=dict)
+async def rebuild_item_statistics(current_admin: models.User = Depends(auth.get_current_admin_user)):
+    """以所有已作答的題目重新計算試題統計（回填或修正用）。"""
+    def run():
+        with SessionLocal() as db:
+            return item_stats.rebuild(db)
+    return await run_in_threadpool(run)
+
+# 常見問題：由提問紀錄分群，較大的群集預先產生答案，/api/ask 命中時直接回覆
+@app.get("/api/admin/faq/clusters", response_model=List[schemas.FaqClusterSchema])
+async def get_faq_clusters(
+    chapter: str = Query(None, description="只列出此章節的常見問題"),
+    limit: int = Query(20, ge=1, le=200),
+    current_admin: models.User = Depends(auth.get_current_admin_user),
+    db: Session = Depends(auth.get_db),
+):
+    return faq_mining.get_clusters(db, chapter=chapter, limit=limit)
+
+@app.post("/api/admin/faq/mine", response_model=List[dict])
+async def mine_faq_clusters(
+    chapter: str = Query(None, description="只分群此章節（預設為所有章節）"),
+    days: float = Query(faq_mining.FAQ_LOOKBACK_DAYS, gt=0, description="分群最近幾天的提問"),
+    answer: bool = Query(True, description="是否為新的常見問題產生答案"),
+    current_admin: models.User = Depends(auth.get_current_admin_user),
+):
+    """立即分群提問紀錄（平時由 FAQ_MINING_HOUR 排程於離峰時段執行）。"""
+    await require_ai_system()
+    reports = await run_in_threadpool(faq_mining.run_exclusive, chapter=chapter, answer=answer, days=days)
+    if reports is None:
+        raise HTTPException(status_code=409, detail="其他行程正在分群提問紀錄，請稍後再試。")
+    return reports
 
 @app.get("/api/admin/analytics/summary", response_model=schemas.AnalyticsSummary)
 async def get_analytics_summary(current_admin: models.User = Depends(auth.get_current_admin_user), db: Session = Depends(auth.get_db)):
-    if not llm:
-        raise HTTPException(status_code=503, detail="AI 系統尚未準備就緒。")
+    # 摘要需要一次 LLM 呼叫，短時間內重複查看時共用結果
+    cached = cache.get("analytics:summary", "latest")
+    if cached is not None:
+        return schemas.AnalyticsSummary(summary=cached)
+    rag_service = await require_ai_system()
     
-    recent_queries = crud.get_all_query_logs(db, limit=20)
-    quiz_attempts = crud.get_all_quiz_attempts(db, limit=20)
+    recent_queries = crud.get_all_query_logs(db, limit=20, load_answer=False)
+    quiz_attempts = crud.get_all_quiz_attempts(db, limit=20, load_questions=False)
     
     queries_text = "\n".join([f"- {log.question}" for log in recent_queries])
     quiz_text = "\n".join([f"- 主題: {att.topic}, 分數: {att.score}" for att in quiz_attempts])
@@ -443,11 +670,149 @@ async def get_analytics_summary(current_admin: models.User = Depends(auth.get_cu
     你的分析與建議：
     """
     try:
-        response = llm.invoke(summary_prompt)
+        async with llm_admission.slot():
+            response = await run_in_threadpool(rag_service.invoke_llm, summary_prompt, "analytics-summary")
+        cache.set("analytics:summary", "latest", response.content, ttl=ANALYTICS_SUMMARY_CACHE_TTL)
         return schemas.AnalyticsSummary(summary=response.content)
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"產生分析摘要時發生錯誤: {e}")
 
+@app.get("/api/admin/retention", response_model=dict)
+async def get_retention_status(current_admin: models.User = Depends(auth.get_current_admin_user)):
+    """熱資料與封存的筆數、檔案大小，以及上次封存的報告。"""
+    return await run_in_threadpool(log_retention.archive.status)
+
+@app.post("/api/admin/retention/run", response_model=dict)
+async def run_retention(
+    days: float = Query(None, gt=0, description="主資料庫保留的天數（預設 LOG_RETENTION_DAYS）"),
+    vacuum: bool = Query(None, description="封存後執行 VACUUM（預設 LOG_RETENTION_VACUUM）"),
+    current_admin: models.User = Depends(auth.get_current_admin_user),
+):
+    """立即封存較舊的提問紀錄，回傳搬移筆數與釋放的空間。"""
+    options = {k: v for k, v in {"days": days, "vacuum": vacuum}.items() if v is not None}
+    return await run_in_threadpool(log_retention.archive.compact, **options)
+
+@app.get("/api/admin/warmup", response_model=dict)
+async def get_warmup_status(current_admin: models.User = Depends(auth.get_current_admin_user)):
+    """回傳各章節索引的預熱狀態與載入時間。"""
+    return chapter_warmup.status()
+
+@app.post("/api/admin/warmup", response_model=dict, status_code=202)
+async def trigger_warmup(current_admin: models.User = Depends(auth.get_current_admin_user)):
+    """在背景重新預熱所有啟用章節。"""
+    if chapter_warmup.status()["running"]:
+        raise HTTPException(status_code=409, detail="章節預熱正在進行中")
+    chapter_warmup.start_background_warmup()
+    return {"message": "章節預熱已開始"}
+
+@app.post("/api/admin/quiz/batch")
+async def generate_quiz_batch(
+    req: schemas.QuizBatchRequest,
+    chapter: str = Query(..., description="選擇的章節"),
+    current_admin: models.User = Depends(auth.get_current_admin_user),
+):
+    """
+    一次為多個主題出題，以 NDJSON 串流回傳：每個主題完成時一行（type=topic），
+    最後一行為摘要（type=summary，persist=true 時含在同一交易中建立的測驗 id）。
+    """
+    rag_service = await require_ai_system()
+    return quiz_batch.batch_response(quiz_flight, rag_service, chapter, req, current_admin.id)
+
+@app.get("/api/admin/vector-index", response_model=dict)
+async def get_vector_index_status(current_admin: models.User = Depends(auth.get_current_admin_user)):
+    """回傳此 worker 已載入的共用 NumPy 索引（章節、版本、向量數與大小）。"""
+    import vector_index
+    return vector_index.catalog.status()
+
+@app.post("/api/admin/vector-index/{chapter}/publish", response_model=dict)
+async def publish_vector_index(chapter: str, current_admin: models.User = Depends(auth.get_current_admin_user)):
+    """章節重新索引後，匯出新版本的 NumPy 索引；所有 worker 會在數秒內熱重載。"""
+    rag_service = await require_ai_system()
+    try:
+        manifest = await run_in_threadpool(rag_service.publish_chapter_index, chapter)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    cache.invalidate(f"answers:{chapter}")  # 內容已更新，舊答案不再適用
+    return {"message": f"章節 '{chapter}' 的索引已發佈", "manifest": manifest}
+
+@app.get("/api/admin/cache", response_model=dict)
+async def get_cache_stats(current_admin: models.User = Depends(auth.get_current_admin_user)):
+    """回傳快取後端、項目數與各命名空間的命中統計（統計只反映處理此請求的 worker）。"""
+    return await run_in_threadpool(cache.stats)
+
+@app.delete("/api/admin/cache/{namespace}", response_model=dict)
+async def invalidate_cache(namespace: str, current_admin: models.User = Depends(auth.get_current_admin_user)):
+    """清除整個命名空間（含子命名空間），例如 answers 或 answers:chapter1。"""
+    removed = await run_in_threadpool(cache.invalidate, namespace)
+    return {"namespace": namespace, "removed": removed}
+
+# 請求剖析：開啟取樣 / cProfile、查看與下載擷取結果（慢請求不需開啟也會擷取）
+@app.get("/api/admin/profiling", response_model=dict)
+async def get_profiling_status(current_admin: models.User = Depends(auth.get_current_admin_user)):
+    captures = await run_in_threadpool(profiler.list_captures)
+    return {"config": profiler.describe_config(), "pid": os.getpid(), "active_requests": profiler.active_count(), "captures": captures}
+
+@app.put("/api/admin/profiling", response_model=dict)
+async def configure_profiling(settings: schemas.ProfilingSettings, current_admin: models.User = Depends(auth.get_current_admin_user)):
+    return profiler.configure(**settings.model_dump())
+
+@app.delete("/api/admin/profiling", response_model=dict)
+async def clear_profiling_captures(current_admin: models.User = Depends(auth.get_current_admin_user)):
+    return {"removed": await run_in_threadpool(profiler.clear)}
+
+@app.get("/api/admin/profiling/{capture_id}", response_model=dict)
+async def get_profiling_capture(capture_id: str, current_admin: models.User = Depends(auth.get_current_admin_user)):
+    data = await run_in_threadpool(profiler.load, capture_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="找不到指定的剖析結果")
+    return data
+
+@app.get("/api/admin/profiling/{capture_id}/download")
+async def download_profiling_capture(
+    capture_id: str,
+    format: str = Query("speedscope", pattern="^(pstats|speedscope)$", description="pstats（cprofile 模式）或 speedscope（取樣）"),
+    current_admin: models.User = Depends(auth.get_current_admin_user),
+):
+    if format == "pstats":
+        body = await run_in_threadpool(profiler.pstats_bytes, capture_id)
+        if body is None:
+            raise HTTPException(status_code=404, detail="此擷取沒有 cProfile 結果（只有 cprofile 模式會產生）")
+        return Response(content=body, media_type="application/octet-stream",
+                        headers={"Content-Disposition": f'attachment; filename="{capture_id}.prof"'})
+    data = await run_in_threadpool(profiler.load, capture_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="找不到指定的剖析結果")
+    if not data["samples"]:
+        raise HTTPException(status_code=404, detail="此擷取沒有取樣的呼叫堆疊（請使用 sample 模式或查看慢請求）")
+    return FastJSONResponse(content=to_speedscope(data),
+                            headers={"Content-Disposition": f'attachment; filename="{capture_id}.speedscope.json"'})
+
+@app.get("/api/admin/metrics", response_model=dict)
+async def get_metrics(current_admin: models.User = Depends(auth.get_current_admin_user)):
+    """回傳行程內的計數器與延遲統計（例如 /api/ask 快速路徑與 Agent 路徑的延遲分布）。"""
+    return metrics.snapshot()
+
+# 健康檢查：/healthz 只代表行程存活；/readyz 代表資料庫與 AI 系統都已可服務
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    checks = {"ai": ai_runtime.status(), "chapters": chapter_warmup.status()}
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        checks["database"] = {"status": "ready"}
+    except Exception as e:
+        checks["database"] = {"status": "failed", "error": str(e)}
+    ready = ai_runtime.is_ready() and checks["database"]["status"] == "ready" and chapter_warmup.is_complete()
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "checks": checks})
+
 @app.get("/")
 def read_root():
     return {"message": "歡迎使用虛擬助教 API！請前往 /docs 查看 API 文件。"}
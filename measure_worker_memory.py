@@ -0,0 +1,97 @@
+# 檔案：measure_worker_memory.py
+# 說明：量測多 worker 部署時每個行程的記憶體用量（讀取 Linux 的 /proc/<pid>/smaps_rollup）。
+#       RSS 會重複計算共用分頁；PSS 將共用分頁平均分攤給共用的行程，加總即為實際用量。
+#       用法：python measure_worker_memory.py <gunicorn master pid>
+#             python measure_worker_memory.py --start [--workers 4] [--port 8766]
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import requests
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def read_rollup(pid: int) -> dict:
+    """回傳 smaps_rollup 中的欄位（單位 MB）。"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts and parts[0].rstrip(":") in FIELDS:
+                values[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return values
+
+
+def child_pids(pid: int) -> list:
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # 第 4 個欄位為父行程 id（行程名稱可能含空白，從右括號之後解析）
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def report(master_pid: int):
+    rows = [("master", master_pid)] + [(f"worker {i + 1}", pid) for i, pid in enumerate(child_pids(master_pid))]
+    print(f"{'行程':10s} {'pid':>7s} " + " ".join(f"{name:>14s}" for name in FIELDS))
+    total_pss = 0.0
+    for label, pid in rows:
+        values = read_rollup(pid)
+        total_pss += values.get("Pss", 0)
+        print(f"{label:10s} {pid:7d} " + " ".join(f"{values.get(name, 0):11.1f} MB" for name in FIELDS))
+    workers = len(rows) - 1
+    print(f"\n{workers} 個 worker，PSS 總和：{total_pss:.1f} MB（平均每個行程 {total_pss / len(rows):.1f} MB）")
+
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), GUNICORN_BIND=f"127.0.0.1:{port}")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "main:app", "-c", "gunicorn.conf.py"],
+        cwd=PROJECT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/healthz", timeout=0.5).status_code == 200:
+                break
+        except requests.RequestException:
+            time.sleep(0.2)
+    time.sleep(3)  # 等所有 worker 完成 lifespan 與背景預熱
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量測多 worker 部署的每行程記憶體")
+    parser.add_argument("pid", type=int, nargs="?", help="gunicorn master 的 pid")
+    parser.add_argument("--start", action="store_true", help="以 gunicorn.conf.py 啟動伺服器後量測")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    if args.start:
+        server = start_server(args.workers, args.port)
+        try:
+            report(server.pid)
+        finally:
+            server.terminate()
+            server.wait()
+    elif args.pid:
+        report(args.pid)
+    else:
+        parser.error("請指定 master pid 或使用 --start")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# 檔案：metrics.py
+# 說明：行程內的簡易指標收集（計數器、量測值與延遲統計），供管理員端點查詢。
+
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Dict
+
+# 每個延遲指標保留最近多少筆樣本來計算百分位數
+TIMING_WINDOW = 1000
+
+
+class Metrics:
+    """執行緒安全的指標容器。"""
+
+    def __init__(self, window: int = TIMING_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, float] = {}
+        self._timings: Dict[str, deque] = defaultdict(lambda: deque(maxlen=self._window))
+        self._timing_counts: Dict[str, int] = defaultdict(int)
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            self._timings[name].append(seconds)
+            self._timing_counts[name] += 1
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    @staticmethod
+    def _percentile(sorted_values, q: float) -> float:
+        index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+        return sorted_values[index]
+
+    def snapshot(self) -> dict:
+        """回傳目前所有指標；延遲以毫秒表示。"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            timings = {name: (sorted(values), self._timing_counts[name]) for name, values in self._timings.items()}
+        timing_stats = {}
+        for name, (values, count) in timings.items():
+            if not values:
+                continue
+            timing_stats[name] = {
+                "count": count,
+                "avg_ms": round(sum(values) / len(values) * 1000, 2),
+                "p50_ms": round(self._percentile(values, 0.50) * 1000, 2),
+                "p95_ms": round(self._percentile(values, 0.95) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2),
+            }
+        return {"counters": counters, "gauges": gauges, "timings": timing_stats}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timings.clear()
+            self._timing_counts.clear()
+
+
+# 全域共用的指標實例
+metrics = Metrics()
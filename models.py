@@ -1,7 +1,7 @@
 # 檔案：models.py
 # 說明：定義資料庫中的資料表結構。
 
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, JSON, Float, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, JSON, Float, DateTime, Index, UniqueConstraint, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -55,6 +55,58 @@ class ExternalResource(Base):
     title = Column(String, nullable=False)
     description = Column(Text)
     tags = Column(String) # Comma-separated tags for searching
+    
+    # 正規化後的標籤（查詢用），與 tags 同步
+    tag_entries = relationship("ResourceTag", back_populates="resource", cascade="all, delete-orphan")
+
+class ResourceTag(Base):
+    __tablename__ = "resource_tags"
+    id = Column(Integer, primary_key=True, index=True)
+    resource_id = Column(Integer, ForeignKey("external_resources.id"), nullable=False)
+    tag = Column(String, nullable=False) # 小寫、去除多餘空白
+    
+    resource = relationship("ExternalResource", back_populates="tag_entries")
+    __table_args__ = (
+        UniqueConstraint("resource_id", "tag"),
+        Index("ix_resource_tags_tag_resource", "tag", "resource_id"),
+    )
+
+# --- 題目作答統計（item_stats 於提交測驗時增量更新）---
+# 累計值：responses 作答數、correct 答對數、score_sum / score_sq_sum 作答者測驗總分的和與平方和、
+# correct_score_sum 答對者的總分和；難度與鑑別度（點二系列相關）由這些值計算
+class QuestionItemStat(Base):
+    __tablename__ = "question_item_stats"
+    id = Column(Integer, primary_key=True, index=True)
+    item_key = Column(String(40), nullable=False, unique=True) # 主題、題目、選項與正確答案的雜湊（共用的題目跨測驗累計）
+    topic = Column(String, nullable=False, index=True)
+    question_text = Column(Text, nullable=False)
+    correct_answer_index = Column(Integer, nullable=False)
+    num_choices = Column(Integer, nullable=False)
+    responses = Column(Integer, nullable=False, default=0)
+    correct = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+    score_sq_sum = Column(Float, nullable=False, default=0.0)
+    correct_score_sum = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class QuestionChoiceStat(Base):
+    __tablename__ = "question_choice_stats"
+    id = Column(Integer, primary_key=True, index=True)
+    item_key = Column(String(40), nullable=False)
+    choice_index = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    __table_args__ = (UniqueConstraint("item_key", "choice_index"),)
+
+class TopicItemStat(Base):
+    __tablename__ = "topic_item_stats"
+    id = Column(Integer, primary_key=True, index=True)
+    topic = Column(String, nullable=False, unique=True)
+    responses = Column(Integer, nullable=False, default=0)
+    correct = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+    score_sq_sum = Column(Float, nullable=False, default=0.0)
+    correct_score_sum = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 class RAGQueryLog(Base):
     __tablename__ = "rag_query_logs"
@@ -66,6 +118,57 @@ class RAGQueryLog(Base):
     
     user = relationship("User", back_populates="query_logs")
 
+# --- 常見問題（faq_mining 由提問紀錄分群；每次分群取代該章節的所有群集）---
+# centroid 為正規化後的群集中心（float32），answer 為離峰時預先產生的標準答案，
+# index_stamp 為產生答案時章節的索引戳記（章節重新索引後不再提供舊答案）
+class FaqCluster(Base):
+    __tablename__ = "faq_clusters"
+    id = Column(Integer, primary_key=True, index=True)
+    chapter = Column(String, nullable=False, index=True)
+    rank = Column(Integer, nullable=False)                 # 依提問次數排序的名次（1 起算）
+    size = Column(Integer, nullable=False)                 # 群集內的提問次數
+    unique_questions = Column(Integer, nullable=False)     # 正規化後不同的問題數
+    representative = Column(Text, nullable=False)          # 最接近中心的問題
+    sample_questions = Column(JSON, nullable=False, default=list)
+    centroid = Column(LargeBinary, nullable=False)
+    answer = Column(Text)
+    answer_path = Column(String)
+    index_stamp = Column(String)
+    answered_at = Column(DateTime(timezone=True))
+    hits = Column(Integer, nullable=False, default=0)      # /api/ask 直接以此答案回覆的次數
+    mined_at = Column(DateTime(timezone=True), server_default=func.now())
+
+# --- 多輪家教對話（tutor_sessions）---
+# 較舊的回合逐步併入 summary（summarized_turns 為已併入的回合數），最近幾回合逐字放進提示；
+# context_chunks 為上次檢索到的區塊 id 與相關度（JSON），context_embedding 為觸發該次檢索的問題向量（float32）
+class TutorSession(Base):
+    __tablename__ = "tutor_sessions"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    chapter = Column(String, nullable=False)
+    title = Column(String, nullable=False, default="")
+    summary = Column(Text, nullable=False, default="")
+    summarized_turns = Column(Integer, nullable=False, default=0)
+    context_chunks = Column(Text)
+    context_embedding = Column(LargeBinary)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    turns = relationship("TutorTurn", back_populates="session", cascade="all, delete-orphan", order_by="TutorTurn.id")
+
+class TutorTurn(Base):
+    __tablename__ = "tutor_turns"
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("tutor_sessions.id"), nullable=False, index=True)
+    question = Column(Text, nullable=False)
+    answer = Column(Text, nullable=False)
+    path = Column(String, nullable=False)
+    reused_context = Column(Integer, nullable=False, default=0) # 1 表示沿用上一回合的檢索結果
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    session = relationship("TutorSession", back_populates="turns")
+
 class Chapter(Base):
     __tablename__ = "chapters"
     id = Column(Integer, primary_key=True, index=True)
@@ -0,0 +1,351 @@
+# 檔案：pdf_extract.py
+# 說明：索引腳本使用的 PDF 文字擷取（取代 DirectoryLoader + PyPDFLoader 的逐頁單行程解析）。
+#       各頁分批交給行程池平行解析，並提前為後面幾個檔案送出頁數計算與批次（在途工作有上限），
+#       大量小型 PDF 也能同時解析；擷取結果依（檔案雜湊, 頁碼）快取在本機 SQLite，
+#       內容未變動的 PDF 重新索引時不必再解析；頁面依檔案與頁碼順序產出（generator），
+#       每個檔案全部解析成功後才產出該檔案的頁面，無法解析的檔案整個略過（與 silent_errors=True 相同）。
+#       產生的 Document 與 PyPDFLoader 相同：page_content 為 page.extract_text()，metadata 為 {"source", "page"}。
+
+import glob
+import hashlib
+import os
+import sqlite3
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+# 行程池大小，1 表示在目前行程內解析
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+# 每個工作單位解析的頁數（太小時行程間傳遞的成本比例較高）
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", "16"))
+PDF_CACHE_PATH = os.environ.get("PDF_CACHE_PATH", "pdf_text_cache.db")
+# 擷取方式改變時調高，讓舊的快取失效
+EXTRACTOR_VERSION = 1
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PageCache:
+    """（檔案雜湊, 頁碼）-> 文字。只由主行程讀寫。"""
+
+    def __init__(self, path: str = PDF_CACHE_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pdf_files ("
+            " file_hash TEXT NOT NULL, version INTEGER NOT NULL, pages INTEGER NOT NULL, PRIMARY KEY (file_hash, version)) WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pdf_pages ("
+            " file_hash TEXT NOT NULL, version INTEGER NOT NULL, page INTEGER NOT NULL, text TEXT NOT NULL,"
+            " PRIMARY KEY (file_hash, version, page)) WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    def page_count(self, digest: str) -> Optional[int]:
+        row = self.conn.execute("SELECT pages FROM pdf_files WHERE file_hash = ? AND version = ?", (digest, EXTRACTOR_VERSION)).fetchone()
+        return row[0] if row else None
+
+    def pages(self, digest: str) -> Dict[int, str]:
+        rows = self.conn.execute("SELECT page, text FROM pdf_pages WHERE file_hash = ? AND version = ?", (digest, EXTRACTOR_VERSION))
+        return dict(rows)
+
+    def put_pages(self, digest: str, items: List[Tuple[int, str]]):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO pdf_pages (file_hash, version, page, text) VALUES (?, ?, ?, ?)",
+            [(digest, EXTRACTOR_VERSION, page, text) for page, text in items],
+        )
+        self.conn.commit()
+
+    def put_page_count(self, digest: str, pages: int):
+        self.conn.execute("INSERT OR REPLACE INTO pdf_files (file_hash, version, pages) VALUES (?, ?, ?)", (digest, EXTRACTOR_VERSION, pages))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+# --- 在工作行程中執行 ---
+# 多個檔案的批次交錯送出，每個工作行程保留最近開啟的幾個檔案
+_MAX_READERS = 4
+_readers: "OrderedDict[str, object]" = OrderedDict()
+
+
+def _reader(path: str):
+    # 同一個工作行程處理同一檔案的多個批次時，不必重新解析 xref
+    reader = _readers.get(path)
+    if reader is None:
+        import pypdf
+        reader = _readers[path] = pypdf.PdfReader(path)
+        while len(_readers) > _MAX_READERS:
+            _readers.popitem(last=False)
+    else:
+        _readers.move_to_end(path)
+    return reader
+
+
+def count_pages(path: str) -> int:
+    return len(_reader(path).pages)
+
+
+def extract_pages(path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    reader = _reader(path)
+    return [(i, reader.pages[i].extract_text()) for i in range(start, stop)]
+
+
+class PDFExtractor:
+    """
+    逐頁產出 PDF 文字。用法：
+        with PDFExtractor() as extractor:
+            for doc in extractor.iter_documents(paths): ...
+    """
+
+    def __init__(self, workers: int = PDF_EXTRACT_WORKERS, pages_per_task: int = PDF_PAGES_PER_TASK,
+                 cache_path: Optional[str] = PDF_CACHE_PATH):
+        self.workers = max(1, workers)
+        self.pages_per_task = max(1, pages_per_task)
+        self.cache = PageCache(cache_path) if cache_path else None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.stats = {"files": 0, "pages": 0, "cached_pages": 0, "parsed_pages": 0, "errors": 0, "seconds": 0.0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def _run(self, fn, *args):
+        """工作數為 1 時直接在目前行程執行，否則交給行程池；回傳可呼叫 .result() 的物件。"""
+        if self.workers == 1:
+            # 與行程池相同，例外在 .result() 時才拋出（排程時不會中斷其他檔案）
+            try:
+                return _Done(fn(*args))
+            except Exception as e:
+                return _Done(error=e)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool.submit(fn, *args)
+
+    @property
+    def max_in_flight(self) -> int:
+        """同時在途（已送出但尚未取回）的工作數上限，也是提前開啟的檔案數。"""
+        return self.workers * 2
+
+    def _open(self, path: str) -> "_FileJob":
+        try:
+            digest = file_hash(path)
+        except OSError as e:
+            return _FileJob(path, "", {}, error=e)
+        cached = self.cache.pages(digest) if self.cache else {}
+        job = _FileJob(path, digest, cached)
+        pages = self.cache.page_count(digest) if self.cache else None
+        if pages is not None:
+            job.plan(pages, self.pages_per_task)
+        return job
+
+    def _resolve_count(self, job: "_FileJob", wait: bool):
+        if job.count_future is None or (not wait and not job.count_future.done()):
+            return
+        future, job.count_future = job.count_future, None
+        try:
+            pages = future.result()
+        except Exception as e:
+            job.error = e
+            return
+        if self.cache:
+            self.cache.put_page_count(job.digest, pages)
+        job.plan(pages, self.pages_per_task)
+
+    def _submit_next(self, job: "_FileJob"):
+        start, stop = job.tasks[job.next_task]
+        job.pending[start] = self._run(extract_pages, job.path, start, stop)
+        job.next_task += 1
+
+    def _schedule(self, jobs) -> None:
+        """依檔案順序送出頁數計算與批次，直到在途工作達上限；前面的檔案優先。"""
+        budget = self.max_in_flight - sum(job.in_flight for job in jobs)
+        for job in jobs:
+            if budget <= 0:
+                return
+            self._resolve_count(job, wait=False)
+            if job.error is not None:
+                continue
+            if job.pages is None:
+                if job.count_future is None:
+                    job.count_future = self._run(count_pages, job.path)
+                    budget -= 1
+                continue
+            while budget > 0 and job.next_task < len(job.tasks):
+                self._submit_next(job)
+                budget -= 1
+
+    def _iter_job(self, job: "_FileJob", schedule: Callable[[], None]) -> Iterator[Tuple[int, str]]:
+        """依頁碼順序產出 (頁碼, 文字)；每次等待前先呼叫 schedule()，讓後面的檔案繼續佔滿行程池。"""
+        schedule()
+        if job.pages is None and job.error is None:
+            if job.count_future is None:
+                job.count_future = self._run(count_pages, job.path)
+            self._resolve_count(job, wait=True)
+        if job.error is not None:
+            raise job.error
+        parsed: Dict[int, str] = {}
+        for page in range(job.pages):
+            if page in parsed:
+                yield page, parsed.pop(page)
+                continue
+            if page in job.cached:
+                self.stats["cached_pages"] += 1
+                yield page, job.cached.pop(page)
+                continue
+            schedule()
+            if page not in job.pending:
+                # 在途工作已滿（都是後面檔案的）：目前的檔案仍須前進，多送出一個批次
+                self._submit_next(job)
+            # 目前頁碼是某個批次的第一頁（批次中其餘頁面在取回時放入 parsed）
+            items = job.pending.pop(page).result()
+            if self.cache:
+                self.cache.put_pages(job.digest, items)
+            self.stats["parsed_pages"] += len(items)
+            yield items[0]
+            parsed.update(items[1:])
+        self.stats["files"] += 1
+
+    def iter_pages(self, path: str) -> Iterator[Tuple[int, str]]:
+        """依頁碼順序產出單一檔案的 (頁碼, 文字)，已快取的頁面直接讀取。"""
+        job = self._open(path)
+        try:
+            yield from self._iter_job(job, lambda: self._schedule([job]))
+        finally:
+            # 解析失敗或呼叫端提前停止時，不再執行此檔案尚未開始的批次
+            job.cancel()
+
+    def iter_documents(self, paths: List[str], silent_errors: bool = True):
+        """
+        產出與 PyPDFLoader 相同格式的 Document（每頁一個），依檔案與頁碼順序。
+        等待目前檔案時，後面最多 max_in_flight 個檔案的頁數計算與批次已在行程池中進行。
+        每個檔案的頁面先暫存，整個檔案解析成功才產出；中途失敗的檔案不會留下部分頁面。
+        """
+        from langchain_core.documents import Document
+
+        started = time.perf_counter()
+        remaining = iter(paths)
+        jobs: Deque[_FileJob] = deque()
+
+        def schedule():
+            while len(jobs) < self.max_in_flight:
+                path = next(remaining, None)
+                if path is None:
+                    break
+                jobs.append(self._open(path))
+            self._schedule(jobs)
+
+        try:
+            schedule()
+            while jobs:
+                job = jobs[0]
+                try:
+                    documents = [Document(page_content=text, metadata={"source": job.path, "page": page})
+                                 for page, text in self._iter_job(job, schedule)]
+                except Exception as e:
+                    job.cancel()
+                    if not silent_errors:
+                        raise
+                    self.stats["errors"] += 1
+                    print(f"警告: 無法解析 '{job.path}'：{e}")
+                    jobs.popleft()
+                    continue
+                jobs.popleft()
+                self.stats["pages"] += len(documents)
+                yield from documents
+        finally:
+            # 呼叫端提前停止或發生錯誤時，取消尚未開始的工作
+            for job in jobs:
+                job.cancel()
+            self.stats["seconds"] += time.perf_counter() - started
+
+
+class _FileJob:
+    """排程中的檔案：頁數（計算中時為 None）、已快取的頁面、待送出的批次與在途的工作。"""
+
+    def __init__(self, path: str, digest: str, cached: Dict[int, str], error: Optional[Exception] = None):
+        self.path = path
+        self.digest = digest
+        self.cached = cached
+        self.error = error
+        self.pages: Optional[int] = None
+        self.count_future = None
+        self.tasks: List[Tuple[int, int]] = []
+        self.next_task = 0
+        self.pending: Dict[int, object] = {}
+
+    def plan(self, pages: int, pages_per_task: int):
+        self.pages = pages
+        self.tasks = _page_runs([i for i in range(pages) if i not in self.cached], pages_per_task)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.pending) + (self.count_future is not None)
+
+    def cancel(self):
+        for future in list(self.pending.values()) + [self.count_future]:
+            if future is not None:
+                future.cancel()
+        self.pending.clear()
+        self.count_future = None
+
+
+def _page_runs(pages: List[int], size: int) -> List[Tuple[int, int]]:
+    """將頁碼切成連續且不超過 size 頁的 [start, stop) 區段。"""
+    runs = []
+    for page in pages:
+        if runs and runs[-1][1] == page and page - runs[-1][0] < size:
+            runs[-1][1] = page + 1
+        else:
+            runs.append([page, page + 1])
+    return [tuple(run) for run in runs]
+
+
+class _Done:
+    def __init__(self, value=None, error: Optional[Exception] = None):
+        self.value = value
+        self.error = error
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def done(self) -> bool:
+        return True
+
+    def cancel(self) -> bool:
+        return False
+
+
+def find_pdfs(directory: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(directory, "*.pdf")))
+
+
+def load_pdf_directory(directory: str, extractor: Optional[PDFExtractor] = None):
+    """DirectoryLoader(directory, glob='*.pdf', loader_cls=PyPDFLoader, silent_errors=True) 的替代。"""
+    if extractor is not None:
+        yield from extractor.iter_documents(find_pdfs(directory))
+        return
+    with PDFExtractor() as own:
+        yield from own.iter_documents(find_pdfs(directory))
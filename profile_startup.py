@@ -0,0 +1,92 @@
+# 檔案：profile_startup.py
+# 說明：量測 API 冷啟動時間。
+#       1. 以 python -X importtime 分析匯入 main.py 的耗時，依頂層套件彙總。
+#       2. 啟動 uvicorn 子行程，量測第一次成功回應 /healthz（可接受流量）與 /readyz（AI 系統就緒）的時間。
+#       用法：python profile_startup.py [--port 8765] [--top 15]
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import requests
+
+# 目標：行程啟動後 1.5 秒內可回應 /healthz 與 /api/chapters 等不需要 AI 的端點
+TIME_TO_FIRST_REQUEST_TARGET = 1.5
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def import_time_breakdown(top: int):
+    """回傳 (匯入 main 的總秒數, [(頂層套件, 秒數), ...])。"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=PROJECT_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"匯入 main.py 失敗：\n{result.stderr[-2000:]}")
+    per_package = defaultdict(int)
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            self_us = int(self_us)
+        except ValueError:
+            continue  # 表頭
+        per_package[name.strip().split(".")[0]] += self_us
+        if name.strip() == "main":
+            total_us = int(cumulative_us)
+    ranked = sorted(per_package.items(), key=lambda item: item[1], reverse=True)[:top]
+    return total_us / 1e6, [(name, us / 1e6) for name, us in ranked]
+
+def wait_for(url: str, deadline: float) -> float:
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(url, timeout=0.5).status_code == 200:
+                return time.perf_counter() - start
+        except requests.RequestException:
+            pass
+        time.sleep(0.02)
+    return float("nan")
+
+def time_to_first_request(port: int, timeout: float = 60):
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=PROJECT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = start + timeout
+        healthz = wait_for(f"{base}/healthz", deadline)
+        readyz = (time.perf_counter() - start) + wait_for(f"{base}/readyz", deadline)
+        return healthz, readyz
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="量測 API 冷啟動時間")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    total, ranked = import_time_breakdown(args.top)
+    print(f"匯入 main.py 總耗時：{total:.3f} 秒")
+    print("各頂層套件的匯入耗時（self time）：")
+    for name, seconds in ranked:
+        print(f"  {name:30s} {seconds * 1000:8.1f} ms")
+
+    healthz, readyz = time_to_first_request(args.port)
+    print(f"\n啟動到第一次回應 /healthz：{healthz:.3f} 秒（目標 < {TIME_TO_FIRST_REQUEST_TARGET} 秒）")
+    print(f"啟動到 /readyz 就緒（AI 系統暖機完成）：{readyz:.3f} 秒")
+    if healthz > TIME_TO_FIRST_REQUEST_TARGET:
+        print("未達成冷啟動目標！")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# 檔案：qa_router.py
+# 說明：/api/ask 的快速路徑判斷。若章節知識庫的檢索結果相似度夠高，
+#       直接以單次 LLM 呼叫回答；否則才交給完整的 ReAct Agent（含網路搜尋）。
+
+import os
+from typing import List, Tuple
+
+from langchain_core.documents import Document
+
+from context_builder import build_context
+
+# Chroma 的 relevance score 為 1 - d²/√2（d² 為平方 l2 距離，NumPy 索引相同）；正規化向量的 d² = 2(1 - cosine)，
+# 即 score = 1 - √2·(1 - cosine)：0.5 約對應 cosine 相似度 0.65，cosine 0.75 約對應 0.65
+FAST_PATH_MIN_SCORE = float(os.environ.get("FAST_PATH_MIN_SCORE", "0.5"))
+# 至少需要幾個區塊超過門檻才走快速路徑
+FAST_PATH_MIN_DOCS = int(os.environ.get("FAST_PATH_MIN_DOCS", "1"))
+
+PATH_FAST = "fast"
+PATH_AGENT = "agent"
+
+FAST_PATH_PROMPT = """你是 '{chapter}' 章節的虛擬助教。請只根據以下課程內容，用繁體中文清楚回答學生的問題。
+若課程內容不足以回答，請直接說明需要查閱哪些額外資料。
+
+課程內容：
+---
+{context}
+---
+
+學生的問題：{question}
+
+回答："""
+
+
+def is_confident(scored_docs: List[Tuple[Document, float]]) -> bool:
+    """檢索結果中是否有足夠多的高相似度區塊。"""
+    confident = [score for _, score in scored_docs if score >= FAST_PATH_MIN_SCORE]
+    return len(confident) >= FAST_PATH_MIN_DOCS
+
+
+def answer_from_context(llm, chapter: str, question: str, scored_docs: List[Tuple[Document, float]], callbacks=None) -> str:
+    """以檢索到的課程內容直接進行一次 LLM 呼叫產生答案。"""
+    prompt = FAST_PATH_PROMPT.format(chapter=chapter, context=build_context(scored_docs), question=question)
+    response = llm.invoke(prompt, config={"callbacks": callbacks or []})
+    return response.content
@@ -0,0 +1,235 @@
+# 檔案：query_search.py
+# 說明：提問紀錄（rag_query_logs）的全文檢索，使用 SQLite FTS5。
+#       中日韓文字沒有空白分詞，寫入索引前在每個字後插入零寬空白（unicode61 視為分隔字元），
+#       讓「梯度」這類詞可用片語比對找到；輸出的標示文字會移除零寬空白。
+#       分詞在 Python 中進行：新增 / 修改由 ORM 事件寫入 rag_query_logs_fts（同一個交易），
+#       刪除由純 SQL 觸發器同步，資料庫中沒有自訂函式，其他工具（sqlite3 CLI 等）仍可直接寫入資料表；
+#       不經 ORM 新增的紀錄不會被索引，需執行 rebuild。第一次啟動時回填既有資料。
+#       用法：python query_search.py rebuild   # 重建整個索引
+
+import re
+import sys
+import time
+from typing import List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+
+import models
+
+FTS_TABLE = "rag_query_logs_fts"
+HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE = "<mark>", "</mark>"
+SNIPPET_TOKENS = 32
+MAX_PAGE_SIZE = 100
+ORDERS = ("recent", "relevance")
+FIELDS = ("question", "answer")
+
+_SEP = "\u200b"
+_CJK = re.compile(r"([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff])")
+_QUERY_TERM = re.compile(r'(-?)"([^"]*)"|(-?)(\S+)')
+
+# 章節記錄在問題開頭的 "[章節] "，索引時拆成獨立欄位
+_CHAPTER_PREFIX = re.compile(r"\[(.*?)\] ", re.DOTALL)
+BACKFILL_BATCH = 2000
+
+
+def segment(value: Optional[str]) -> Optional[str]:
+    """在每個中日韓文字後插入零寬空白，讓 FTS 以單字為詞元（片語查詢即可比對連續的字）。"""
+    return _CJK.sub("\\1" + _SEP, value) if value else value
+
+
+def index_row(row_id: int, question: str, answer: str) -> dict:
+    """提問紀錄在索引中的欄位值：問題開頭的 "[章節] " 拆成章節欄位，問題與回答分詞。"""
+    match = _CHAPTER_PREFIX.match(question or "")
+    chapter = match.group(1) if match else None
+    if match:
+        question = question[match.end():]
+    return {"id": row_id, "chapter": chapter, "question": segment(question), "answer": segment(answer)}
+
+
+_INSERT = f"INSERT INTO {FTS_TABLE} (rowid, chapter, question, answer) VALUES (:id, :chapter, :question, :answer)"
+_DELETE = f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"
+SCHEMA = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(chapter, question, answer, tokenize = 'unicode61')",
+    # 依相關度排序時，問題的命中比回答更重要
+    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) VALUES ('rank', 'bm25(0.0, 2.0, 1.0)')",
+    f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON rag_query_logs BEGIN "
+    f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END",
+]
+# 舊版以觸發器呼叫自訂函式 vta_segment() 同步新增 / 修改，啟動時移除
+_LEGACY_TRIGGERS = (f"{FTS_TABLE}_ai", f"{FTS_TABLE}_au")
+
+_available = None
+
+
+def _backfill(conn) -> int:
+    count, last_id = 0, 0
+    while True:
+        rows = conn.execute(text("SELECT id, question, answer FROM rag_query_logs WHERE id > :after ORDER BY id LIMIT :limit"),
+                            {"after": last_id, "limit": BACKFILL_BATCH}).all()
+        if not rows:
+            return count
+        conn.execute(text(_INSERT), [index_row(*row) for row in rows])
+        count += len(rows)
+        last_id = rows[-1][0]
+
+
+def ensure_index(engine) -> bool:
+    """建立 FTS 資料表與刪除觸發器（已存在則略過），新建時回填既有的提問紀錄。"""
+    global _available
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": FTS_TABLE}).first():
+            for trigger in _LEGACY_TRIGGERS:
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+            _available = True
+            return True
+        started = time.perf_counter()
+        try:
+            for statement in SCHEMA:
+                conn.execute(text(statement))
+        except OperationalError as e:
+            # 部分 SQLite 編譯版本沒有 FTS5
+            print(f"[search] 無法建立全文檢索索引，停用搜尋: {e}")
+            _available = False
+            return False
+        count = _backfill(conn)
+    print(f"[search] 已建立全文檢索索引：{count} 筆，{time.perf_counter() - started:.1f} 秒")
+    _available = True
+    return True
+
+
+def rebuild_index(engine) -> int:
+    with engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM {FTS_TABLE}"))
+        count = _backfill(conn)
+        conn.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')"))
+        return count
+
+
+# --- 經由 ORM 新增 / 修改的提問紀錄在同一個交易中寫入索引 ---
+def _index_ready(connection) -> bool:
+    global _available
+    if _available is None:
+        # 尚未執行 ensure_index 的行程（例如命令列工具）：索引已存在時照常同步
+        _available = connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": FTS_TABLE}).first() is not None
+    return _available
+
+
+@event.listens_for(models.RAGQueryLog, "after_insert")
+def _index_inserted(mapper, connection, target):
+    if _index_ready(connection):
+        connection.execute(text(_INSERT), index_row(target.id, target.question, target.answer))
+
+
+@event.listens_for(models.RAGQueryLog, "after_update")
+def _index_updated(mapper, connection, target):
+    if _index_ready(connection):
+        connection.execute(text(_DELETE), {"id": target.id})
+        connection.execute(text(_INSERT), index_row(target.id, target.question, target.answer))
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _phrase(value: str) -> str:
+    prefix = value.endswith("*") and len(value) > 1
+    return _quote(segment(value[:-1] if prefix else value)) + (" *" if prefix else "")
+
+
+def build_match(query: str, field: Optional[str] = None, chapter: Optional[str] = None) -> str:
+    """
+    將使用者的查詢轉為 FTS5 MATCH 運算式：空白分隔的詞皆須出現（AND），
+    "雙引號" 為片語、詞尾 * 為前綴比對、開頭 - 為排除。所有詞都加上引號，使用者輸入不會被當成 FTS 語法。
+    未指定 field 時搜尋問題與回答（不比對章節欄位）。
+    """
+    include: List[str] = []
+    exclude: List[str] = []
+    for match in _QUERY_TERM.finditer(query or ""):
+        negated = match.group(1) or match.group(3)
+        value = match.group(2) if match.group(2) is not None else match.group(4)
+        if not value.strip() or value == "*":
+            continue
+        (exclude if negated else include).append(_phrase(value.strip()))
+    if not include:
+        raise HTTPException(status_code=400, detail="請輸入至少一個搜尋詞（不可只有排除詞）")
+    expression = " AND ".join(include) + "".join(f" NOT {term}" for term in exclude)
+    expression = f"{{{field or ' '.join(FIELDS)}}} : ({expression})"
+    if chapter:
+        # 章節也是索引欄位，由 FTS 直接縮小範圍（比對結果再以 f.chapter 精確確認）；
+        # 章節欄位索引時未分詞，這裡也不能分詞，否則中文章節名稱比對不到
+        expression = f"chapter : {_quote(chapter)} AND {expression}"
+    return expression
+
+
+def _parse_cursor(cursor: str, order: str):
+    try:
+        if order == "relevance":
+            rank, _, last_id = cursor.partition(":")
+            return float(rank), int(last_id)
+        return None, int(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="無效的 cursor")
+
+
+def _clean(value: Optional[str]) -> Optional[str]:
+    return value.replace(_SEP, "") if value else value
+
+
+def search(db, query: str, chapter: Optional[str] = None, field: Optional[str] = None,
+           order: str = "recent", limit: int = 20, cursor: Optional[str] = None) -> dict:
+    """
+    搜尋提問紀錄，回傳 {"items", "next_cursor", "took_ms"}。
+    以 keyset 分頁：recent 依 id 由新到舊（cursor 為上一頁最後一筆的 id），
+    relevance 依 bm25 分數（cursor 為 "分數:id"）；下一頁帶入 next_cursor。
+    """
+    if _available is False:
+        raise HTTPException(status_code=503, detail="此 SQLite 不支援 FTS5，全文檢索無法使用。")
+    if order not in ORDERS:
+        raise HTTPException(status_code=400, detail=f"不支援的排序: {order}（可用：{', '.join(ORDERS)}）")
+    if field is not None and field not in FIELDS:
+        raise HTTPException(status_code=400, detail=f"不支援的欄位: {field}（可用：{', '.join(FIELDS)}）")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    params = {"match": build_match(query, field, chapter), "open": HIGHLIGHT_OPEN, "close": HIGHLIGHT_CLOSE,
+              "tokens": SNIPPET_TOKENS, "limit": limit + 1}
+    conditions = [f"{FTS_TABLE} MATCH :match"]
+    if chapter:
+        conditions.append("f.chapter = :chapter")
+        params["chapter"] = chapter
+    if cursor:
+        params["rank"], params["after"] = _parse_cursor(cursor, order)
+        conditions.append("(f.rank > :rank OR (f.rank = :rank AND f.rowid < :after))" if order == "relevance" else "f.rowid < :after")
+    order_by = "f.rank, f.rowid DESC" if order == "relevance" else "f.rowid DESC"
+    sql = (
+        f"SELECT f.rowid AS id, f.chapter, f.rank,"
+        f" highlight({FTS_TABLE}, 1, :open, :close) AS question,"
+        f" snippet({FTS_TABLE}, 2, :open, :close, '…', :tokens) AS answer,"
+        f" l.created_at, l.user_id, u.email AS user_email"
+        f" FROM {FTS_TABLE} AS f JOIN rag_query_logs AS l ON l.id = f.rowid LEFT JOIN users AS u ON u.id = l.user_id"
+        f" WHERE {' AND '.join(conditions)} ORDER BY {order_by} LIMIT :limit"
+    )
+    started = time.perf_counter()
+    try:
+        rows = db.execute(text(sql), params).mappings().all()
+    except OperationalError as e:
+        raise HTTPException(status_code=400, detail=f"搜尋條件無效: {e.orig}")
+    took_ms = (time.perf_counter() - started) * 1000
+    items = [{"id": r["id"], "chapter": r["chapter"], "question": _clean(r["question"]), "answer_snippet": _clean(r["answer"]),
+              "created_at": r["created_at"], "user_id": r["user_id"], "user_email": r["user_email"],
+              "score": -r["rank"]} for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = f"{last['rank']!r}:{last['id']}" if order == "relevance" else str(last["id"])
+    return {"items": items, "next_cursor": next_cursor, "took_ms": round(took_ms, 2)}
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    if sys.argv[1:] != ["rebuild"]:
+        print("用法：python query_search.py rebuild")
+        sys.exit(1)
+    ensure_index(engine)
+    print(f"已重建全文檢索索引：{rebuild_index(engine)} 筆")
@@ -0,0 +1,96 @@
+# 檔案：quiz_batch.py
+# 說明：管理員批次出題。同一章節的多個主題共用一個向量資料庫，以有上限的併發數同時檢索與出題，
+#       每個主題完成就以 NDJSON 送出一行結果（完成順序，不必等最慢的主題），
+#       全部結束後在同一個交易中寫入成功的測驗，最後一行為摘要（含測驗 id）。
+
+import asyncio
+import os
+import time
+from typing import AsyncIterator, List
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+import crud, schemas
+from database import SessionLocal
+from fast_response import dumps
+from metrics import metrics
+from singleflight import SingleFlight, normalize_text
+
+# 單一批次同時進行的主題數（所有請求共用的 LLM 併發上限仍由 rate_limit.llm_admission 控制）
+QUIZ_BATCH_CONCURRENCY = int(os.environ.get("QUIZ_BATCH_CONCURRENCY", "4"))
+
+
+def _line(payload: dict) -> bytes:
+    return dumps(payload) + b"\n"
+
+
+async def _generate(flight: SingleFlight, rag_service, chapter: str, vector_store, index: int,
+                    item: schemas.GenerateQuizRequest, limit: asyncio.Semaphore) -> dict:
+    async with limit:
+        started = time.perf_counter()
+        result = {"type": "topic", "index": index, "topic": item.topic, "num_questions": item.num_questions}
+        try:
+            # 與 /api/quiz/generate 使用相同的 key：學生同時請求相同主題時共用同一次計算
+            key = (chapter, normalize_text(item.topic), item.num_questions)
+            quiz_data, _ = await flight.do(key, rag_service.generate_quiz_data, chapter, item.topic, item.num_questions, vector_store)
+            result.update(status="ok", questions=quiz_data["questions"], incomplete=quiz_data["incomplete"])
+            result["_quiz_data"] = quiz_data
+        except HTTPException as e:
+            result.update(status="error", error=e.detail)
+        except Exception as e:
+            result.update(status="error", error=f"AI 產生測驗失敗或格式錯誤: {e}")
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        metrics.incr(f"quiz_batch.topics.{result['status']}")
+        if result.get("incomplete"):
+            metrics.incr("quiz_batch.topics.incomplete")
+        return result
+
+
+async def _stream(flight: SingleFlight, rag_service, chapter: str, vector_store, request: schemas.QuizBatchRequest,
+                  user_id: int) -> AsyncIterator[bytes]:
+    started = time.perf_counter()
+    limit = asyncio.Semaphore(max(1, QUIZ_BATCH_CONCURRENCY))
+    tasks = [asyncio.ensure_future(_generate(flight, rag_service, chapter, vector_store, i, item, limit))
+             for i, item in enumerate(request.topics)]
+    succeeded: List[dict] = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            quiz_data = result.pop("_quiz_data", None)
+            if quiz_data is not None:
+                succeeded.append({"index": result["index"], "topic": result["topic"], "quiz_data": quiz_data})
+            yield _line(result)
+    finally:
+        # 客戶端中途斷線時取消尚未開始的主題（已在執行緒中進行的 LLM 呼叫會自行結束）
+        for task in tasks:
+            task.cancel()
+
+    summary = {"type": "summary", "chapter": chapter, "succeeded": len(succeeded),
+               "failed": len(request.topics) - len(succeeded),
+               "incomplete": sum(1 for s in succeeded if s["quiz_data"]["incomplete"]), "attempt_ids": []}
+    if request.persist and succeeded:
+        succeeded.sort(key=lambda s: s["index"])
+        items = [(f"{chapter} - {s['topic']}", s["quiz_data"]) for s in succeeded]
+        try:
+            summary["attempt_ids"] = await run_in_threadpool(_persist, user_id, items)
+        except Exception as e:
+            summary["persist_error"] = f"儲存測驗失敗: {e}"
+    summary["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    metrics.observe("quiz_batch.latency", time.perf_counter() - started)
+    yield _line(summary)
+
+
+def _persist(user_id: int, items) -> List[int]:
+    with SessionLocal() as db:
+        return crud.create_quiz_attempts(db, user_id, items)
+
+
+def batch_response(flight: SingleFlight, rag_service, chapter: str, request: schemas.QuizBatchRequest,
+                   user_id: int) -> StreamingResponse:
+    """章節不存在時在開始串流前就以 404 回應。"""
+    vector_store = rag_service.get_vector_store_for_chapter(chapter)
+    print(f"[quiz-batch] '{chapter}'：{len(request.topics)} 個主題，併發 {QUIZ_BATCH_CONCURRENCY}")
+    body = _stream(flight, rag_service, chapter, vector_store, request, user_id)
+    return StreamingResponse(body, media_type="application/x-ndjson")
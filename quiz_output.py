@@ -0,0 +1,245 @@
+# 檔案：quiz_output.py
+# 說明：測驗題目的結構化輸出。提示中附上 JSON Schema，回應以寬鬆方式取出 JSON
+#       （忽略 ```json 標記、前後說明文字與多餘的逗號），逐題驗證題數、選項與正確答案索引，
+#       只針對缺少或格式錯誤的題目再呼叫 LLM 修復，不必整份重新產生。
+#       使用的 google-generativeai 版本不支援 response_mime_type，因此以提示 + 驗證約束格式。
+
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Tuple
+
+from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
+
+from metrics import metrics
+
+# 第一次輸出不完整時，最多再呼叫幾次 LLM 補齊
+QUIZ_REPAIR_ATTEMPTS = int(os.environ.get("QUIZ_REPAIR_ATTEMPTS", "2"))
+MIN_CHOICES = 2
+MAX_CHOICES = 6
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_LETTER = re.compile(r"^\(?([A-Fa-f])[\).:：]?$")
+# 常見的欄位名稱變形
+_ALIASES = {
+    "question_text": ("question", "text", "stem"),
+    "choices": ("options", "answers"),
+    "correct_answer_index": ("correct_index", "answer_index", "correct_answer", "answer"),
+}
+
+
+class QuizQuestion(BaseModel):
+    question_text: str = Field(min_length=1)
+    choices: List[str] = Field(min_length=MIN_CHOICES, max_length=MAX_CHOICES)
+    correct_answer_index: int = Field(ge=0)
+
+    @field_validator("question_text")
+    @classmethod
+    def _strip_text(cls, value: str) -> str:
+        if not value.strip():
+            raise ValueError("題目不可為空白")
+        return value.strip()
+
+    @field_validator("choices")
+    @classmethod
+    def _check_choices(cls, value: List[str]) -> List[str]:
+        choices = [str(c).strip() for c in value]
+        if any(not c for c in choices):
+            raise ValueError("選項不可為空白")
+        if len(set(choices)) != len(choices):
+            raise ValueError("選項重複")
+        return choices
+
+    @model_validator(mode="after")
+    def _check_answer(self):
+        if self.correct_answer_index >= len(self.choices):
+            raise ValueError(f"correct_answer_index {self.correct_answer_index} 超出選項範圍（共 {len(self.choices)} 個選項）")
+        return self
+
+
+class QuizOutput(BaseModel):
+    questions: List[QuizQuestion]
+
+
+QUIZ_SCHEMA = json.dumps(QuizOutput.model_json_schema(), ensure_ascii=False)
+
+QUIZ_PROMPT = """請根據以下關於 '{chapter}' 章節的課程內容，為「{topic}」設計一份包含 {num_questions} 題單選題的測驗。
+
+課程內容：
+---
+{context}
+---
+
+只輸出一個符合以下 JSON Schema 的 JSON 物件，不要加上說明文字或 Markdown 標記：
+{schema}
+
+範例：
+{{"questions": [{{"question_text": "問題？", "choices": ["A", "B", "C", "D"], "correct_answer_index": 0}}]}}
+
+請確保：
+1. 問題與提供的課程內容相關
+2. 每題 {min_choices} 到 {max_choices} 個互不相同的選項，選項具有挑戰性且合理
+3. correct_answer_index 是正確選項的索引，從 0 開始計算
+4. questions 恰好有 {num_questions} 題
+"""
+
+REPAIR_PROMPT = """你先前為 '{chapter}' 章節的「{topic}」設計的測驗還缺少 {missing} 題有效的單選題。
+{problems}
+請根據以下課程內容，另外設計 {missing} 題，不要與已完成的題目重複。
+
+課程內容：
+---
+{context}
+---
+
+已完成的題目：
+{existing}
+
+只輸出一個符合以下 JSON Schema 的 JSON 物件，questions 恰好有 {missing} 題：
+{schema}
+"""
+
+
+@dataclass
+class QuizParseResult:
+    questions: List[dict] = field(default_factory=list)
+    problems: List[str] = field(default_factory=list)
+
+    def missing(self, num_questions: int) -> int:
+        return max(0, num_questions - len(self.questions))
+
+
+def build_prompt(chapter: str, topic: str, num_questions: int, context: str) -> str:
+    return QUIZ_PROMPT.format(chapter=chapter, topic=topic, num_questions=num_questions, context=context,
+                              schema=QUIZ_SCHEMA, min_choices=MIN_CHOICES, max_choices=MAX_CHOICES)
+
+
+def build_repair_prompt(chapter: str, topic: str, context: str, result: QuizParseResult, missing: int) -> str:
+    problems = ""
+    if result.problems:
+        problems = "上一次的輸出有以下問題，請避免：\n" + "\n".join(f"- {p}" for p in result.problems[:10]) + "\n"
+    existing = "\n".join(f"- {q['question_text']}" for q in result.questions) or "（無）"
+    return REPAIR_PROMPT.format(chapter=chapter, topic=topic, missing=missing, problems=problems,
+                                context=context, existing=existing, schema=QUIZ_SCHEMA)
+
+
+def extract_json(text: str) -> Any:
+    """從 LLM 回應中取出第一個 JSON 物件或陣列；找不到時拋出 ValueError。"""
+    candidates = [m.group(1) for m in _FENCE.finditer(text or "")] + [text or ""]
+    decoder = json.JSONDecoder()
+    for candidate in candidates:
+        # 由最外層開始嘗試，失敗時先去掉多餘的逗號再試，最後才往內層找
+        for match in re.finditer(r"[{\[]", candidate):
+            source = candidate[match.start():]
+            for attempt in (source, _TRAILING_COMMA.sub(r"\1", source)):
+                try:
+                    value, _ = decoder.raw_decode(attempt)
+                except json.JSONDecodeError:
+                    continue
+                return value
+    raise ValueError("回應中找不到 JSON")
+
+
+def _normalize_item(item: Any) -> Any:
+    """補上常見的欄位名稱變形，並將 "B" 或選項文字形式的答案轉為索引。"""
+    if not isinstance(item, dict):
+        return item
+    item = dict(item)
+    for name, aliases in _ALIASES.items():
+        if name not in item:
+            for alias in aliases:
+                if alias in item:
+                    item[name] = item.pop(alias)
+                    break
+    answer, choices = item.get("correct_answer_index"), item.get("choices")
+    if isinstance(answer, str) and isinstance(choices, list):
+        answer = answer.strip()
+        letter = _LETTER.match(answer)
+        if answer.isdigit():
+            item["correct_answer_index"] = int(answer)
+        elif letter:
+            item["correct_answer_index"] = ord(letter.group(1).upper()) - ord("A")
+        elif answer in choices:
+            item["correct_answer_index"] = choices.index(answer)
+    return item
+
+
+def _describe(error: ValidationError) -> str:
+    return "；".join(f"{'.'.join(str(p) for p in e['loc']) or '題目'}: {e['msg']}" for e in error.errors()[:3])
+
+
+def parse_quiz(text: str, num_questions: int, existing: Optional[QuizParseResult] = None) -> QuizParseResult:
+    """
+    解析並逐題驗證 LLM 的輸出，回傳有效題目（最多 num_questions 題）與問題描述。
+    傳入 existing 時將新題目加在其後，並略過與已有題目相同的題目。
+    """
+    result = QuizParseResult(questions=list(existing.questions) if existing else [])
+    try:
+        data = extract_json(text)
+    except ValueError as e:
+        result.problems.append(f"輸出不是有效的 JSON（{e}）")
+        return result
+    items = data.get("questions") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        result.problems.append("缺少 questions 陣列")
+        return result
+
+    seen = {q["question_text"] for q in result.questions}
+    for number, item in enumerate(items, start=1):
+        if len(result.questions) >= num_questions:
+            break
+        try:
+            question = QuizQuestion.model_validate(_normalize_item(item)).model_dump()
+        except ValidationError as e:
+            result.problems.append(f"第 {number} 題：{_describe(e)}")
+            continue
+        if question["question_text"] in seen:
+            result.problems.append(f"第 {number} 題與其他題目重複")
+            continue
+        seen.add(question["question_text"])
+        result.questions.append(question)
+    return result
+
+
+_first_pass_lock = threading.Lock()
+_first_pass = [0, 0]  # [完全有效, 總數]
+
+
+def record_first_pass(result: QuizParseResult, num_questions: int):
+    """記錄第一次輸出的有效率（量測值 quiz.first_pass_valid_rate）。"""
+    valid = result.missing(num_questions) == 0 and not result.problems
+    metrics.incr("quiz.first_pass.valid" if valid else "quiz.first_pass.invalid")
+    metrics.incr("quiz.questions.invalid", len(result.problems))
+    with _first_pass_lock:
+        _first_pass[0] += valid
+        _first_pass[1] += 1
+        rate = _first_pass[0] / _first_pass[1]
+    metrics.set_gauge("quiz.first_pass_valid_rate", round(rate, 4))
+
+
+def generate_quiz(invoke, chapter: str, topic: str, num_questions: int, context: str,
+                  repair_attempts: int = QUIZ_REPAIR_ATTEMPTS) -> Tuple[dict, QuizParseResult]:
+    """
+    invoke(prompt, label) 回傳 LLM 的文字。第一次輸出有缺漏時只要求補上缺少的題數。
+    回傳 ({"questions": [...], "requested": 題數, "incomplete": 是否少於要求的題數}, 最後的解析結果)；
+    修復後仍沒有任何有效題目時拋出 ValueError。
+    """
+    result = parse_quiz(invoke(build_prompt(chapter, topic, num_questions, context), f"quiz[{chapter}]"), num_questions)
+    record_first_pass(result, num_questions)
+    for _ in range(repair_attempts):
+        missing = result.missing(num_questions)
+        if not missing:
+            break
+        metrics.incr("quiz.repairs")
+        text = invoke(build_repair_prompt(chapter, topic, context, result, missing), f"quiz-repair[{chapter}]")
+        result = parse_quiz(text, num_questions, existing=result)
+    if result.missing(num_questions):
+        metrics.incr("quiz.incomplete")
+        if not result.questions:
+            raise ValueError("AI 產生的測驗格式錯誤：" + "；".join(result.problems[-3:]))
+        print(f"[quiz] '{chapter}' / '{topic}' 只取得 {len(result.questions)}/{num_questions} 題有效題目")
+    incomplete = result.missing(num_questions) > 0
+    return {"questions": result.questions, "requested": num_questions, "incomplete": incomplete}, result
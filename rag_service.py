@@ -0,0 +1,190 @@
+# 檔案：rag_service.py
+# 說明：RAG 問答與出題的核心邏輯（向量資料庫、ReAct Agent、LLM 呼叫）。
+#       此模組會載入 LangChain / Chroma 等重量級套件，由 ai_runtime 初始化時或第一次使用時才匯入。
+
+import os
+import time
+import threading
+from fastapi import HTTPException
+
+import crud, qa_router, quiz_output, ai_runtime, vector_index, faq_mining
+from chapter_registry import registry, CHROMA_ROOT
+from database import SessionLocal
+from metrics import metrics
+from request_profiling import stage
+from llm_client import LLMUnavailableError, invoke_agent
+from context_builder import (
+    build_context, PromptTokenLogger, RAG_RETRIEVAL_K, AGENT_OBSERVATION_TOKEN_BUDGET,
+    AGENT_SCRATCHPAD_STEPS, AGENT_MAX_ITERATIONS,
+)
+
+# LangChain Agent 相關匯入
+from langchain_community.vectorstores import Chroma
+from langchain.agents import Tool, AgentExecutor, create_react_agent
+from langchain_community.tools.google_search.tool import GoogleSearchRun
+from langchain_community.utilities.google_search import GoogleSearchAPIWrapper
+from langchain import hub
+
+# AI 服務故障時以過去的回答替代
+PATH_CACHED = "cached"
+
+# 已開啟的章節向量資料庫（依路徑快取），避免每個請求重新開啟 Chroma 與載入 HNSW 索引
+_store_cache = {}
+_store_lock = threading.Lock()
+
+def service_unavailable(e: Exception) -> HTTPException:
+    return HTTPException(status_code=503, detail=f"AI 服務暫時無法使用，請稍後再試: {e}")
+
+# --- Helper 函式來動態載入向量資料庫 ---
+def open_chapter_store(db_path: str):
+    """開啟（或取得已快取的）指定路徑的 Chroma 向量資料庫。"""
+    store = _store_cache.get(db_path)
+    if store is None:
+        with _store_lock:
+            store = _store_cache.get(db_path)
+            if store is None:
+                store = Chroma(persist_directory=db_path, embedding_function=ai_runtime.embeddings)
+                _store_cache[db_path] = store
+    return store
+
+def invalidate_chapter_store(chapter: str):
+    """章節重新索引後，移除快取中的舊向量資料庫。"""
+    db_path = os.path.join(CHROMA_ROOT, chapter)
+    with _store_lock:
+        # 進行中的請求仍可使用舊的 Chroma，最後一個請求釋放後才關閉其連線與索引
+        vector_index.release_chroma(db_path, holder=_store_cache.pop(db_path, None))
+
+# index_documents.py 重建章節後，章節登錄表偵測到新的索引戳記時丟棄舊的 Chroma
+registry.on_reindex(invalidate_chapter_store)
+
+def publish_chapter_index(chapter: str) -> dict:
+    """
+    將章節重新索引後的 Chroma 資料匯出為新版本的 NumPy 索引。
+    本行程立即切換；其他 worker 會在 VECTOR_INDEX_RELOAD_CHECK 秒內偵測到新版本並重新載入。
+    """
+    invalidate_chapter_store(chapter)
+    manifest = vector_index.export_chapter(chapter, chroma_root=CHROMA_ROOT)
+    vector_index.catalog.get(chapter, force_check=True)
+    return manifest
+
+def get_vector_store_for_chapter(chapter: str):
+    """
+    根據章節名稱取得對應的向量資料庫。章節已匯出且依 VECTOR_BACKEND 選用 NumPy 索引時
+    （auto 模式下為小章節），回傳共用的 memory-mapped 索引；否則回傳 ChromaDB（由章節登錄表判斷索引是否存在）。
+    """
+    with stage("vector_store.open"):
+        registry.check_reindexed(chapter)
+        index = vector_index.select_index(chapter)
+        if index is not None:
+            return vector_index.NumpyVectorStore(index, ai_runtime.embeddings)
+        db_path = registry.index_path(chapter)
+        if db_path is None:
+            raise HTTPException(status_code=404, detail=f"找不到章節 '{chapter}' 的知識庫。")
+        return open_chapter_store(db_path)
+
+def retrieve_context(vector_store, query: str, token_budget: int = None) -> str:
+    """檢索並組裝提示用的課程內容（去重、依相關度排序、依 token 預算裁切）。"""
+    with stage("rag.retrieve"):
+        scored_docs = vector_store.similarity_search_with_relevance_scores(query, k=RAG_RETRIEVAL_K)
+        return build_context(scored_docs, token_budget=token_budget)
+
+def run_agent(chapter: str, question: str, vector_store, callbacks=None) -> str:
+    """以完整的 ReAct Agent（課程知識庫 + 網路搜尋）回答問題。"""
+    def course_knowledge_base_search(query: str) -> str:
+        return retrieve_context(vector_store, query, token_budget=AGENT_OBSERVATION_TOKEN_BUDGET)
+
+    # f-string 不會成為 docstring，因此以 Tool.from_function 明確指定描述
+    knowledge_base_tool = Tool.from_function(
+        func=course_knowledge_base_search,
+        name="course_knowledge_base_search",
+        description=f"當問題與 '{chapter}' 章節的課程內容、講義、作業或評分標準相關時，使用此工具來搜尋內部知識庫。",
+    )
+
+    # 設定網路搜尋工具
+    search = GoogleSearchAPIWrapper(
+        google_api_key=os.environ.get("GOOGLE_API_KEY_SEARCH"), 
+        google_cse_id=os.environ.get("GOOGLE_CSE_ID")
+    )
+    web_search_tool = GoogleSearchRun(api_wrapper=search)
+    web_search_tool.name = "internet_search"
+    web_search_tool.description = "當問題涉及即時資訊、最新版本、外部事件或在課程知識庫中找不到答案時，使用此工具進行網路搜尋。"
+    
+    tools = [knowledge_base_tool, web_search_tool]
+    agent_prompt = hub.pull("hwchase17/react")
+    agent = create_react_agent(ai_runtime.llm.model, tools, agent_prompt)
+    agent_executor = AgentExecutor(
+        agent=agent, tools=tools, verbose=True, handle_parsing_errors=True,
+        max_iterations=AGENT_MAX_ITERATIONS,
+        trim_intermediate_steps=AGENT_SCRATCHPAD_STEPS,  # 限制 scratchpad 成長
+    )
+
+    response = invoke_agent(agent_executor, {"input": question}, config={"callbacks": callbacks or []})
+    return response.get("output", "抱歉，我無法處理這個問題。")
+
+def answer_with_faq(chapter: str, question: str, vector_store):
+    """
+    回傳 (答案, 路徑, 常見問題群集 id)。問題屬於某個常見問題群集時直接回覆預先產生的答案（不呼叫 LLM），
+    未命中時沿用比對時算好的問題向量回答。由 main 的 ask_flight 呼叫：並行的相同問題只嵌入一次，且受 LLM 併發上限控制。
+    """
+    faq, query_vector = faq_mining.faq_index.match(chapter, question, ai_runtime.embeddings)
+    if faq is not None:
+        metrics.incr(f"ask.path.{faq_mining.PATH_FAQ}")
+        return faq["answer"], faq_mining.PATH_FAQ, faq["id"]
+    answer, path = answer_question(chapter, question, vector_store, query_vector)
+    return answer, path, None
+
+def answer_question(chapter: str, question: str, vector_store, query_vector=None):
+    """
+    回答問題並回傳 (答案, 路徑)。檢索相似度夠高時走快速路徑，否則交給 Agent。
+    已有問題向量（例如比對常見問題時算好的）時直接以向量檢索，不再呼叫嵌入模型。
+    """
+    token_logger = PromptTokenLogger(f"ask[{chapter}]")
+    start = time.perf_counter()
+
+    try:
+        # 快速路徑：檢索結果相似度夠高時，只需一次 LLM 呼叫
+        with stage("rag.retrieve"):
+            if query_vector is not None:
+                hits = vector_index.similarity_search_by_vector(vector_store, query_vector, question, RAG_RETRIEVAL_K)
+                scored_docs = [(doc, score) for doc, score, _ in hits]
+            else:
+                scored_docs = vector_store.similarity_search_with_relevance_scores(question, k=RAG_RETRIEVAL_K)
+        if qa_router.is_confident(scored_docs):
+            path = qa_router.PATH_FAST
+            with stage("rag.fast_path"):
+                answer = qa_router.answer_from_context(ai_runtime.llm, chapter, question, scored_docs, callbacks=[token_logger])
+        else:
+            path = qa_router.PATH_AGENT
+            with stage("rag.agent"):
+                answer = run_agent(chapter, question, vector_store, callbacks=[token_logger])
+    except LLMUnavailableError as e:
+        # AI 服務故障時，退回先前對相同問題的回答
+        with SessionLocal() as db:
+            cached = crud.get_latest_answer(db, question=f"[{chapter}] {question}")
+        if cached is None:
+            metrics.incr("ask.unavailable")
+            raise service_unavailable(e)
+        path = PATH_CACHED
+        answer = cached
+
+    metrics.incr(f"ask.path.{path}")
+    metrics.observe(f"ask.latency.{path}", time.perf_counter() - start)
+    metrics.incr(f"ask.prompt_tokens.{path}", token_logger.total_tokens)
+    return answer, path
+
+def generate_quiz_data(chapter: str, topic: str, num_questions: int, vector_store) -> dict:
+    """根據章節內容產生測驗題目的 JSON 資料（逐題驗證，只修復缺少或格式錯誤的題目）。"""
+    context_text = retrieve_context(vector_store, topic)
+    invoke = lambda prompt, label: invoke_llm(prompt, label=label).content
+    try:
+        quiz_data, _ = quiz_output.generate_quiz(invoke, chapter, topic, num_questions, context_text)
+    except ValueError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    return quiz_data
+
+def invoke_llm(prompt: str, label: str):
+    """單次 LLM 呼叫（記錄提示 token 數）；AI 服務無法使用時轉為 503。"""
+    try:
+        return ai_runtime.llm.invoke(prompt, config={"callbacks": [PromptTokenLogger(label)]})
+    except LLMUnavailableError as e:
+        raise service_unavailable(e)
@@ -0,0 +1,152 @@
+# 檔案：rate_limit.py
+# 說明：流量控制。以 token bucket 限制每位使用者的請求速率（管理員有較寬鬆的額度），
+#       並以全域 semaphore 限制同時進行中的 LLM / 嵌入計算，排隊已滿時快速拒絕。
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, Optional, Tuple
+
+from fastapi import Depends, HTTPException, status
+
+import auth, models
+from metrics import metrics
+from request_profiling import stage
+
+# --- 每位使用者的速率限制 (每分鐘補充的請求數, 可瞬間爆發的請求數) ---
+USER_RATE_PER_MINUTE = float(os.environ.get("USER_RATE_PER_MINUTE", "10"))
+USER_RATE_BURST = int(os.environ.get("USER_RATE_BURST", "5"))
+ADMIN_RATE_PER_MINUTE = float(os.environ.get("ADMIN_RATE_PER_MINUTE", "60"))
+ADMIN_RATE_BURST = int(os.environ.get("ADMIN_RATE_BURST", "20"))
+
+# --- 全域 LLM 併發上限 ---
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "30"))
+
+# 最多追蹤多少位使用者的 bucket，超過時淘汰最久未使用者
+MAX_TRACKED_USERS = 10000
+
+
+class TokenBucket:
+    """容量為 capacity、每秒補充 refill_rate 個 token 的 bucket。"""
+
+    def __init__(self, capacity: int, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def try_acquire(self, now: float) -> float:
+        """嘗試取得一個 token；成功回傳 0，否則回傳需要等待的秒數。"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.refill_rate
+
+
+class RateLimiter:
+    """依使用者與角色分別維護 token bucket。"""
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]], default_role: str = "user"):
+        # limits: {角色: (每分鐘請求數, 爆發量)}
+        self.limits = limits
+        self.default_role = default_role
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key: Hashable, role: str) -> float:
+        """回傳 0 表示放行，否則為建議的重試等待秒數。"""
+        per_minute, burst = self.limits.get(role, self.limits[self.default_role])
+        with self._lock:
+            bucket = self._buckets.get((key, role))
+            if bucket is None:
+                bucket = TokenBucket(burst, per_minute / 60.0)
+                self._buckets[(key, role)] = bucket
+                if len(self._buckets) > MAX_TRACKED_USERS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end((key, role))
+            return bucket.try_acquire(time.monotonic())
+
+
+class AdmissionController:
+    """限制同時進行的計算數量；等待中的請求超過 max_queue 時立即以 503 拒絕。"""
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._waiting = 0
+        self._active = 0
+
+    def _reject(self, reason: str):
+        metrics.incr(f"admission.{self.name}.rejected.{reason}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="系統目前忙碌中，請稍後再試。",
+            headers={"Retry-After": str(max(1, int(self.queue_timeout // 2)))},
+        )
+
+    def _report(self):
+        metrics.set_gauge(f"admission.{self.name}.queue_depth", self._waiting)
+        metrics.set_gauge(f"admission.{self.name}.active", self._active)
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        # 以自行維護的計數判斷，避免 semaphore 尚未實際取得前的競態
+        if self._active + self._waiting >= self.max_concurrency + self.max_queue:
+            self._reject("queue_full")
+
+        self._waiting += 1
+        self._report()
+        try:
+            with stage(f"admission.{self.name}.wait"):
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject("timeout")
+        finally:
+            self._waiting -= 1
+            self._report()
+
+        self._active += 1
+        self._report()
+        try:
+            yield
+        finally:
+            self._active -= 1
+            self._semaphore.release()
+            self._report()
+
+
+# 全域共用的限制器
+user_rate_limiter = RateLimiter({
+    "user": (USER_RATE_PER_MINUTE, USER_RATE_BURST),
+    "admin": (ADMIN_RATE_PER_MINUTE, ADMIN_RATE_BURST),
+})
+llm_admission = AdmissionController("llm", LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT)
+
+
+async def get_rate_limited_user(current_user: models.User = Depends(auth.get_current_user)):
+    """
+    取代 auth.get_current_user 的依賴項，額外套用每位使用者的速率限制。
+    """
+    retry_after = user_rate_limiter.check(current_user.id, current_user.role)
+    if retry_after:
+        metrics.incr(f"rate_limit.rejected.{current_user.role}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="請求過於頻繁，請稍後再試。",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+    return current_user
@@ -0,0 +1,412 @@
+# 檔案：request_profiling.py
+# 說明：管理員觸發的請求剖析與慢請求擷取。
+#       - 各階段耗時：程式中以 stage("名稱") 標記（LLM / 嵌入呼叫、檢索、常見問題比對、排隊等候…），
+#         目前請求以 contextvars 傳遞，run_in_threadpool 與 llm_client 的執行緒池中也能記錄到同一個請求。
+#       - 剖析模式（PUT /api/admin/profiling 開啟，到期自動關閉）：依比例、路徑前綴或章節挑選請求，
+#         sample 以背景執行緒定期讀取 sys._current_frames() 取樣呼叫堆疊，cprofile 在請求使用的工作執行緒上啟用 cProfile。
+#       - 慢請求：設定 PROFILING_SLOW_MS（或 PUT 的 slow_ms）後，超過門檻的請求保留各階段耗時，並從超過門檻起開始取樣呼叫堆疊；
+#         預設停用，未開啟時請求不建立任何剖析狀態。串流回應（匯出、批次出題）計時到本文送完為止。
+#       事件迴圈執行緒由所有請求共用，不取樣也不啟用 cProfile（該處的階段仍會記錄耗時）。
+#       擷取結果寫入 PROFILING_DIR（保留最新 PROFILING_BUFFER_SIZE 筆，所有 worker 共用），
+#       可下載為 pstats（cprofile，供 python -m pstats / snakeviz）或 speedscope（取樣，https://www.speedscope.app）。
+
+import itertools
+import json
+import marshal
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from cache import cache
+from metrics import metrics
+
+# 超過此毫秒數的請求保留各階段耗時與呼叫堆疊；0 表示停用（Agent 回答常超過數秒，門檻應高於此）
+PROFILING_SLOW_MS = float(os.environ.get("PROFILING_SLOW_MS", "0"))
+PROFILING_DIR = os.environ.get("PROFILING_DIR", "profiles")
+PROFILING_BUFFER_SIZE = int(os.environ.get("PROFILING_BUFFER_SIZE", "50"))
+# sample 模式的取樣間隔；慢請求超過門檻後以較粗的間隔取樣
+PROFILING_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILING_SAMPLE_INTERVAL_MS", "5"))
+PROFILING_SLOW_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILING_SLOW_SAMPLE_INTERVAL_MS", "50"))
+# 各 worker 重新讀取剖析設定（存於共用快取）的間隔（秒）
+PROFILING_CONFIG_CHECK = float(os.environ.get("PROFILING_CONFIG_CHECK", "2"))
+MAX_STACK_DEPTH = 128
+TOP_FUNCTIONS = 30
+
+MODE_OFF, MODE_SAMPLE, MODE_CPROFILE = "off", "sample", "cprofile"
+MODES = (MODE_OFF, MODE_SAMPLE, MODE_CPROFILE)
+EXCLUDED_PREFIX = "/api/admin/profiling"
+_CAPTURE_ID = re.compile(r"^[0-9]+-[0-9]+-[0-9]+$")
+
+_current: ContextVar[Optional["RequestProfile"]] = ContextVar("request_profile", default=None)
+
+
+class RequestProfile:
+    """一個請求的剖析狀態；threads 為目前正在為此請求工作的執行緒（計數）。"""
+
+    def __init__(self, method: str, path: str, chapter: Optional[str], mode: Optional[str], slow_after: Optional[float], loop_thread: int):
+        self.method = method
+        self.path = path
+        self.chapter = chapter
+        self.mode = mode
+        self.slow_after = slow_after
+        self.slow = False
+        self.loop_thread = loop_thread
+        self.started_at = datetime.utcnow()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.status = None
+        self.stages: List[dict] = []
+        self.threads: Dict[int, int] = {}
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.cprofiles: Dict[int, object] = {}
+        self.finished_profiles: List[object] = []
+        self.lock = threading.Lock()
+
+    def enter_thread(self, thread: int):
+        with self.lock:
+            depth = self.threads.get(thread, 0)
+            self.threads[thread] = depth + 1
+        if depth == 0 and self.mode == MODE_CPROFILE:
+            import cProfile
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:  # 此執行緒已有其他剖析工具
+                return
+            self.cprofiles[thread] = profile
+
+    def exit_thread(self, thread: int):
+        with self.lock:
+            depth = self.threads.get(thread, 1) - 1
+            if depth:
+                self.threads[thread] = depth
+            else:
+                self.threads.pop(thread, None)
+        if depth == 0 and thread in self.cprofiles:
+            profile = self.cprofiles.pop(thread)
+            profile.disable()
+            with self.lock:
+                self.finished_profiles.append(profile)
+
+
+@contextmanager
+def _thread_scope(profile: RequestProfile):
+    thread = threading.get_ident()
+    # 事件迴圈執行緒同時執行所有請求，其呼叫堆疊無法歸屬到單一請求
+    if thread == profile.loop_thread:
+        yield
+        return
+    profile.enter_thread(thread)
+    try:
+        yield
+    finally:
+        profile.exit_thread(thread)
+
+
+@contextmanager
+def stage(name: str):
+    """記錄目前請求中一個階段的耗時；沒有請求（例如背景工作）時不做任何事。"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        with _thread_scope(profile):
+            yield
+    finally:
+        profile.stages.append({
+            "name": name, "start_ms": round((start - profile.start) * 1000, 2),
+            "duration_ms": round((time.perf_counter() - start) * 1000, 2), "thread": threading.get_ident(),
+        })
+
+
+def attach(fn):
+    """包裝要交給其他執行緒池執行的函式，讓該執行緒的工作也算入目前請求的取樣與 cProfile（需搭配 copy_context）。"""
+    def run(*args, **kwargs):
+        profile = _current.get()
+        if profile is None:
+            return fn(*args, **kwargs)
+        with _thread_scope(profile):
+            return fn(*args, **kwargs)
+    return run
+
+
+def _frame_stack(frame) -> tuple:
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+class Profiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active: Dict[int, RequestProfile] = {}
+        self._config: dict = {"mode": MODE_OFF}
+        self._config_checked = float("-inf")
+        self._sampler: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self._ids = itertools.count(1)
+        # 保存在單一背景執行緒中依序進行，不延遲回應，也不必在串流結束的清理程式中等待
+        self._saver = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-save")
+        self._unpruned = 0
+
+    # --- 設定（存於共用快取，所有 worker 生效）---
+    def config(self) -> dict:
+        now = time.monotonic()
+        if now - self._config_checked >= PROFILING_CONFIG_CHECK:
+            self._config = cache.get("profiling", "config") or {"mode": MODE_OFF}
+            self._config_checked = now
+        return self._config
+
+    def configure(self, mode: str, rate: float = 1.0, path: Optional[str] = None, chapter: Optional[str] = None,
+                  slow_ms: Optional[float] = None, duration_seconds: float = 600) -> dict:
+        if mode not in MODES:
+            raise ValueError(f"不支援的剖析模式: {mode}")
+        config = {"mode": mode, "rate": rate, "path": path, "chapter": chapter,
+                  "slow_ms": PROFILING_SLOW_MS if slow_ms is None else slow_ms,
+                  "expires_at": time.time() + duration_seconds}
+        cache.set("profiling", "config", config, ttl=duration_seconds)
+        self._config, self._config_checked = config, time.monotonic()
+        return self.describe_config()
+
+    def describe_config(self) -> dict:
+        config = dict(self.config())
+        config.setdefault("slow_ms", PROFILING_SLOW_MS)
+        if config.get("expires_at"):
+            config["expires_in"] = max(0, round(config["expires_at"] - time.time()))
+        return config
+
+    def _selected(self, config: dict, path: str, chapter: Optional[str]) -> Optional[str]:
+        mode = config.get("mode", MODE_OFF)
+        if mode == MODE_OFF or config.get("expires_at", 0) < time.time():
+            return None
+        if config.get("path") and not path.startswith(config["path"]):
+            return None
+        if config.get("chapter") and chapter != config["chapter"]:
+            return None
+        return mode if random.random() < config.get("rate", 1.0) else None
+
+    # --- 請求的開始與結束（由 main.py 的 middleware 呼叫）---
+    def begin(self, method: str, path: str, chapter: Optional[str]) -> Optional[RequestProfile]:
+        if path.startswith(EXCLUDED_PREFIX):
+            return None
+        config = self.config()
+        mode = self._selected(config, path, chapter)
+        slow_ms = config.get("slow_ms", PROFILING_SLOW_MS)
+        if mode is None and slow_ms <= 0:
+            return None
+        profile = RequestProfile(method, path, chapter, mode, slow_ms / 1000 if slow_ms > 0 else None, threading.get_ident())
+        with self._lock:
+            self._active[id(profile)] = profile
+        self._ensure_sampler()
+        if mode:
+            metrics.incr(f"profiling.requests.{mode}")
+        return profile
+
+    def activate(self, profile: RequestProfile):
+        return _current.set(profile)
+
+    def deactivate(self, token):
+        _current.reset(token)
+
+    def finish(self, profile: RequestProfile, status: int) -> bool:
+        """結束請求；回傳是否需要保存（被挑選剖析的請求或慢請求），需要時呼叫 save_later()。"""
+        profile.duration = time.perf_counter() - profile.start
+        profile.status = status
+        with self._lock:
+            self._active.pop(id(profile), None)
+        profile.slow = profile.slow_after is not None and profile.duration >= profile.slow_after
+        if profile.slow:
+            metrics.incr("profiling.slow_requests")
+        return bool(profile.mode) or profile.slow
+
+    def save_later(self, profile: RequestProfile):
+        self._saver.submit(self._save_logged, profile)
+
+    def _save_logged(self, profile: RequestProfile):
+        try:
+            self.save(profile)
+        except Exception as e:
+            print(f"[profiling] 保存剖析結果失敗: {e}")
+
+    # --- 取樣 ---
+    def _ensure_sampler(self):
+        self._wake.set()
+        if self._sampler is None:
+            with self._lock:
+                if self._sampler is None:
+                    self._sampler = threading.Thread(target=self._sample_loop, name="request-sampler", daemon=True)
+                    self._sampler.start()
+
+    def _sample_loop(self):
+        while True:
+            with self._lock:
+                active = list(self._active.values())
+            if not active:
+                # 沒有進行中的請求時睡眠，直到下一個請求開始
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            sampling = any(p.mode == MODE_SAMPLE for p in active)
+            time.sleep((PROFILING_SAMPLE_INTERVAL_MS if sampling else PROFILING_SLOW_SAMPLE_INTERVAL_MS) / 1000)
+            now = time.perf_counter()
+            targets = [p for p in active if p.mode == MODE_SAMPLE or (p.slow_after is not None and now - p.start >= p.slow_after)]
+            if not targets:
+                continue
+            frames = sys._current_frames()
+            for profile in targets:
+                with profile.lock:
+                    threads = list(profile.threads)
+                stacks = [(thread, _frame_stack(frames[thread])) for thread in threads if thread in frames]
+                # 快照可能包含剛結束的請求，與 save() 同樣在鎖內更新，避免保存時計數器被修改
+                with profile.lock:
+                    profile.sample_count += 1
+                    profile.samples.update(stacks)
+            del frames
+
+    # --- 保存與查詢 ---
+    def save(self, profile: RequestProfile) -> str:
+        capture_id = f"{int(time.time() * 1000)}-{os.getpid()}-{next(self._ids)}"
+        interval = PROFILING_SAMPLE_INTERVAL_MS if profile.mode == MODE_SAMPLE else PROFILING_SLOW_SAMPLE_INTERVAL_MS
+        with profile.lock:
+            samples = profile.samples.most_common()
+            sample_count = profile.sample_count
+            stages = list(profile.stages)
+            finished_profiles = list(profile.finished_profiles)
+        data = {
+            "id": capture_id, "pid": os.getpid(), "method": profile.method, "path": profile.path, "chapter": profile.chapter,
+            "status": profile.status, "started_at": profile.started_at.isoformat() + "Z",
+            "duration_ms": round(profile.duration * 1000, 2), "mode": profile.mode, "slow": profile.slow,
+            "stages": sorted(stages, key=lambda s: s["start_ms"]),
+            "sample_interval_ms": interval, "sample_ticks": sample_count,
+            "samples": [{"thread": thread, "count": count, "stack": [list(f) for f in stack]}
+                        for (thread, stack), count in samples],
+            "top_functions": [],
+        }
+        os.makedirs(PROFILING_DIR, exist_ok=True)
+        if finished_profiles:
+            import pstats
+            stats = pstats.Stats(finished_profiles[0])
+            for extra in finished_profiles[1:]:
+                stats.add(extra)
+            data["top_functions"] = _top_functions(stats.stats)
+            with open(os.path.join(PROFILING_DIR, f"{capture_id}.prof"), "wb") as f:
+                marshal.dump(stats.stats, f)
+        path = os.path.join(PROFILING_DIR, f"{capture_id}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        # 列出並排序整個目錄的成本隨保存次數累加，每保存約一成緩衝區筆數才整理一次（目錄最多短暫多出這些檔案）
+        self._unpruned += 1
+        if self._unpruned >= max(1, PROFILING_BUFFER_SIZE // 10):
+            self._unpruned = 0
+            self._prune()
+        metrics.incr("profiling.captures")
+        return capture_id
+
+    def _capture_files(self) -> List[str]:
+        if not os.path.isdir(PROFILING_DIR):
+            return []
+        # 檔名以毫秒時間戳開頭，依數值排序即為時間順序
+        ids = [name[:-5] for name in os.listdir(PROFILING_DIR) if name.endswith(".json") and _CAPTURE_ID.match(name[:-5])]
+        return sorted(ids, key=lambda i: tuple(int(part) for part in i.split("-")))
+
+    def _remove(self, capture_id: str):
+        for ext in (".json", ".prof"):
+            try:
+                os.remove(os.path.join(PROFILING_DIR, capture_id + ext))
+            except FileNotFoundError:
+                pass
+
+    def _prune(self):
+        ids = self._capture_files()
+        for capture_id in ids[:max(0, len(ids) - PROFILING_BUFFER_SIZE)]:
+            self._remove(capture_id)
+
+    def load(self, capture_id: str) -> Optional[dict]:
+        if not _CAPTURE_ID.match(capture_id):
+            return None
+        try:
+            with open(os.path.join(PROFILING_DIR, f"{capture_id}.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def list_captures(self) -> List[dict]:
+        """最新的擷取在前；不含取樣的堆疊內容。"""
+        captures = []
+        for capture_id in reversed(self._capture_files()):
+            data = self.load(capture_id)
+            if data is None:
+                continue
+            data["samples"] = sum(s["count"] for s in data["samples"])
+            data["stages"] = len(data["stages"])
+            data["has_pstats"] = os.path.exists(os.path.join(PROFILING_DIR, f"{capture_id}.prof"))
+            data.pop("top_functions", None)
+            captures.append(data)
+        return captures
+
+    def clear(self) -> int:
+        ids = self._capture_files()
+        for capture_id in ids:
+            self._remove(capture_id)
+        return len(ids)
+
+    def pstats_bytes(self, capture_id: str) -> Optional[bytes]:
+        if not _CAPTURE_ID.match(capture_id):
+            return None
+        try:
+            with open(os.path.join(PROFILING_DIR, f"{capture_id}.prof"), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def active_count(self) -> int:
+        with self._lock:
+            return len(self._active)
+
+
+def _top_functions(stats: dict, limit: int = TOP_FUNCTIONS) -> List[dict]:
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [{"function": func, "file": file, "line": line, "calls": nc, "tottime_ms": round(tt * 1000, 3), "cumtime_ms": round(ct * 1000, 3)}
+            for (file, line, func), (cc, nc, tt, ct, callers) in rows]
+
+
+def to_speedscope(data: dict) -> dict:
+    """將取樣的呼叫堆疊轉為 speedscope 的 sampled 格式（每個執行緒一個 profile）。"""
+    frames, frame_index, by_thread = [], {}, {}
+    for sample in data["samples"]:
+        indices = []
+        for name, file, line in sample["stack"]:
+            key = (name, file, line)
+            if key not in frame_index:
+                frame_index[key] = len(frames)
+                frames.append({"name": name, "file": file, "line": line})
+            indices.append(frame_index[key])
+        thread = by_thread.setdefault(sample["thread"], {"samples": [], "weights": []})
+        thread["samples"].append(indices)
+        thread["weights"].append(sample["count"] * data["sample_interval_ms"])
+    profiles = [
+        {"type": "sampled", "name": f"{data['method']} {data['path']} (thread {thread})", "unit": "milliseconds",
+         "startValue": 0, "endValue": sum(values["weights"]), "samples": values["samples"], "weights": values["weights"]}
+        for thread, values in by_thread.items()
+    ]
+    return {"$schema": "https://www.speedscope.app/file-format-schema.json", "name": f"{data['method']} {data['path']} {data['id']}",
+            "exporter": "virtual-ta request_profiling", "activeProfileIndex": 0, "shared": {"frames": frames}, "profiles": profiles}
+
+
+profiler = Profiler()
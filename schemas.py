@@ -22,11 +22,54 @@ class Token(BaseModel):
 class AskRequest(BaseModel):
     question: str
 
+# --- Tutor Session Schemas ---
+class TutorSessionCreate(BaseModel):
+    chapter: str
+
+class TutorAskRequest(BaseModel):
+    question: str = Field(min_length=1)
+
+class TutorTurnSchema(BaseModel):
+    id: int
+    question: str
+    answer: str
+    path: str
+    reused_context: bool
+    prompt_tokens: int
+    created_at: Optional[datetime] = None
+    class Config: from_attributes = True
+
+class TutorSessionListItem(BaseModel):
+    id: int
+    chapter: str
+    title: str
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    class Config: from_attributes = True
+
+class TutorSessionSchema(TutorSessionListItem):
+    summary: str
+    summarized_turns: int
+    turns: List[TutorTurnSchema] = []
+
+class TutorAnswer(BaseModel):
+    session_id: int
+    turn_id: int
+    answer: str
+    path: str
+    reused_context: bool
+    prompt_tokens: int
+
 # --- Quiz Schemas ---
 class GenerateQuizRequest(BaseModel):
     topic: str
     num_questions: int = Field(default=3, gt=0, le=10)
 
+class QuizBatchRequest(BaseModel):
+    """管理員批次出題：同一章節的多個主題（每個主題可各自指定題數）。"""
+    topics: List[GenerateQuizRequest] = Field(min_length=1, max_length=50)
+    persist: bool = True
+
 class ChoiceSchema(BaseModel):
     id: int
     choice_text: str
@@ -42,6 +85,9 @@ class QuizAttemptSchema(BaseModel):
     id: int
     topic: str
     questions: List[QuestionSchema]
+    # 產生測驗時回傳：要求的題數，以及修復後仍少於要求題數時 incomplete 為 true
+    requested: Optional[int] = None
+    incomplete: bool = False
     class Config: from_attributes = True
 
 class SubmitAnswer(BaseModel):
@@ -87,10 +133,72 @@ class RAGQueryLogSchema(BaseModel):
 class QuizAttemptAdminView(QuizResultSchema):
     user: UserSchema
 
+class QueryLogSearchHit(BaseModel):
+    id: int
+    chapter: Optional[str] = None
+    question: str  # 命中的詞以 <mark></mark> 標示
+    answer_snippet: Optional[str] = None
+    created_at: datetime
+    user_id: Optional[int] = None
+    user_email: Optional[str] = None
+    score: float
+
+class QueryLogSearchPage(BaseModel):
+    items: List[QueryLogSearchHit]
+    next_cursor: Optional[str] = None  # 下一頁帶入 ?cursor=；None 表示沒有更多結果
+    took_ms: float
+
+class ItemStatSchema(BaseModel):
+    item_key: str
+    topic: str
+    question_text: str
+    correct_answer_index: int
+    responses: int
+    choice_counts: List[int]  # 各選項被選的次數
+    correct_rate: Optional[float] = None  # 難度：答對率
+    mean_score: Optional[float] = None  # 作答者的平均測驗分數
+    discrimination: Optional[float] = None  # 點二系列相關；無法計算時為 None
+    flags: List[str] = []  # too_easy / too_hard / low_discrimination / negative_discrimination
+    updated_at: Optional[datetime] = None
+
+class TopicStatSchema(BaseModel):
+    topic: str
+    items: int
+    responses: int
+    correct_rate: Optional[float] = None
+    mean_score: Optional[float] = None
+    discrimination: Optional[float] = None
+    updated_at: Optional[datetime] = None
+
+class FaqClusterSchema(BaseModel):
+    id: int
+    chapter: str
+    rank: int
+    size: int
+    unique_questions: int
+    representative: str
+    sample_questions: List[str]
+    answer: Optional[str] = None
+    answer_path: Optional[str] = None
+    answered_at: Optional[datetime] = None
+    hits: int
+    mined_at: Optional[datetime] = None
+    class Config: from_attributes = True
+
+class ProfilingSettings(BaseModel):
+    """請求剖析設定：mode 為 off / sample（取樣呼叫堆疊）/ cprofile，duration_seconds 後自動恢復預設。"""
+    mode: str = Field(pattern="^(off|sample|cprofile)$")
+    rate: float = Field(default=1.0, gt=0, le=1, description="被挑選剖析的請求比例")
+    path: Optional[str] = Field(None, description="只剖析此路徑前綴，例如 /api/ask")
+    chapter: Optional[str] = Field(None, description="只剖析 chapter 查詢參數為此章節的請求")
+    slow_ms: Optional[float] = Field(None, ge=0, description="慢請求門檻（毫秒），0 表示停用")
+    duration_seconds: float = Field(default=600, gt=0, le=86400)
+
 class LearningRecommendation(BaseModel):
     recommendation_type: str # e.g., "review_topic", "practice_quiz"
     topic: str
     reason: str
+    resources: List[ExternalResourceSchema] = []  # 標籤與主題相符的外部資源
     
 class AnalyticsSummary(BaseModel):
     summary: str
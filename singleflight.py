@@ -0,0 +1,63 @@
+# 檔案：singleflight.py
+# 說明：相同請求的合併執行 (single-flight)。同一個 key 同時只會有一個計算在進行，
+#       其他並行的重複請求會等待並共用同一份結果。
+
+import asyncio
+import re
+import unicodedata
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from metrics import metrics
+
+_WS_RE = re.compile(r"\s+")
+_TRAILING_PUNCT = " ?？!！。.,，~～"
+
+
+def normalize_text(text: str) -> str:
+    """正規化問題或主題文字：全形轉半形、小寫、合併空白、去除結尾標點。"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return _WS_RE.sub(" ", text).strip().rstrip(_TRAILING_PUNCT)
+
+
+class SingleFlight:
+    """以 asyncio Task 合併相同 key 的並行計算；計算本身在執行緒池中執行，不會阻塞事件迴圈。"""
+
+    def __init__(self, name: str, admission=None):
+        self.name = name
+        # 選用的 rate_limit.AdmissionController：只有實際執行計算的請求需要佔用名額
+        self.admission = admission
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        # 取出例外，避免所有等待者都已離開時出現 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self.admission is None:
+            return await run_in_threadpool(fn, *args)
+        async with self.admission.slot():
+            return await run_in_threadpool(fn, *args)
+
+    async def do(self, key: Hashable, fn: Callable[..., Any], *args: Any) -> Tuple[Any, bool]:
+        """
+        執行 fn(*args) 並回傳 (結果, 是否為共用結果)。
+        若已有相同 key 的計算進行中，則等待該計算完成並共用其結果。
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if shared:
+            metrics.incr(f"singleflight.{self.name}.coalesced")
+        else:
+            task = asyncio.ensure_future(self._run(fn, *args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, key=key: self._finish(key, t))
+            metrics.incr(f"singleflight.{self.name}.executed")
+        # shield：發起請求的客戶端斷線時，不影響其他仍在等待的請求
+        return await asyncio.shield(task), shared
+
+    def inflight_count(self) -> int:
+        return len(self._inflight)
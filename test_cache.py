@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+測試共用快取的後端（cache.MemoryCache / SQLiteCache / RedisCache）：到期、命名空間失效與筆數上限
+RedisCache 以行程內的假 Redis 測試（只實作用到的指令，glob 規則與 Redis 相同）
+用法：python -m pytest test_cache.py
+"""
+
+import re
+import time
+
+import pytest
+
+import cache
+
+
+class FakeRedis:
+    """行程內的 Redis 替身：get / set(px) / delete / unlink / scan_iter(match)，鍵與值以 bytes 儲存。"""
+
+    def __init__(self):
+        self.data = {}
+        self.px = {}
+
+    @staticmethod
+    def _glob(pattern: str):
+        # Redis 的 glob：* ? [...]，反斜線跳脫下一個字元
+        out, i = [], 0
+        while i < len(pattern):
+            ch = pattern[i]
+            if ch == "\\" and i + 1 < len(pattern):
+                out.append(re.escape(pattern[i + 1]))
+                i += 2
+                continue
+            if ch == "*":
+                out.append(".*")
+            elif ch == "?":
+                out.append(".")
+            elif ch == "[":
+                end = pattern.index("]", i + 1)
+                out.append("[" + pattern[i + 1:end] + "]")
+                i = end
+            else:
+                out.append(re.escape(ch))
+            i += 1
+        return re.compile("".join(out), re.DOTALL)
+
+    def _live(self, key: bytes):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            del self.data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        entry = self._live(key.encode("utf-8"))
+        return entry[0] if entry else None
+
+    def set(self, key, value, px=None):
+        self.px[key] = px
+        self.data[key.encode("utf-8")] = (value.encode("utf-8"), time.time() + px / 1000 if px else None)
+
+    def delete(self, *keys):
+        return sum(self.data.pop(k.encode("utf-8") if isinstance(k, str) else k, None) is not None for k in keys)
+
+    unlink = delete
+
+    def scan_iter(self, match="*", count=None):
+        regex = self._glob(match)
+        return [key for key in list(self.data) if regex.fullmatch(key.decode("utf-8")) and self._live(key)]
+
+
+def _redis_cache(client=None, prefix="vta:"):
+    # 不經過 __init__（測試環境不需要安裝 redis 套件）
+    backend = cache.RedisCache.__new__(cache.RedisCache)
+    backend.client, backend.prefix = client or FakeRedis(), prefix
+    return backend
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return cache.MemoryCache(max_entries=10)
+    if request.param == "redis":
+        return _redis_cache()
+    return cache.SQLiteCache(str(tmp_path / "cache.db"), max_entries=10)
+
+
+def test_get_set_delete(backend):
+    assert backend.get("ns", "k") is None
+    backend.set("ns", "k", "v", None)
+    assert backend.get("ns", "k") == "v"
+    backend.set("ns", "k", "v2", 60)
+    assert backend.get("ns", "k") == "v2"
+    backend.delete("ns", "k")
+    assert backend.get("ns", "k") is None
+
+
+def test_expired_entries(backend, monkeypatch):
+    backend.set("ns", "k", "v", 10)
+    now = time.time()
+    monkeypatch.setattr(cache.time, "time", lambda: now + 11)
+    assert backend.get("ns", "k") is None
+
+
+def test_invalidate_includes_sub_namespaces_only(backend):
+    for namespace in ("auth", "auth:abc", "auth:abc:x", "authors", "auth;"):
+        backend.set(namespace, "k", namespace, None)
+    assert backend.invalidate("auth") == 3
+    assert backend.get("authors", "k") == "authors"
+    assert backend.get("auth;", "k") == "auth;"
+    assert backend.get("auth:abc", "k") is None
+
+
+def test_memory_cache_evicts_least_recently_used():
+    backend = cache.MemoryCache(max_entries=2)
+    backend.set("ns", "a", "1", None)
+    backend.set("ns", "b", "2", None)
+    backend.get("ns", "a")
+    backend.set("ns", "c", "3", None)
+    assert backend.get("ns", "b") is None
+    assert backend.get("ns", "a") == "1" and backend.size() == 2
+
+
+def test_sqlite_cache_purges_expired_then_oldest(tmp_path, monkeypatch):
+    backend = cache.SQLiteCache(str(tmp_path / "cache.db"), max_entries=2)
+    monkeypatch.setattr(backend, "PURGE_EVERY", 4)
+    backend.set("ns", "expired", "x", 0.01)
+    backend.set("ns", "soon", "x", 60)
+    backend.set("ns", "later", "x", 120)
+    time.sleep(0.02)
+    backend.set("ns", "forever", "x", None)
+    assert backend.size() == 2
+    assert backend.get("ns", "later") == "x" and backend.get("ns", "forever") == "x"
+
+
+def test_redis_key_layout_and_ttl():
+    backend = _redis_cache()
+    backend.set("answers:ch1", "q", "v", 1.5)
+    backend.set("answers", "q", "v", None)
+    assert set(backend.client.data) == {b"vta:answers:ch1|q", b"vta:answers|q"}
+    assert backend.client.px == {"vta:answers:ch1|q": 1500, "vta:answers|q": None}
+
+
+def test_redis_invalidate_escapes_glob_characters():
+    backend = _redis_cache()
+    for namespace in ("a*", "a*:sub", "ab", "a?", "a[b]", "a[b]:x", "ab:x"):
+        backend.set(namespace, "k", "v", None)
+    assert backend.invalidate("a*") == 2
+    assert backend.invalidate("a[b]") == 2
+    assert sorted(backend.client.data) == [b"vta:a?|k", b"vta:ab:x|k", b"vta:ab|k"]
+
+
+def test_redis_size_counts_only_prefix():
+    client = FakeRedis()
+    backend, other = _redis_cache(client, prefix="vta:"), _redis_cache(client, prefix="other:")
+    backend.set("ns", "a", "1", None)
+    backend.set("ns", "b", "2", None)
+    other.set("ns", "a", "1", None)
+    assert backend.size() == 2 and other.size() == 1
+    assert backend.invalidate("ns") == 2 and other.get("ns", "a") == "1"
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+測試章節登錄表在其他 worker 修改章節後重新載入（chapter_registry.ChapterRegistry.check_db）
+用法：python -m pytest test_chapter_registry.py
+"""
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import chapter_registry
+import crud
+import models
+import schemas
+
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    """所有 worker 共用的記憶體資料庫。"""
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(chapter_registry, "SessionLocal", factory)
+    yield factory
+    engine.dispose()
+
+
+def _registry(tmp_path):
+    registry = chapter_registry.ChapterRegistry(chroma_root=str(tmp_path / "chroma_db"))
+    registry.reload()
+    return registry
+
+
+def test_check_db_picks_up_changes_from_other_workers(session_factory, tmp_path):
+    worker_a, worker_b = _registry(tmp_path), _registry(tmp_path)
+    assert not worker_b.check_db()
+
+    with session_factory() as db:
+        chapter = crud.create_chapter(db, schemas.ChapterCreate(name="ch1", display_name="第一章", folder_path="data/ch1"))
+        worker_a.refresh_from_db(db)
+    assert [c.name for c in worker_a.managed_chapters()] == ["ch1"]
+    assert worker_b.managed_chapters() == []
+    old_etag = worker_b.etag
+
+    assert worker_b.check_db()
+    assert [c.name for c in worker_b.managed_chapters()] == ["ch1"]
+    assert worker_b.etag == worker_a.etag != old_etag
+    assert not worker_b.check_db()
+
+    with session_factory() as db:
+        crud.toggle_chapter_status(db, chapter.id)
+    assert worker_b.check_db()
+    assert worker_b.managed_chapters() == [] and worker_b.get("ch1").is_active == 0
+
+    with session_factory() as db:
+        crud.delete_chapter(db, chapter.id)
+    assert worker_b.check_db()
+    assert worker_b.get("ch1") is None
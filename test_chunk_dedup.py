@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+測試建立索引前的重複區塊去除（chunk_dedup.deduplicate / strip_repeated_lines）
+用法：python -m pytest test_chunk_dedup.py
+"""
+
+import pytest
+from langchain_core.documents import Document
+
+import chunk_dedup
+
+TEXT = ("梯度下降是一種迭代的最佳化方法，每一步沿著損失函數的負梯度方向更新參數，"
+        "學習率決定每一步的大小；學習率太大可能發散，太小則收斂緩慢。")
+
+
+def _doc(text, source="a.pdf", page=0):
+    return Document(page_content=text, metadata={"source": source, "page": page})
+
+
+def test_deduplicate_exact_and_near_duplicates():
+    chunks = [
+        _doc(TEXT, page=0),
+        _doc("  " + TEXT + "\n", source="b.pdf", page=3),
+        _doc(TEXT[:-1] + "！", source="c.pdf", page=1),
+        _doc("過擬合是指模型在訓練資料上表現很好，卻無法推廣到新資料的現象。", page=2),
+    ]
+    kept, report = chunk_dedup.deduplicate(chunks)
+    assert [c.metadata["page"] for c in kept] == [0, 2]
+    assert kept[0].metadata["duplicates"] == 2
+    assert kept[0].metadata["duplicate_sources"] == "b.pdf#3,c.pdf#1"
+    assert report.exact_duplicates == 1 and report.near_duplicates == 1
+    assert report.removed == 2 and report.chunks_out == 2
+
+
+def test_deduplicate_keeps_distinct_chunks():
+    chunks = [_doc(f"第 {i} 節：" + TEXT[i * 5:] + f"（補充 {i}）", page=i) for i in range(5)]
+    kept, report = chunk_dedup.deduplicate(chunks, threshold=0.95)
+    assert len(kept) == 5 and report.removed == 0
+
+
+def test_deduplicate_rejects_uneven_bands():
+    with pytest.raises(ValueError):
+        chunk_dedup.deduplicate([_doc(TEXT)], num_perm=100, bands=16)
+
+
+def test_strip_repeated_lines():
+    topics = ["梯度下降", "過擬合", "正則化", "神經網路"]
+    pages = [_doc(f"機器學習導論\n{topic}\nPage {i + 1}", page=i) for i, topic in enumerate(topics)]
+    report = chunk_dedup.DedupReport()
+    chunk_dedup.strip_repeated_lines(pages, report)
+    assert [p.page_content for p in pages] == topics
+    assert report.boilerplate_lines_removed == 8
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+測試提示內容的 token 估算、截斷與重疊區塊去除（context_builder）
+用法：python -m pytest test_context_builder.py
+"""
+
+import context_builder
+
+
+def test_estimate_tokens():
+    assert context_builder.estimate_tokens("") == 0
+    assert context_builder.estimate_tokens("梯度下降") == 4
+    assert context_builder.estimate_tokens("abcdefgh") == 2
+    assert context_builder.estimate_tokens("梯度 abc") == 3
+
+
+def test_truncate_to_tokens_keeps_short_text():
+    assert context_builder.truncate_to_tokens("短句", 10) == "短句"
+    assert context_builder.truncate_to_tokens("任何文字", 0) == ""
+
+
+def test_truncate_to_tokens_finds_longest_prefix():
+    text = "梯度下降" * 50 + "gradientdescent" * 20
+    for budget in (1, 7, 100, 200, 240):
+        truncated = context_builder.truncate_to_tokens(text, budget)
+        assert truncated.endswith("…")
+        prefix = truncated[:-1]
+        assert text.startswith(prefix)
+        assert context_builder.estimate_tokens(prefix) <= budget
+        # 再多一個字元就會超出預算
+        assert context_builder.estimate_tokens(text[:len(prefix) + 1]) > budget
+
+
+def test_dedupe_chunks_removes_contained_and_overlapping_text():
+    shared = "x" * 40
+    chunks = ["第一段 " + shared, shared + " 第二段", "第一段", "  第一段   " + shared + "  "]
+    assert context_builder.dedupe_chunks(chunks) == ["第一段 " + shared, "第二段"]
+
+
+def test_dedupe_chunks_longer_chunk_replaces_contained_one():
+    assert context_builder.dedupe_chunks(["中間", "其他內容", "前面 中間 後面"]) == ["前面 中間 後面", "其他內容"]
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+測試外部資源標籤的解析（crud.parse_tags）
+用法：python -m pytest test_crud.py
+"""
+
+import crud
+
+
+def test_parse_tags_separators_and_normalization():
+    assert crud.parse_tags("Machine  Learning，深度學習、 NLP ;CV；") == ["machine learning", "深度學習", "nlp", "cv"]
+
+
+def test_parse_tags_deduplicates_in_order():
+    assert crud.parse_tags("python, Python ,PYTHON, numpy") == ["python", "numpy"]
+
+
+def test_parse_tags_empty():
+    assert crud.parse_tags(None) == []
+    assert crud.parse_tags(" , ，、") == []
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+測試常見問題分群（faq_mining.cluster）與分群問題的載入（faq_mining.load_questions）
+用法：python -m pytest test_faq_mining.py
+"""
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import faq_mining
+import models
+
+
+def _vectors(*rows):
+    return faq_mining._normalize_rows(np.asarray(rows, dtype=np.float32))
+
+
+def test_cluster_groups_similar_questions():
+    vectors = _vectors([1, 0, 0], [0.99, 0.1, 0], [0.98, 0, 0.1], [0, 1, 0], [0, 0.99, 0.1], [0, 0, 1])
+    labels, centroids = faq_mining.cluster(vectors, np.ones(6, dtype=np.float32), threshold=0.9)
+    assert labels[0] == labels[1] == labels[2]
+    assert labels[3] == labels[4] != labels[0]
+    assert labels[5] not in labels[:5]
+    assert centroids.shape == (3, 3)
+    assert np.allclose(np.linalg.norm(centroids, axis=1), 1)
+
+
+def test_cluster_center_follows_question_counts():
+    # 相鄰問題彼此相近、間隔兩個以上則否：提問次數決定誰先成為中心
+    vectors = _vectors(*[[np.cos(a), np.sin(a)] for a in (0.0, 0.3, 0.6, 0.9)])
+    threshold = np.cos(0.35)
+    labels, _ = faq_mining.cluster(vectors, np.ones(4, dtype=np.float32), threshold=threshold)
+    assert labels[0] == labels[1] == labels[2] != labels[3]
+    # 問題 3 最常被問：問題 2 成為中心並與問題 3 同群，問題 1 再改屬較近的問題 0
+    labels, _ = faq_mining.cluster(vectors, np.array([1, 1, 1, 10], dtype=np.float32), threshold=threshold)
+    assert labels[2] == labels[3] != labels[0] == labels[1]
+
+
+def test_cluster_reassigns_to_nearest_center():
+    # 問題 1 先成為中心並收入問題 3、4，兩者與問題 5 的群中心更接近，最後改屬該群
+    angles = [0.0, 0.1, -0.1, 0.35, 0.45, 0.5]
+    vectors = _vectors(*[[np.cos(a), np.sin(a)] for a in angles])
+    labels, centroids = faq_mining.cluster(vectors, np.ones(6, dtype=np.float32), threshold=np.cos(0.36))
+    assert labels[0] == labels[1] == labels[2]
+    assert labels[3] == labels[4] == labels[5] != labels[0]
+    assert len(centroids) == 2
+
+
+def test_cluster_blocks_match_single_block(monkeypatch):
+    rng = np.random.default_rng(0)
+    vectors = faq_mining._normalize_rows(rng.normal(size=(50, 8)).astype(np.float32))
+    weights = rng.integers(1, 5, size=50).astype(np.float32)
+    expected, _ = faq_mining.cluster(vectors, weights, threshold=0.5)
+    monkeypatch.setattr(faq_mining, "SIMILARITY_BLOCK_ROWS", 7)
+    labels, _ = faq_mining.cluster(vectors, weights, threshold=0.5)
+    assert (labels == expected).all()
+
+
+def test_load_questions_skips_tutor_turns_and_followups():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        db.add(models.User(id=1, email="s@example.com", name="s", role="user"))
+        for question in ["[ch1] 什麼是梯度？", "[ch1] 什麼是梯度", "[ch1] 為什麼？", "[ch2] 過擬合是什麼",
+                         crud.tutor_log_question("ch1", "什麼是梯度？"), crud.tutor_log_question("ch1", "再舉個例子"), "沒有章節"]:
+            db.add(models.RAGQueryLog(user_id=1, question=question, answer="回答"))
+        db.commit()
+        assert faq_mining.load_questions(db) == {"ch1": {"什麼是梯度": [2, "什麼是梯度？"]}, "ch2": {"過擬合是什麼": [1, "過擬合是什麼"]}}
+        assert list(faq_mining.load_questions(db, chapter="ch2")) == ["ch2"]
+        assert not any("[tutor]" in t["question"] for t in crud.get_most_queried_topics(db, limit=10))
+    engine.dispose()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+測試題目分析的統計計算（item_stats.describe / rebuild）與逐次累計的一致性
+用法：python -m pytest test_item_stats.py
+"""
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import item_stats
+import models
+
+TOPIC = "ch1 - 梯度"
+CHOICES = ["甲", "乙", "丙"]
+# (每位學生的答案, 分數)；兩題的正確答案都是索引 0
+SUBMISSIONS = [([0, 0], 100.0), ([0, 1], 50.0), ([1, 0], 50.0), ([2, 2], 0.0), ([0, 2], 50.0)]
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add(models.User(id=1, email="s@example.com", name="s", role="user"))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _create(db, num_questions):
+    attempt = models.QuizAttempt(user_id=1, topic=TOPIC)
+    for number in range(num_questions):
+        question = models.Question(question_text=f"Q{number}", correct_answer_index=0)
+        question.choices = [models.Choice(choice_text=text) for text in CHOICES]
+        attempt.questions.append(question)
+    db.add(attempt)
+    db.commit()
+    return attempt
+
+
+def _answer(db, attempt, answers, score):
+    """模擬 submit_quiz：記下評分前的作答與分數，評分後與作答在同一個交易中累計（重新提交時先扣除上次的作答）。"""
+    previous_answers = {q.id: q.user_answer_index for q in attempt.questions}
+    previous_score = attempt.score
+    for question, answer in zip(attempt.questions, answers):
+        if answer is not None:
+            question.user_answer_index = answer
+    attempt.score = score
+    item_stats.record_submission(db, attempt, previous_answers, previous_score)
+    db.commit()
+
+
+def _submit(db, answers, score):
+    attempt = _create(db, len(answers))
+    _answer(db, attempt, answers, score)
+    return attempt
+
+
+def _snapshot(db):
+    items = {row.question_text: item_stats._sums(row) for row in db.query(models.QuestionItemStat)}
+    choices = sorted((row.item_key, row.choice_index, row.count) for row in db.query(models.QuestionChoiceStat) if row.count)
+    topics = {row.topic: item_stats._sums(row) for row in db.query(models.TopicItemStat)}
+    return items, choices, topics
+
+
+def test_describe_matches_point_biserial():
+    correct = np.array([1, 1, 0, 0, 1], dtype=float)
+    score = np.array([100, 50, 50, 0, 50], dtype=float)
+    stats = item_stats.describe(len(score), correct.sum(), score.sum(), (score ** 2).sum(), (score * correct).sum())
+    assert stats["correct_rate"] == 0.6
+    assert stats["mean_score"] == 50.0
+    assert stats["discrimination"] == pytest.approx(np.corrcoef(correct, score)[0, 1], abs=1e-4)
+
+
+def test_describe_without_variation():
+    assert item_stats.describe(0, 0, 0, 0, 0) == {"correct_rate": None, "discrimination": None, "mean_score": None}
+    # 全部答對或總分沒有變異時無法計算鑑別度
+    assert item_stats.describe(3, 3, 150, 7500, 150)["discrimination"] is None
+    assert item_stats.describe(2, 1, 100, 5000, 50)["discrimination"] is None
+
+
+def test_flags():
+    assert item_stats._flags({"correct_rate": 0.95, "discrimination": 0.5}) == ["too_easy"]
+    assert item_stats._flags({"correct_rate": 0.1, "discrimination": -0.3}) == ["too_hard", "negative_discrimination"]
+    assert item_stats._flags({"correct_rate": 0.5, "discrimination": 0.1}) == ["low_discrimination"]
+
+
+def _assert_matches_rebuild(db):
+    incremental = _snapshot(db)
+    summary = item_stats.rebuild(db)
+    rebuilt = _snapshot(db)
+    assert rebuilt[0].keys() == incremental[0].keys()
+    for name in incremental[0]:
+        assert rebuilt[0][name] == pytest.approx(incremental[0][name])
+    assert rebuilt[1] == incremental[1]
+    assert rebuilt[2].keys() == incremental[2].keys()
+    for topic in incremental[2]:
+        assert rebuilt[2][topic] == pytest.approx(incremental[2][topic])
+    return summary
+
+
+def test_rebuild_matches_incremental_updates(db):
+    for answers, score in SUBMISSIONS:
+        _submit(db, answers, score)
+    summary = _assert_matches_rebuild(db)
+    assert summary["responses"] == 10 and summary["items"] == 2 and summary["topics"] == 1
+
+
+def test_resubmission_matches_rebuild(db):
+    attempts = [_submit(db, answers, score) for answers, score in SUBMISSIONS]
+    # 改答案與分數重新提交：扣除上次的作答（以上次的分數）再加上新的作答
+    _answer(db, attempts[0], [1, 2], 0.0)
+    _answer(db, attempts[3], [0, 0], 100.0)
+    _answer(db, attempts[3], [0, 1], 50.0)
+    # 只改一題：另一題的答案不變，但分數改變，仍須以新分數重新累計
+    _answer(db, attempts[1], [None, 0], 100.0)
+    # 先建立、之後才第一次作答的測驗（只答一題）
+    _answer(db, _create(db, 2), [2, None], 0.0)
+
+    summary = _assert_matches_rebuild(db)
+    assert summary["responses"] == 11
+    items = {item["question_text"]: item for item in item_stats.get_item_stats(db)}
+    assert items["Q0"]["choice_counts"] == [3, 2, 1]
+    assert items["Q1"]["choice_counts"] == [2, 1, 2]
+
+
+def test_item_stats_report(db):
+    for answers, score in SUBMISSIONS:
+        _submit(db, answers, score)
+    items = {item["question_text"]: item for item in item_stats.get_item_stats(db, chapter="ch1")}
+    assert items["Q0"]["correct_rate"] == 0.6
+    assert items["Q0"]["choice_counts"] == [3, 1, 1]
+    assert items["Q1"]["choice_counts"] == [2, 1, 2]
+    [topic] = item_stats.get_topic_stats(db)
+    assert topic["topic"] == TOPIC and topic["items"] == 2 and topic["responses"] == 10
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+測試提問紀錄全文檢索（query_search）：查詢轉換、中文分詞與章節篩選
+用法：python -m pytest test_query_search.py
+"""
+
+import sqlite3
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+import models
+import query_search
+
+
+@pytest.fixture
+def db():
+    """記憶體中的資料庫，建立資料表與全文檢索索引。"""
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    assert query_search.ensure_index(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(models.User(id=1, email="s@example.com", name="s", role="user"))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _log(db, question, answer="回答"):
+    db.add(models.RAGQueryLog(user_id=1, question=question, answer=answer))
+    db.commit()
+
+
+def test_build_match_quotes_terms():
+    assert query_search.build_match("gradient descent") == '{question answer} : ("gradient" AND "descent")'
+    # 使用者輸入的 FTS 語法字元只當成文字
+    assert query_search.build_match('a"b OR') == '{question answer} : ("a""b" AND "OR")'
+
+
+def test_build_match_phrase_prefix_and_exclude():
+    match = query_search.build_match('"learning rate" grad* -adam', field="question")
+    assert match == '{question} : ("learning rate" AND "grad" * NOT "adam")'
+
+
+def test_build_match_segments_cjk():
+    assert query_search.build_match("梯度") == '{question answer} : ("梯\u200b度\u200b")'
+
+
+def test_build_match_requires_include_term():
+    with pytest.raises(HTTPException) as e:
+        query_search.build_match("-adam")
+    assert e.value.status_code == 400
+
+
+def test_build_match_does_not_segment_chapter():
+    match = query_search.build_match("梯度", chapter="第一章")
+    assert match.startswith('chapter : "第一章" AND ')
+
+
+def test_index_row_splits_chapter():
+    row = query_search.index_row(7, "[第一章] 什麼是梯度？", "梯度是斜率")
+    assert row["chapter"] == "第一章"
+    assert row["question"].replace("\u200b", "") == "什麼是梯度？"
+    assert query_search.index_row(8, "沒有章節", "a")["chapter"] is None
+
+
+def test_search_cjk_term_and_chapter(db):
+    _log(db, "[第一章] 什麼是梯度下降？")
+    _log(db, "[第二章] 梯度消失的原因")
+    _log(db, "[ch1] what is gradient descent")
+
+    result = query_search.search(db, "梯度", chapter="第一章")
+    assert [item["chapter"] for item in result["items"]] == ["第一章"]
+    assert "<mark>梯度</mark>" in result["items"][0]["question"]
+    assert len(query_search.search(db, "梯度")["items"]) == 2
+    assert len(query_search.search(db, "gradient", chapter="ch1")["items"]) == 1
+
+
+def test_index_follows_update_and_delete(db):
+    _log(db, "[ch1] overfitting")
+    log = db.query(models.RAGQueryLog).one()
+    log.question = "[ch1] underfitting"
+    db.commit()
+    assert query_search.search(db, "overfitting")["items"] == []
+    assert len(query_search.search(db, "underfitting")["items"]) == 1
+    db.delete(log)
+    db.commit()
+    assert query_search.search(db, "underfitting")["items"] == []
+
+
+def test_plain_sqlite_writers_need_no_custom_function(tmp_path):
+    """資料庫中沒有自訂函式，sqlite3 等其他工具仍可直接寫入提問紀錄。"""
+    path = tmp_path / "logs.db"
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    assert query_search.ensure_index(engine)
+    engine.dispose()
+    with sqlite3.connect(path) as conn:
+        conn.execute("INSERT INTO rag_query_logs (user_id, question, answer) VALUES (1, '[ch1] q', 'a')")
+        conn.execute("DELETE FROM rag_query_logs")
+    engine = create_engine(f"sqlite:///{path}")
+    assert query_search.rebuild_index(engine) == 0
+    with engine.connect() as conn:
+        assert conn.execute(text(f"SELECT count(*) FROM {query_search.FTS_TABLE}")).scalar() == 0
+    engine.dispose()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+測試測驗輸出的 JSON 擷取與逐題驗證（quiz_output.extract_json / parse_quiz）
+用法：python -m pytest test_quiz_output.py
+"""
+
+import json
+
+import pytest
+
+import quiz_output
+
+
+def _question(text, choices=("A 選項", "B 選項", "C 選項"), answer=0):
+    return {"question_text": text, "choices": list(choices), "correct_answer_index": answer}
+
+
+def test_extract_json_from_fence_and_prose():
+    assert quiz_output.extract_json('說明文字\n```json\n{"a": 1}\n```\n結尾') == {"a": 1}
+    assert quiz_output.extract_json('以下是測驗：[1, 2] 完成') == [1, 2]
+
+
+def test_extract_json_tolerates_trailing_commas():
+    assert quiz_output.extract_json('{"questions": [{"x": 1,},],}') == {"questions": [{"x": 1}]}
+
+
+def test_extract_json_without_json_raises():
+    with pytest.raises(ValueError):
+        quiz_output.extract_json("沒有任何 JSON")
+    with pytest.raises(ValueError):
+        quiz_output.extract_json(None)
+
+
+def test_parse_quiz_normalizes_aliases_and_answers():
+    text = json.dumps({"questions": [
+        {"question": "Q1", "options": ["甲", "乙", "丙"], "answer": "B"},
+        {"stem": "Q2", "choices": ["甲", "乙"], "correct_answer": "乙"},
+        {"question_text": "Q3", "choices": ["甲", "乙"], "correct_answer_index": "1"},
+    ]}, ensure_ascii=False)
+    result = quiz_output.parse_quiz(text, 3)
+    assert result.problems == []
+    assert [q["correct_answer_index"] for q in result.questions] == [1, 1, 1]
+    assert [q["question_text"] for q in result.questions] == ["Q1", "Q2", "Q3"]
+
+
+def test_parse_quiz_reports_invalid_questions():
+    text = json.dumps([
+        _question("好題目"),
+        _question("答案超出範圍", answer=5),
+        _question("選項重複", choices=("一樣", "一樣")),
+        _question("  "),
+        _question("好題目"),
+    ], ensure_ascii=False)
+    result = quiz_output.parse_quiz(text, 5)
+    assert [q["question_text"] for q in result.questions] == ["好題目"]
+    assert len(result.problems) == 4
+    assert result.missing(5) == 4
+
+
+def test_parse_quiz_not_json_or_missing_questions():
+    assert quiz_output.parse_quiz("抱歉，我無法產生", 3).problems[0].startswith("輸出不是有效的 JSON")
+    assert quiz_output.parse_quiz('{"items": []}', 3).problems == ["缺少 questions 陣列"]
+
+
+def test_parse_quiz_appends_to_existing_and_stops_at_limit():
+    first = quiz_output.parse_quiz(json.dumps([_question("Q1")]), 2)
+    text = json.dumps([_question("Q1"), _question("Q2"), _question("Q3")])
+    result = quiz_output.parse_quiz(text, 2, existing=first)
+    assert [q["question_text"] for q in result.questions] == ["Q1", "Q2"]
+    assert result.problems == ["第 1 題與其他題目重複"]
+    assert first.questions == [_question("Q1")]
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+測試請求合併、限流與斷路器（singleflight.SingleFlight、rate_limit.TokenBucket、llm_client.CircuitBreaker）
+用法：python -m pytest test_resilience.py
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+import llm_client
+import rate_limit
+import singleflight
+
+
+def test_normalize_text():
+    assert singleflight.normalize_text("  什麼是  梯度？ ") == "什麼是 梯度"
+    assert singleflight.normalize_text("ＧＲＡＤＩＥＮＴ!!") == "gradient"
+
+
+def test_singleflight_coalesces_concurrent_calls():
+    flight = singleflight.SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        release.wait(5)
+        return value * 2
+
+    async def run():
+        first = asyncio.ensure_future(flight.do("k", compute, 21))
+        await asyncio.sleep(0.05)
+        others = [asyncio.ensure_future(flight.do("k", compute, 99)) for _ in range(3)]
+        other_key = asyncio.ensure_future(flight.do("other", compute, 1))
+        await asyncio.sleep(0.05)
+        assert flight.inflight_count() == 2
+        release.set()
+        return await first, await asyncio.gather(*others), await other_key
+
+    first, others, other_key = asyncio.run(run())
+    assert first == (42, False)
+    assert others == [(42, True)] * 3
+    assert other_key == (2, False)
+    assert sorted(calls) == [1, 21]
+    assert flight.inflight_count() == 0
+
+
+def test_singleflight_shares_errors_then_retries():
+    flight = singleflight.SingleFlight("test")
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("失敗")
+        return "ok"
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await flight.do("k", flaky)
+        return await flight.do("k", flaky)
+
+    assert asyncio.run(run()) == ("ok", False)
+    assert len(attempts) == 2
+
+
+def test_token_bucket():
+    bucket = rate_limit.TokenBucket(capacity=2, refill_rate=0.5)
+    now = bucket.updated
+    assert bucket.try_acquire(now) == 0
+    assert bucket.try_acquire(now) == 0
+    assert bucket.try_acquire(now) == pytest.approx(2.0)
+    assert bucket.try_acquire(now + 1) == pytest.approx(1.0)
+    assert bucket.try_acquire(now + 2) == 0
+    # 閒置再久也只補滿到容量上限
+    assert [bucket.try_acquire(now + 100) for _ in range(3)][-1] > 0
+
+
+def test_rate_limiter_separates_users_and_roles():
+    limiter = rate_limit.RateLimiter({"user": (60, 1), "admin": (60, 3)})
+    assert limiter.check(1, "user") == 0
+    assert limiter.check(1, "user") > 0
+    assert limiter.check(2, "user") == 0
+    assert [limiter.check(1, "admin") for _ in range(3)] == [0, 0, 0]
+    assert limiter.check(3, "unknown") == 0 and limiter.check(3, "unknown") > 0
+
+
+def test_circuit_breaker_opens_and_probes(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_client.time, "monotonic", lambda: now[0])
+    breaker = llm_client.CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.state == breaker.CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN and not breaker.allow()
+
+    now[0] += 30
+    assert breaker.allow() and breaker.state == breaker.HALF_OPEN
+    assert not breaker.allow()  # 半開時只放行一個試探呼叫
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN and not breaker.allow()
+
+    now[0] += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED and breaker.allow()
+
+
+def test_call_with_resilience_retries_and_short_circuits(monkeypatch):
+    monkeypatch.setattr(llm_client.time, "sleep", lambda seconds: None)
+    breaker = llm_client.CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("暫時失敗")
+        return "ok"
+
+    assert llm_client.call_with_resilience("test", flaky, breaker=breaker, timeout=5, retries=2) == "ok"
+    assert len(attempts) == 3 and breaker.state == breaker.CLOSED
+
+    def down():
+        raise ConnectionError("服務中斷")
+
+    with pytest.raises(ConnectionError):
+        llm_client.call_with_resilience("test", down, breaker=breaker, timeout=5, retries=2)
+    assert breaker.state == breaker.OPEN
+    with pytest.raises(llm_client.CircuitOpenError):
+        llm_client.call_with_resilience("test", flaky, breaker=breaker, timeout=5, retries=2)
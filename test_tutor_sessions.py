@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+測試家教對話沿用上次檢索結果的判斷（tutor_sessions.session_context）
+用法：python -m pytest test_tutor_sessions.py
+"""
+
+import pytest
+
+import models
+import tutor_sessions
+import vector_index
+
+
+class FakeEmbeddings:
+    """依問題中的關鍵詞產生向量，並記錄嵌入呼叫次數。"""
+
+    TOPICS = ("梯度", "過擬合")
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [1.0 if topic in text else 0.0 for topic in self.TOPICS] + [0.1]
+
+
+@pytest.fixture
+def retrieval(monkeypatch):
+    """以假的檢索取代向量資料庫：回傳的區塊 id 依問題主題而定，並記錄檢索次數。"""
+    calls = []
+
+    def search(vector_store, vector, query, k):
+        calls.append(query)
+        topic = "過擬合" if "過擬合" in query else "梯度"
+        return [(f"{topic} 的課程內容", 0.9, f"chroma:{topic}")]
+
+    def get_chunks(vector_store, refs):
+        return [(f"{ref['id'].split(':')[1]} 的課程內容", ref["score"]) for ref in refs]
+
+    monkeypatch.setattr(vector_index, "similarity_search_by_vector", search)
+    monkeypatch.setattr(vector_index, "get_chunks", get_chunks)
+    return calls
+
+
+def _session_after(question, embeddings):
+    session = models.TutorSession(chapter="ch1", summary="", summarized_turns=0)
+    tutor_sessions.session_context(session, question, None, embeddings, k=3)
+    return session
+
+
+def test_is_followup():
+    assert tutor_sessions.is_followup("再舉個例子")
+    assert tutor_sessions.is_followup("可以再解釋一下嗎？")
+    assert tutor_sessions.is_followup("Why?")
+    assert not tutor_sessions.is_followup("什麼是過擬合？")
+    assert not tutor_sessions.is_followup("梯度下降呢？")
+
+
+def test_short_new_topic_cjk_question_retrieves(retrieval):
+    embeddings = FakeEmbeddings()
+    session = _session_after("梯度下降是什麼？", embeddings)
+
+    docs, reused = tutor_sessions.session_context(session, "什麼是過擬合？", None, embeddings, k=3)
+    assert not reused
+    assert docs == [("過擬合 的課程內容", 0.9)]
+    assert embeddings.calls == 2
+    assert len(retrieval) == 2
+
+
+def test_followup_phrase_reuses_without_embedding(retrieval):
+    embeddings = FakeEmbeddings()
+    session = _session_after("梯度下降是什麼？", embeddings)
+
+    docs, reused = tutor_sessions.session_context(session, "可以再舉個例子嗎？", None, embeddings, k=3)
+    assert reused
+    assert docs == [("梯度 的課程內容", 0.9)]
+    assert embeddings.calls == 1
+    assert len(retrieval) == 1
+
+
+def test_similar_question_reuses_after_embedding(retrieval):
+    embeddings = FakeEmbeddings()
+    session = _session_after("梯度下降是什麼？", embeddings)
+
+    docs, reused = tutor_sessions.session_context(session, "梯度下降的學習率要怎麼選？", None, embeddings, k=3)
+    assert reused
+    assert embeddings.calls == 2
+    assert len(retrieval) == 1
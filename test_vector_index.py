@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+測試 NumPy 章節索引的量化與精確 top-k（vector_index.quantize / write_index / NumpyChapterIndex.search）
+用法：python -m pytest test_vector_index.py
+"""
+
+import numpy as np
+import pytest
+
+import vector_index
+
+
+@pytest.fixture
+def matrix():
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(200, 16)).astype(np.float32)
+    data[5] = 0  # 全零向量不應產生除以零
+    return data
+
+
+def test_quantize_float32_is_exact(matrix):
+    stored, scales, sq_norms = vector_index.quantize(matrix, "float32")
+    assert stored.dtype == np.float32 and scales is None
+    assert np.allclose(sq_norms, (matrix ** 2).sum(axis=1))
+
+
+@pytest.mark.parametrize("dtype, tolerance", [("float16", 1e-3), ("int8", 1e-2)])
+def test_quantize_round_trip(matrix, dtype, tolerance):
+    stored, scales, sq_norms = vector_index.quantize(matrix, dtype)
+    assert stored.dtype == np.dtype(dtype) and stored.flags.c_contiguous
+    restored = stored.astype(np.float32) * (scales[:, None] if scales is not None else 1)
+    assert np.abs(restored - matrix).max() <= tolerance * np.abs(matrix).max()
+    assert np.allclose(sq_norms, (restored ** 2).sum(axis=1), rtol=1e-5)
+    if dtype == "int8":
+        assert np.abs(stored).max() == 127 and scales[5] == 1.0
+
+
+def test_quantize_rejects_unknown_dtype(matrix):
+    with pytest.raises(ValueError):
+        vector_index.quantize(matrix, "int4")
+
+
+@pytest.mark.parametrize("dtype", vector_index.DTYPES)
+def test_search_matches_brute_force(tmp_path, matrix, dtype, monkeypatch):
+    monkeypatch.setattr(vector_index, "VECTOR_INDEX_BLOCK_ROWS", 64)
+    documents = [{"page_content": f"區塊 {i}", "metadata": {"i": i}} for i in range(len(matrix))]
+    manifest = vector_index.write_index("ch1", matrix, documents, index_root=str(tmp_path), dtype=dtype)
+    index = vector_index.NumpyChapterIndex.load("ch1", index_root=str(tmp_path))
+    assert index.version == manifest["version"] and len(index) == len(matrix)
+
+    query = matrix[17] + 0.01
+    expected = np.argsort(((matrix - query) ** 2).sum(axis=1))[:5]
+    result = index.search(query, 5)
+    assert [i for i, _ in result][0] == 17
+    assert len(set(i for i, _ in result) & set(expected.tolist())) >= 4
+    assert [d for _, d in result] == sorted(d for _, d in result)
+    assert index.document(17) == {"page_content": "區塊 17", "metadata": {"i": 17}}
+    assert index.search(query, 0) == []
+    assert len(index.search(query, 1000)) == len(matrix)
@@ -0,0 +1,238 @@
+# 檔案：tutor_sessions.py
+# 說明：多輪家教對話。每個使用者可在章節內建立對話，追問時帶入先前的對話，但提示大小有上限：
+#       最近 TUTOR_RECENT_TURNS 回合逐字放入提示（每回合截斷到 TUTOR_TURN_TOKENS），
+#       更早的回合在回應送出後於背景逐批併入摘要（只送出「舊摘要 + 新回合」，不重送整段對話）。
+#       追問與上一次檢索的主題相同時（問題向量的 cosine 相似度達門檻，或是「再舉個例子」這類追問語句），
+#       直接以記錄的區塊 id 取回上次的課程內容，不再做向量檢索；追問語句連嵌入呼叫也省下。
+#       只看長度不可靠（中文一字約一 token，「什麼是過擬合？」也很短），其他問題一律以向量相似度判斷。
+
+import json
+import math
+import os
+import re
+from array import array
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+import crud, models
+from database import SessionLocal
+from metrics import metrics
+from request_profiling import stage
+
+# 逐字放入提示的最近回合數
+TUTOR_RECENT_TURNS = int(os.environ.get("TUTOR_RECENT_TURNS", "3"))
+# 最近回合之外累積到幾回合才做一次摘要（避免每回合都多一次 LLM 呼叫）
+TUTOR_SUMMARY_BATCH = int(os.environ.get("TUTOR_SUMMARY_BATCH", "2"))
+TUTOR_SUMMARY_TOKENS = int(os.environ.get("TUTOR_SUMMARY_TOKENS", "300"))
+TUTOR_TURN_TOKENS = int(os.environ.get("TUTOR_TURN_TOKENS", "250"))
+# 追問與上次檢索問題的 cosine 相似度達此值時沿用上次的課程內容
+TUTOR_REUSE_THRESHOLD = float(os.environ.get("TUTOR_REUSE_THRESHOLD", "0.8"))
+# 追問語句（「再舉個例子」、「為什麼？」）的 token 上限；只有整句都是追問語句時才不檢索也不嵌入
+TUTOR_FOLLOWUP_TOKENS = int(os.environ.get("TUTOR_FOLLOWUP_TOKENS", "12"))
+TITLE_MAX_CHARS = 60
+
+PATH_TUTOR = "tutor"
+
+# 追問語句：去掉標點、空白與客套詞後，剩下的部分必須是空的或整個是以下其中之一（沒有新的主題詞）
+_FOLLOWUP_FILLER = re.compile(r"[\W_]+|請|麻煩|可以|能不能|能否|可不可以|再|多|一下|一點|一些|嗎|呢|吧|那|please|can you|could you|again|more|another", re.IGNORECASE)
+_FOLLOWUP_PHRASES = {
+    "舉例", "舉個例子", "舉一個例子", "舉例子", "給個例子", "給我一個例子", "例子", "例如",
+    "為什麼", "為何", "怎麼說", "什麼意思", "這是什麼意思", "解釋", "說明", "詳細", "詳細說明", "說",
+    "繼續", "然後", "還有", "不懂", "我不懂", "還是不懂",
+    "example", "anexample", "giveanexample", "giveexample", "why", "explain", "explainthat", "elaborate",
+    "continue", "goon", "whatdoyoumean", "idontunderstand",
+}
+
+TUTOR_PROMPT = """你是 '{chapter}' 章節的虛擬助教，正在與學生進行多輪的家教對話。
+請根據課程內容與先前的對話，用繁體中文清楚回答學生的新問題；若課程內容不足以回答，請直接說明需要查閱哪些額外資料。
+
+課程內容：
+---
+{context}
+---
+
+{history}學生的新問題：{question}
+
+回答："""
+
+SUMMARY_PROMPT = """以下是學生與 '{chapter}' 章節虛擬助教的家教對話。請更新對話摘要，用繁體中文、不超過 {tokens} 個 token，
+保留學生問過的概念、助教給過的重點與例子，以及學生仍有疑問的地方，供之後的回答參考。
+
+目前的摘要：
+{summary}
+
+新的對話：
+{turns}
+
+更新後的摘要："""
+
+
+# --- 對話的建立與查詢 ---
+def create_session(db: Session, user_id: int, chapter: str) -> models.TutorSession:
+    session = models.TutorSession(user_id=user_id, chapter=chapter, title="", summary="", summarized_turns=0)
+    db.add(session)
+    db.commit()
+    db.refresh(session)
+    return session
+
+
+def get_session(db: Session, session_id: int, user_id: int) -> models.TutorSession:
+    session = db.get(models.TutorSession, session_id)
+    if session is None or session.user_id != user_id:
+        raise HTTPException(status_code=404, detail="找不到指定的對話或權限不足。")
+    return session
+
+
+def list_sessions(db: Session, user_id: int, chapter: Optional[str] = None) -> List[models.TutorSession]:
+    query = db.query(models.TutorSession).filter(models.TutorSession.user_id == user_id)
+    if chapter:
+        query = query.filter(models.TutorSession.chapter == chapter)
+    return query.order_by(models.TutorSession.updated_at.desc(), models.TutorSession.id.desc()).all()
+
+
+def delete_session(db: Session, session_id: int, user_id: int):
+    db.delete(get_session(db, session_id, user_id))
+    db.commit()
+
+
+# --- 提示中的對話內容 ---
+def _format_turns(turns, max_tokens: int) -> str:
+    from context_builder import truncate_to_tokens
+    return "\n".join(
+        f"學生：{truncate_to_tokens(t.question, max_tokens)}\n助教：{truncate_to_tokens(t.answer, max_tokens)}" for t in turns
+    )
+
+
+def recent_turns(session: models.TutorSession) -> list:
+    """尚未併入摘要的回合中最近的幾回合（摘要落後時也不會超過 TUTOR_RECENT_TURNS + TUTOR_SUMMARY_BATCH 回合）。"""
+    pending = session.turns[session.summarized_turns:]
+    return pending[-(TUTOR_RECENT_TURNS + TUTOR_SUMMARY_BATCH):]
+
+
+def format_history(session: models.TutorSession) -> str:
+    parts = []
+    if session.summary:
+        parts.append(f"先前對話摘要：\n{session.summary}\n")
+    turns = recent_turns(session)
+    if turns:
+        parts.append(f"最近的對話：\n{_format_turns(turns, TUTOR_TURN_TOKENS)}\n")
+    return "\n".join(parts) + ("\n" if parts else "")
+
+
+def is_followup(question: str) -> bool:
+    """整句只是追問語句（沒有可單獨檢索的主題詞），例如「可以再舉個例子嗎？」、「為什麼？」。"""
+    from context_builder import estimate_tokens
+
+    if estimate_tokens(question) > TUTOR_FOLLOWUP_TOKENS:
+        return False
+    core = _FOLLOWUP_FILLER.sub("", question).lower()
+    return not core or core in _FOLLOWUP_PHRASES  # 只剩客套詞時（「more?」、「再一次？」）也是追問
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def session_context(session: models.TutorSession, question: str, vector_store, embeddings, k: int) -> Tuple[list, bool]:
+    """
+    回傳本回合的 ([(Document, 相關度)], 是否沿用上次的檢索結果)。
+    重新檢索時會更新 session 記錄的區塊 id 與問題向量（由呼叫端 commit）。
+    """
+    import vector_index
+
+    refs = json.loads(session.context_chunks) if session.context_chunks else []
+    if refs and is_followup(question):
+        docs = vector_index.get_chunks(vector_store, refs)
+        if docs:
+            return docs, True
+    vector = embeddings.embed_query(question)
+    if refs and session.context_embedding:
+        previous = array("f")
+        previous.frombytes(session.context_embedding)
+        if len(previous) == len(vector) and _cosine(vector, previous) >= TUTOR_REUSE_THRESHOLD:
+            docs = vector_index.get_chunks(vector_store, refs)
+            if docs:
+                return docs, True
+    hits = vector_index.similarity_search_by_vector(vector_store, vector, question, k)
+    session.context_chunks = json.dumps([{"id": id_, "score": round(float(score), 6)} for _, score, id_ in hits])
+    session.context_embedding = array("f", vector).tobytes()
+    return [(doc, score) for doc, score, _ in hits], False
+
+
+# --- 回答與摘要 ---
+def answer(rag_service, db: Session, session_id: int, user_id: int, question: str, vector_store) -> dict:
+    """回答對話中的新問題並記錄回合（在執行緒中呼叫）。"""
+    import ai_runtime, qa_router
+    from context_builder import PromptTokenLogger, RAG_RETRIEVAL_K, build_context
+    from llm_client import LLMUnavailableError
+
+    session = get_session(db, session_id, user_id)
+    token_logger = PromptTokenLogger(f"tutor[{session.chapter}]")
+    with stage("tutor.context"):
+        scored_docs, reused = session_context(session, question, vector_store, ai_runtime.embeddings, RAG_RETRIEVAL_K)
+    history = format_history(session)
+    try:
+        if qa_router.is_confident(scored_docs):
+            path = PATH_TUTOR
+            prompt = TUTOR_PROMPT.format(chapter=session.chapter, context=build_context(scored_docs), history=history, question=question)
+            reply = ai_runtime.llm.invoke(prompt, config={"callbacks": [token_logger]}).content
+        else:
+            # 課程內容不足時交給 Agent，問題前附上有上限的對話內容
+            path = qa_router.PATH_AGENT
+            reply = rag_service.run_agent(session.chapter, f"{history}學生的新問題：{question}", vector_store, callbacks=[token_logger])
+    except LLMUnavailableError as e:
+        metrics.incr("tutor.unavailable")
+        raise rag_service.service_unavailable(e)
+
+    turn = models.TutorTurn(question=question, answer=reply, path=path, reused_context=int(reused), prompt_tokens=token_logger.total_tokens)
+    session.turns.append(turn)
+    if not session.title:
+        session.title = question[:TITLE_MAX_CHARS]
+    db.commit()
+    crud.log_rag_query(db, user_id=user_id, question=crud.tutor_log_question(session.chapter, question), answer=reply)
+
+    metrics.incr(f"tutor.path.{path}")
+    metrics.incr("tutor.context.reused" if reused else "tutor.context.retrieved")
+    metrics.incr("tutor.prompt_tokens", token_logger.total_tokens)
+    return {"session_id": session.id, "turn_id": turn.id, "answer": reply, "path": path,
+            "reused_context": reused, "prompt_tokens": token_logger.total_tokens}
+
+
+def needs_summary(session: models.TutorSession) -> bool:
+    return len(session.turns) - session.summarized_turns >= TUTOR_RECENT_TURNS + TUTOR_SUMMARY_BATCH
+
+
+def summarize(rag_service, session_id: int):
+    """
+    將超出最近回合數的舊回合併入摘要（回應送出後於背景執行）。
+    以 summarized_turns 做條件更新，同一對話的兩個背景工作不會重複併入相同回合。
+    """
+    from context_builder import truncate_to_tokens
+
+    with SessionLocal() as db:
+        session = db.get(models.TutorSession, session_id)
+        if session is None or not needs_summary(session):
+            return
+        start = session.summarized_turns
+        stop = len(session.turns) - TUTOR_RECENT_TURNS
+        prompt = SUMMARY_PROMPT.format(chapter=session.chapter, tokens=TUTOR_SUMMARY_TOKENS, summary=session.summary or "（無）",
+                                       turns=_format_turns(session.turns[start:stop], TUTOR_TURN_TOKENS * 2))
+        try:
+            summary = rag_service.invoke_llm(prompt, label=f"tutor-summary[{session.chapter}]").content
+        except Exception as e:
+            # 摘要失敗時下一回合再試；期間提示仍有上限（見 recent_turns）
+            metrics.incr("tutor.summary.errors")
+            print(f"[tutor] 對話 {session_id} 摘要失敗：{e}")
+            return
+        updated = (
+            db.query(models.TutorSession)
+            .filter(models.TutorSession.id == session_id, models.TutorSession.summarized_turns == start)
+            .update({"summary": truncate_to_tokens(summary.strip(), TUTOR_SUMMARY_TOKENS), "summarized_turns": stop},
+                    synchronize_session=False)
+        )
+        db.commit()
+        metrics.incr("tutor.summary.updated" if updated else "tutor.summary.skipped")
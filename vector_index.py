@@ -0,0 +1,417 @@
+# 檔案：vector_index.py
+# 說明：以 NumPy 檔案儲存的唯讀章節向量索引，供多 worker 部署共用。
+#       索引由 chroma_db/<章節> 匯出，以 memory-map 方式開啟：gunicorn master 預先載入後 fork，
+#       所有 worker 共用同一份分頁快取，不會因 worker 數量倍增記憶體。
+#       匯出時寫入新版本資料夾並原子地更新 CURRENT，各 worker 定期檢查後自動切換（熱重載）。
+#       小章節可直接以此索引取代 Chroma（精確 top-k，可選 float16 / int8 量化）。
+#       用法：python vector_index.py export [章節 ...] [--dtype float32|float16|int8]
+
+import json
+import os
+import shutil
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import metrics
+
+CHROMA_ROOT = "chroma_db"
+VECTOR_INDEX_ROOT = os.environ.get("VECTOR_INDEX_ROOT", "vector_index")
+# 檢索後端：chroma（每個行程各自開啟 Chroma）、numpy（共用的 memory-mapped 索引），
+# 或 auto（已匯出且向量數不超過 VECTOR_INDEX_AUTO_MAX_VECTORS 的章節用 numpy，其餘用 Chroma）
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "auto")
+# auto 模式的門檻，依 bench_vector_index.py 的量測結果設定
+VECTOR_INDEX_AUTO_MAX_VECTORS = int(os.environ.get("VECTOR_INDEX_AUTO_MAX_VECTORS", "10000"))
+# 匯出時的向量精度：float32、float16（記憶體減半）或 int8（每個向量各自的縮放係數，記憶體約 1/4）
+VECTOR_INDEX_DTYPE = os.environ.get("VECTOR_INDEX_DTYPE", "float32")
+# 量化索引查詢時每次轉回 float32 的列數，限制暫存記憶體
+VECTOR_INDEX_BLOCK_ROWS = int(os.environ.get("VECTOR_INDEX_BLOCK_ROWS", "8192"))
+# 各 worker 檢查章節索引是否有新版本的間隔（秒）
+VECTOR_INDEX_RELOAD_CHECK = float(os.environ.get("VECTOR_INDEX_RELOAD_CHECK", "5"))
+# 匯出時保留的舊版本數量（仍在使用舊版本的 worker 可繼續讀取）
+VECTOR_INDEX_KEEP_VERSIONS = int(os.environ.get("VECTOR_INDEX_KEEP_VERSIONS", "2"))
+
+# langchain Chroma 預設的集合名稱
+CHROMA_COLLECTION = "langchain"
+CURRENT_FILE = "CURRENT"
+DTYPES = ("float32", "float16", "int8")
+
+
+def _chapter_dir(chapter: str, index_root: str) -> str:
+    # 章節名稱來自請求參數，不允許跳出索引根目錄
+    if not chapter or os.path.basename(chapter) != chapter or chapter.startswith("."):
+        raise ValueError(f"不合法的章節名稱: {chapter!r}")
+    return os.path.join(index_root, chapter)
+
+
+def read_current_version(chapter: str, index_root: str = VECTOR_INDEX_ROOT) -> Optional[str]:
+    try:
+        with open(os.path.join(_chapter_dir(chapter, index_root), CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except (OSError, ValueError):
+        return None
+
+
+class NumpyChapterIndex:
+    """
+    單一章節的唯讀索引：
+      embeddings.npy  (N, D) 向量，float32 / float16 / int8
+      scales.npy      (N,)   int8 量化時各向量的縮放係數（原向量 ≈ scale * int8 向量）
+      sq_norms.npy    (N,)   各向量（量化後還原值）的平方長度
+      documents.jsonl 每行一個 {"page_content", "metadata"}，offsets.npy 記錄各行的位元組位置
+    全部以 memory-map 開啟，查詢時只解碼命中的文件。
+    """
+
+    def __init__(self, chapter: str, version: str, directory: str):
+        self.chapter = chapter
+        self.version = version
+        self.directory = directory
+        self.embeddings = np.load(os.path.join(directory, "embeddings.npy"), mmap_mode="r")
+        self.sq_norms = np.load(os.path.join(directory, "sq_norms.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        self.documents = np.memmap(os.path.join(directory, "documents.jsonl"), dtype=np.uint8, mode="r")
+        with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.dtype = self.manifest.get("dtype", "float32")
+        self.scales = np.load(os.path.join(directory, "scales.npy"), mmap_mode="r") if self.dtype == "int8" else None
+
+    @classmethod
+    def load(cls, chapter: str, index_root: str = VECTOR_INDEX_ROOT) -> Optional["NumpyChapterIndex"]:
+        version = read_current_version(chapter, index_root)
+        if version is None:
+            return None
+        return cls(chapter, version, os.path.join(_chapter_dir(chapter, index_root), version))
+
+    def __len__(self) -> int:
+        return self.embeddings.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self._arrays())
+
+    def _arrays(self):
+        arrays = [self.embeddings, self.sq_norms, self.offsets, self.documents]
+        return arrays + [self.scales] if self.scales is not None else arrays
+
+    def touch(self):
+        """預先讀取所有分頁，讓 fork 後的 worker 直接命中分頁快取。"""
+        for array in self._arrays():
+            np.asarray(array).sum()
+
+    def document(self, i: int) -> dict:
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return json.loads(self.documents[start:end].tobytes().decode("utf-8"))
+
+    def dot(self, q: np.ndarray) -> np.ndarray:
+        """所有向量與 q 的內積。float32 直接做一次矩陣-向量乘法；量化索引分塊轉回 float32 再乘。"""
+        if self.dtype == "float32":
+            return self.embeddings @ q
+        out = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), VECTOR_INDEX_BLOCK_ROWS):
+            block = self.embeddings[start:start + VECTOR_INDEX_BLOCK_ROWS]
+            out[start:start + len(block)] = block.astype(np.float32) @ q
+        if self.scales is not None:
+            out *= self.scales
+        return out
+
+    def search(self, query_vector, k: int) -> List[Tuple[int, float]]:
+        """精確 top-k，回傳 [(列索引, 平方歐氏距離), ...]，距離由小到大。"""
+        n = len(self)
+        if n == 0 or k <= 0:
+            return []
+        q = np.asarray(query_vector, dtype=np.float32)
+        # ||x - q||^2 = ||x||^2 + ||q||^2 - 2 x·q，與 Chroma 預設的 l2 距離一致
+        distances = self.sq_norms + float(q @ q) - 2.0 * self.dot(q)
+        k = min(k, n)
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return [(int(i), float(distances[i])) for i in top]
+
+
+class NumpyVectorStore:
+    """提供 rag_service 使用到的 LangChain 向量資料庫介面（相關度分數與 Chroma 的 l2 換算方式相同）。"""
+
+    def __init__(self, index: NumpyChapterIndex, embedding_function):
+        self.index = index
+        self.embedding_function = embedding_function
+
+    def _to_document(self, i: int):
+        from langchain_core.documents import Document
+        data = self.index.document(i)
+        return Document(page_content=data["page_content"], metadata=data.get("metadata") or {})
+
+    def similarity_search_with_relevance_scores(self, query: str, k: int = 4, **kwargs):
+        hits = self.index.search(self.embedding_function.embed_query(query), k)
+        return [(self._to_document(i), 1.0 - distance / np.sqrt(2)) for i, distance in hits]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_relevance_scores(query, k=k)]
+
+
+
+# --- 以已算好的向量檢索與依區塊 id 取回（NumPy 索引的 id 為「np:版本:列號」，Chroma 為「chroma:文件 id」）---
+def similarity_search_by_vector(vector_store, vector, query: str, k: int) -> List[Tuple[object, float, Optional[str]]]:
+    """以已算好的問題向量檢索，回傳 [(Document, 相關度, 區塊 id)]；不支援的向量資料庫改以 query 檢索，id 為 None。"""
+    from langchain_core.documents import Document
+
+    if isinstance(vector_store, NumpyVectorStore):
+        index = vector_store.index
+        return [(vector_store._to_document(i), 1.0 - d / np.sqrt(2), f"np:{index.version}:{i}") for i, d in index.search(vector, k)]
+    collection = getattr(vector_store, "_collection", None)
+    if collection is not None:
+        result = collection.query(query_embeddings=[vector], n_results=k, include=["documents", "metadatas", "distances"])
+        score = vector_store._select_relevance_score_fn()
+        return [
+            (Document(page_content=text, metadata=metadata or {}), score(distance), f"chroma:{id_}")
+            for id_, text, metadata, distance in zip(result["ids"][0], result["documents"][0], result["metadatas"][0], result["distances"][0])
+        ]
+    return [(doc, score, None) for doc, score in vector_store.similarity_search_with_relevance_scores(query, k=k)]
+
+
+def get_chunks(vector_store, refs: List[dict]) -> Optional[List[Tuple[object, float]]]:
+    """依記錄的 [{"id", "score"}] 取回 (Document, 相關度)；索引已重建或換了向量資料庫時回傳 None（需重新檢索）。"""
+    from langchain_core.documents import Document
+
+    if not refs or any(not ref.get("id") for ref in refs):
+        return None
+    if isinstance(vector_store, NumpyVectorStore):
+        docs = []
+        for ref in refs:
+            kind, version, row = (ref["id"].split(":", 2) + ["", ""])[:3]
+            if kind != "np" or version != vector_store.index.version:
+                return None
+            docs.append((vector_store._to_document(int(row)), ref["score"]))
+        return docs
+    collection = getattr(vector_store, "_collection", None)
+    if collection is None or not all(ref["id"].startswith("chroma:") for ref in refs):
+        return None
+    ids = [ref["id"][len("chroma:"):] for ref in refs]
+    result = collection.get(ids=ids, include=["documents", "metadatas"])
+    found = {id_: (text, metadata) for id_, text, metadata in zip(result["ids"], result["documents"], result["metadatas"])}
+    if len(found) != len(ids):
+        return None
+    return [(Document(page_content=found[id_][0], metadata=found[id_][1] or {}), ref["score"]) for id_, ref in zip(ids, refs)]
+
+class IndexCatalog:
+    """行程內已載入的章節索引；每隔 VECTOR_INDEX_RELOAD_CHECK 秒檢查 CURRENT，有新版本時切換。"""
+
+    def __init__(self, index_root: str = VECTOR_INDEX_ROOT, reload_check: float = VECTOR_INDEX_RELOAD_CHECK):
+        self.index_root = index_root
+        self.reload_check = reload_check
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, NumpyChapterIndex] = {}
+        self._checked_at: Dict[str, float] = {}
+
+    def chapters(self) -> List[str]:
+        if not os.path.isdir(self.index_root):
+            return []
+        return sorted(d for d in os.listdir(self.index_root) if read_current_version(d, self.index_root))
+
+    def preload(self, touch: bool = True) -> List[str]:
+        """載入所有已匯出的章節（gunicorn master 在 fork 前呼叫）。"""
+        loaded = []
+        for chapter in self.chapters():
+            index = self.get(chapter, force_check=True)
+            if index is not None:
+                if touch:
+                    index.touch()
+                loaded.append(chapter)
+        return loaded
+
+    def get(self, chapter: str, force_check: bool = False) -> Optional[NumpyChapterIndex]:
+        now = time.monotonic()
+        index = self._indexes.get(chapter)
+        if index is not None and not force_check and now - self._checked_at.get(chapter, 0) < self.reload_check:
+            return index
+        with self._lock:
+            self._checked_at[chapter] = now
+            try:
+                version = read_current_version(chapter, self.index_root)
+                if version is None:
+                    self._indexes.pop(chapter, None)
+                    return None
+                index = self._indexes.get(chapter)
+                if index is None or index.version != version:
+                    if index is not None:
+                        print(f"[vector-index] 行程 {os.getpid()} 重新載入章節 '{chapter}' 索引：{index.version} -> {version}")
+                        metrics.incr("vector_index.reloads")
+                    index = NumpyChapterIndex(chapter, version, os.path.join(self.index_root, chapter, version))
+                    self._indexes[chapter] = index
+            except (OSError, ValueError) as e:
+                print(f"[vector-index] 無法載入章節 '{chapter}' 索引: {e}")
+                metrics.incr("vector_index.load_failures")
+                return self._indexes.get(chapter)  # 沿用舊版本
+            return index
+
+    def status(self) -> dict:
+        with self._lock:
+            indexes = list(self._indexes.values())
+        return {
+            "backend": VECTOR_BACKEND,
+            "pid": os.getpid(),
+            "index_root": self.index_root,
+            "chapters": [
+                {"chapter": ix.chapter, "version": ix.version, "vectors": len(ix), "dtype": ix.dtype, "bytes": ix.nbytes}
+                for ix in sorted(indexes, key=lambda ix: ix.chapter)
+            ],
+        }
+
+
+# --- 匯出 ---
+def quantize(matrix: np.ndarray, dtype: str):
+    """回傳 (儲存用矩陣, int8 縮放係數或 None, 還原後向量的平方長度)。"""
+    if dtype == "float32":
+        stored, scales, restored = matrix, None, matrix
+    elif dtype == "float16":
+        stored, scales = matrix.astype(np.float16), None
+        restored = stored.astype(np.float32)
+    elif dtype == "int8":
+        # 對稱量化：每個向量以自己的最大絕對值對應到 127
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        stored = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        scales = scales.astype(np.float32)
+        restored = stored.astype(np.float32) * scales[:, None]
+    else:
+        raise ValueError(f"不支援的向量精度: {dtype}（可用：{', '.join(DTYPES)}）")
+    return np.ascontiguousarray(stored), scales, np.einsum("ij,ij->i", restored, restored)
+
+
+def write_index(
+    chapter: str, embeddings, documents: List[dict], index_root: str = VECTOR_INDEX_ROOT,
+    source: str = "", dtype: str = VECTOR_INDEX_DTYPE,
+) -> dict:
+    """寫入新版本的章節索引並原子地切換 CURRENT；documents 為 {"page_content", "metadata"} 列表。"""
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim != 2 or matrix.shape[0] != len(documents) or matrix.shape[0] == 0:
+        raise ValueError(f"章節 '{chapter}' 的向量與文件數量不一致或為空")
+    stored, scales, sq_norms = quantize(matrix, dtype)
+
+    chapter_dir = _chapter_dir(chapter, index_root)
+    os.makedirs(chapter_dir, exist_ok=True)
+    version = f"v{time.time_ns()}"
+    tmp_dir = os.path.join(chapter_dir, f".tmp-{version}")
+    os.makedirs(tmp_dir)
+
+    np.save(os.path.join(tmp_dir, "embeddings.npy"), stored)
+    np.save(os.path.join(tmp_dir, "sq_norms.npy"), sq_norms)
+    if scales is not None:
+        np.save(os.path.join(tmp_dir, "scales.npy"), scales)
+    offsets = [0]
+    with open(os.path.join(tmp_dir, "documents.jsonl"), "wb") as f:
+        for doc in documents:
+            line = (json.dumps({"page_content": doc["page_content"], "metadata": doc.get("metadata") or {}}, ensure_ascii=False) + "\n").encode("utf-8")
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    np.save(os.path.join(tmp_dir, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    manifest = {
+        "chapter": chapter, "version": version, "vectors": matrix.shape[0], "dim": matrix.shape[1],
+        "dtype": dtype, "source": source, "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    os.rename(tmp_dir, os.path.join(chapter_dir, version))
+    current_tmp = os.path.join(chapter_dir, f".{CURRENT_FILE}.tmp")
+    with open(current_tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(current_tmp, os.path.join(chapter_dir, CURRENT_FILE))
+    _prune_versions(chapter_dir, keep=VECTOR_INDEX_KEEP_VERSIONS, current=version)
+    return manifest
+
+
+def _prune_versions(chapter_dir: str, keep: int, current: str):
+    versions = sorted((d for d in os.listdir(chapter_dir) if d.startswith("v") and d != current), reverse=True)
+    for old in versions[keep:]:
+        # Windows 上仍被 memory-map 的檔案無法刪除，下次匯出時再試
+        shutil.rmtree(os.path.join(chapter_dir, old), ignore_errors=True)
+
+
+# 依路徑共用 System 的私有屬性 SharedSystemClient._identifer_to_system 只在這些版本確認過
+CHROMA_SHARED_SYSTEM_VERSIONS = ("0.4.",)
+
+
+def _stop_chroma_system(db_path: str, system):
+    try:
+        system.stop()
+    except Exception as e:
+        print(f"[vector-index] 關閉 '{db_path}' 的 Chroma 失敗: {e}")
+
+
+def release_chroma(db_path: str, holder=None):
+    """
+    chromadb 在行程內依路徑共用已開啟的 SQLite 連線與 HNSW 索引；資料夾被替換後必須移除，
+    下次以相同路徑開啟才會讀到新的資料，移除的 System 也要停止才會釋放連線與索引。
+    holder 為進行中的請求可能仍在使用的物件（例如快取的 Chroma）：它被回收後才停止；未指定時立即停止。
+    """
+    try:
+        import chromadb
+        from chromadb.api.client import SharedSystemClient
+    except ImportError:
+        return
+    if not chromadb.__version__.startswith(CHROMA_SHARED_SYSTEM_VERSIONS) or not hasattr(SharedSystemClient, "_identifer_to_system"):
+        raise RuntimeError(f"release_chroma 未支援 chromadb {chromadb.__version__}（依賴 SharedSystemClient 的私有屬性），請更新此函式")
+    system = SharedSystemClient._identifer_to_system.pop(db_path, None)
+    if system is None:
+        return
+    if holder is None:
+        _stop_chroma_system(db_path, system)
+    else:
+        weakref.finalize(holder, _stop_chroma_system, db_path, system)
+
+
+def export_chapter(
+    chapter: str, chroma_root: str = CHROMA_ROOT, index_root: str = VECTOR_INDEX_ROOT, dtype: str = VECTOR_INDEX_DTYPE,
+) -> dict:
+    """將 chroma_db/<章節> 的向量與文件匯出為 NumPy 索引。"""
+    import chromadb
+
+    db_path = os.path.join(chroma_root, chapter)
+    if not os.path.isdir(db_path):
+        raise FileNotFoundError(f"找不到章節 '{chapter}' 的知識庫")
+    try:
+        client = chromadb.PersistentClient(path=db_path)
+        data = client.get_collection(CHROMA_COLLECTION).get(include=["embeddings", "documents", "metadatas"])
+    finally:
+        # 同一行程之後重新匯出（index_documents.py --watch）時必須讀到替換後的資料夾
+        release_chroma(db_path)
+    documents = [
+        {"page_content": text or "", "metadata": metadata or {}}
+        for text, metadata in zip(data["documents"], data["metadatas"])
+    ]
+    return write_index(chapter, data["embeddings"], documents, index_root=index_root, source=db_path, dtype=dtype)
+
+
+# 全域共用的索引目錄（gunicorn master 預先載入後由 worker 繼承）
+catalog = IndexCatalog()
+
+
+def select_index(chapter: str) -> Optional[NumpyChapterIndex]:
+    """依 VECTOR_BACKEND 決定章節是否使用 NumPy 索引；回傳 None 表示改用 Chroma。"""
+    if VECTOR_BACKEND == "chroma":
+        return None
+    index = catalog.get(chapter)
+    if index is None:
+        return None
+    if VECTOR_BACKEND == "auto" and len(index) > VECTOR_INDEX_AUTO_MAX_VECTORS:
+        return None
+    return index
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="將 chroma_db/<章節> 匯出為 NumPy 索引")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("chapters", nargs="*", help="預設為 chroma_db 下的所有章節")
+    parser.add_argument("--dtype", choices=DTYPES, default=VECTOR_INDEX_DTYPE)
+    args = parser.parse_args()
+    targets = args.chapters or sorted(
+        d for d in os.listdir(CHROMA_ROOT) if os.path.isdir(os.path.join(CHROMA_ROOT, d))
+    )
+    for name in targets:
+        result = export_chapter(name, dtype=args.dtype)
+        print(f"章節 '{name}' 已匯出：{result['vectors']} 個向量 ({result['dim']} 維, {result['dtype']})，版本 {result['version']}")